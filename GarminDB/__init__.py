@@ -6,9 +6,18 @@ __license__ = "GPL"
 
 # flake8: noqa
 
-from GarminDB.garmin_db import GarminDB, Attributes, Device, DeviceInfo, File, Weight, Stress, Sleep, SleepEvents, RestingHeartRate, DailySummary
-from GarminDB.monitoring_db import MonitoringDB, MonitoringInfo, MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, Monitoring, \
-    MonitoringRespirationRate, MonitoringPulseOx
-from GarminDB.activities_db import ActivitiesDB, ActivitiesLocationSegment, Activities, ActivityLaps, ActivityRecords, SportActivities, StepsActivities, \
+from GarminDB.aggregate_stats import AggregateStat, AggregateStatsObject, get_daily_stats_for_tables
+from GarminDB.hourly_rollup import HourlyRollupBase, HourlyRollupStateBase, HourlyRollupObject
+from GarminDB.time_series import TimeSeries
+from GarminDB.secondary_indexes import SecondaryIndexesObject
+from GarminDB.epoch_timestamps import EpochTimestamps, EpochDateTime, EpochTime, EpochTimestampsObject
+from GarminDB.delta_varint_codec import DeltaVarintCodec
+from GarminDB.garmin_db import GarminDB, Attributes, Device, DeviceInfo, File, Weight, HourlyRollupState, StressHourly, Stress, Sleep, SleepEvents, \
+    RestingHeartRate, DailySummary
+from GarminDB.monitoring_db import MonitoringDB, MonitoringInfo, MonitoringHourlyRollupState, MonitoringHeartRateHourly, MonitoringHeartRate, MonitoringIntensity, \
+    MonitoringClimb, Monitoring, MonitoringRespirationRateHourly, MonitoringRespirationRate, MonitoringPulseOxHourly, MonitoringPulseOx
+from GarminDB.monitoring_years import MonitoringUnionDB, MonitoringYears
+from GarminDB.activities_db import ActivitiesDB, ActivitiesLocationSegment, Activities, ActivityLaps, ActivityRecords, ActivityRecordStreams, SportActivities, StepsActivities, \
     PaddleActivities, CycleActivities, EllipticalActivities
-from GarminDB.garmin_summary_db import GarminSummaryDB, Summary, YearsSummary, MonthsSummary, WeeksSummary, DaysSummary, IntensityHR
+from GarminDB.garmin_summary_db import GarminSummaryDB, Summary, YearsSummary, MonthsSummary, WeeksSummary, DaysSummary, IntensityHR, DirtyDays, \
+    DirtyDaysTracker
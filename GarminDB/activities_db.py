@@ -6,13 +6,18 @@ __license__ = "GPL"
 
 import logging
 import datetime
-from sqlalchemy import Column, String, Float, Integer, DateTime, Time, ForeignKey, PrimaryKeyConstraint, desc, exists, literal_column
+import numpy as np
+from sqlalchemy import Column, String, Float, Integer, DateTime, Time, LargeBinary, ForeignKey, PrimaryKeyConstraint, Index, desc, exists, literal_column, func
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 
 import HealthDB
 import utilities
+from GarminDB.aggregate_stats import AggregateStat, AggregateStatsObject
+from GarminDB.secondary_indexes import SecondaryIndexesObject
+from GarminDB.epoch_timestamps import EpochTimestamps, EpochDateTime, EpochTimestampsObject
+from GarminDB.delta_varint_codec import DeltaVarintCodec
 
 
 logger = logging.getLogger(__name__)
@@ -30,6 +35,11 @@ class ActivitiesDB(utilities.DB):
     class _DbVersion(Base, utilities.DbVersionObject):
         """Stores version information for this database and it's tables."""
 
+    def __init__(self, db_params, debug_level=0):
+        """Return an instance of the database with its timestamps stored as configured in db_params."""
+        EpochTimestamps.configure(db_params)
+        super().__init__(db_params, debug_level)
+
 
 class ActivitiesLocationSegment(utilities.DBObject):
     """Object representing a databse object for storing location segnment from an activity."""
@@ -61,7 +71,7 @@ class ActivitiesLocationSegment(utilities.DBObject):
         self.stop_long = stop_location.long_deg
 
 
-class Activities(ActivitiesDB.Base, ActivitiesLocationSegment):
+class Activities(ActivitiesDB.Base, SecondaryIndexesObject, ActivitiesLocationSegment, AggregateStatsObject):
     """Class represents a databse table that contains data about recorded activities."""
 
     __tablename__ = 'activities'
@@ -112,6 +122,13 @@ class Activities(ActivitiesDB.Base, ActivitiesLocationSegment):
     training_effect = Column(Float)
     anaerobic_training_effect = Column(Float)
 
+    __table_args__ = (
+        # stats and the sport and course views filter and order by these
+        Index('ix_activities_start_time', 'start_time'),
+        Index('ix_activities_course_id', 'course_id'),
+        Index('ix_activities_sport', 'sport'),
+    )
+
     def is_steps_activity(self):
         """Return if the activity is a steps based activity."""
         return self.sport in ['walking', 'running', 'hiking']
@@ -134,15 +151,25 @@ class Activities(ActivitiesDB.Base, ActivitiesLocationSegment):
         with db.managed_session() as session:
             return session.query(cls).filter(cls.course_id == course_id).order_by(cls.avg_speed).limit(1).one_or_none()
 
+    @classmethod
+    def _stats_spec(cls):
+        return {
+            'activities'            : AggregateStat.count(),
+            'activities_calories'   : AggregateStat.sum(cls.calories),
+            'activities_distance'   : AggregateStat.sum(cls.distance),
+        }
+
     @classmethod
     def get_stats(cls, session, start_ts, end_ts):
         """Return a dict of stats for the time range."""
-        stats = {
-            'activities'            : cls.s_row_count_for_period(session, start_ts, end_ts),
-            'activities_calories'   : cls.s_get_col_sum(session, cls.calories, start_ts, end_ts),
-            'activities_distance'   : cls.s_get_col_sum(session, cls.distance, start_ts, end_ts),
-        }
-        return stats
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
+
+    @classmethod
+    def get_sport_stats(cls, db):
+        """Return a dict, keyed by sport, of the number of activities and total distance for each sport with activities."""
+        with db.managed_session() as session:
+            query = session.query(cls.sport, func.count(cls.activity_id), func.sum(cls.distance)).filter(cls.sport != None).group_by(cls.sport)  # noqa
+            return {sport: (records, total_distance) for sport, records, total_distance in query.all()}
 
 
 class ActivityLaps(ActivitiesDB.Base, ActivitiesLocationSegment):
@@ -208,7 +235,7 @@ class ActivityLaps(ActivitiesDB.Base, ActivitiesLocationSegment):
         self.start_long = start_location.long_deg
 
 
-class ActivityRecords(ActivitiesDB.Base, utilities.DBObject):
+class ActivityRecords(ActivitiesDB.Base, EpochTimestampsObject, SecondaryIndexesObject, utilities.DBObject):
     """Encapsilates record for a single point in time from an activity."""
 
     __tablename__ = 'activity_records'
@@ -218,7 +245,7 @@ class ActivityRecords(ActivitiesDB.Base, utilities.DBObject):
 
     activity_id = Column(String, ForeignKey('activities.activity_id'))
     record = Column(Integer)
-    timestamp = Column(DateTime)
+    timestamp = Column(EpochDateTime)
     position_lat = Column(Float)    # degrees
     position_long = Column(Float)   # degrees
     distance = Column(Float)
@@ -232,6 +259,8 @@ class ActivityRecords(ActivitiesDB.Base, utilities.DBObject):
 
     __table_args__ = (
         PrimaryKeyConstraint("activity_id", "record"),
+        # records of an activity by time range, for instance a lap's records
+        Index('ix_activity_records_activity_id_timestamp', 'activity_id', 'timestamp'),
     )
 
     @classmethod
@@ -241,8 +270,11 @@ class ActivityRecords(ActivitiesDB.Base, utilities.DBObject):
 
     @classmethod
     def s_get_activity(cls, session, activity_id):
-        """Return all records for a given activity_id."""
-        return session.query(cls).filter(cls.activity_id == activity_id).all()
+        """Return all records for a given activity_id, decoded from the activity's record streams if it was stored that way."""
+        records = session.query(cls).filter(cls.activity_id == activity_id).all()
+        if not records:
+            records = ActivityRecordStreams.s_get_records(session, activity_id)
+        return records
 
     @hybrid_property
     def position(self):
@@ -255,6 +287,116 @@ class ActivityRecords(ActivitiesDB.Base, utilities.DBObject):
         self.position_long = location.long_deg
 
 
+class ActivityRecordStreams(ActivitiesDB.Base, utilities.DBObject):
+    """
+    The records of an activity stored as one row with an encoded array per record field.
+
+    An alternative to a row per record in activity_records that is a fraction of the size. The arrays are encoded with
+    DeltaVarintCodec and keep the number of decimal places in stream_decimals, about the resolution of the sensors. The
+    arrays can only be decoded in Python, with s_get_arrays and s_get_records, so there is no view with a row per record.
+    Other tools can read the decoded records from the activity_record_streams partitions of the Parquet export.
+    """
+
+    __tablename__ = 'activity_record_streams'
+
+    db = ActivitiesDB
+    table_version = 1
+    # version 1 had a view that needed an SQL function registered by GarminDB, version 2 drops it
+    view_version = 2
+
+    # The record fields stored as arrays and the number of decimal places that are kept. Timestamps are stored as epoch seconds.
+    stream_decimals = {
+        'timestamp'         : 0,
+        'position_lat'      : 7,    # about 1 cm
+        'position_long'     : 7,
+        'distance'          : 5,    # about 1 cm
+        'cadence'           : 0,
+        'altitude'          : 2,
+        'hr'                : 0,
+        'rr'                : 2,
+        'speed'             : 3,
+        'temperature'       : 1,
+    }
+
+    activity_id = Column(String, ForeignKey('activities.activity_id'), primary_key=True)
+    records = Column(Integer, nullable=False)
+    timestamp = Column(LargeBinary)
+    position_lat = Column(LargeBinary)
+    position_long = Column(LargeBinary)
+    distance = Column(LargeBinary)
+    cadence = Column(LargeBinary)
+    altitude = Column(LargeBinary)
+    hr = Column(LargeBinary)
+    rr = Column(LargeBinary)
+    speed = Column(LargeBinary)
+    temperature = Column(LargeBinary)
+
+    @classmethod
+    def s_insert_or_replace(cls, session, activity_id, records, compress=True):
+        """
+        Store the records of an activity, replacing the activity's stored records if there are any.
+
+        Parameters:
+        ----------
+        session (Session): a session on the activities database
+        activity_id (string): the id of the activity the records are from
+        records (list): record dicts with ActivityRecords' fields, ordered by record number
+        compress (Boolean): zlib compress the arrays
+
+        """
+        values = {'activity_id': activity_id, 'records': len(records)}
+        for field, decimals in cls.stream_decimals.items():
+            field_values = [record.get(field) for record in records]
+            if field == 'timestamp':
+                field_values = [EpochTimestamps.to_secs(value) if value is not None else None for value in field_values]
+            # fields without any values, like rr from most devices, don't take up any space
+            if any(value is not None for value in field_values):
+                values[field] = DeltaVarintCodec.encode(field_values, decimals, compress)
+            else:
+                values[field] = None
+        session.merge(cls(**values))
+
+    @classmethod
+    def s_get_arrays(cls, session, activity_id):
+        """Return a dict of NumPy arrays of the record fields, with NaN for missing values, or None if the activity has no streams."""
+        streams = session.query(cls).filter(cls.activity_id == activity_id).one_or_none()
+        if streams is None:
+            return None
+        arrays = {'record': np.arange(streams.records)}
+        for field in cls.stream_decimals:
+            data = getattr(streams, field)
+            arrays[field] = DeltaVarintCodec.decode(data) if data is not None else np.full(streams.records, np.nan)
+        arrays['timestamp'] = arrays['timestamp'].astype('datetime64[s]')
+        return arrays
+
+    @classmethod
+    def __record_value(cls, field, value):
+        if np.isnan(value):
+            return None
+        if field == 'timestamp':
+            return EpochTimestamps.from_secs(int(value))
+        if isinstance(ActivityRecords.__table__.columns[field].type, Integer):
+            return int(value)
+        return float(value)
+
+    @classmethod
+    def s_get_records(cls, session, activity_id):
+        """Return the records of an activity as ActivityRecords instances that aren't part of the session."""
+        arrays = cls.s_get_arrays(session, activity_id)
+        if arrays is None:
+            return []
+        arrays['timestamp'] = arrays['timestamp'].astype(np.float64)
+        return [
+            ActivityRecords(activity_id=activity_id, record=record, **{field: cls.__record_value(field, arrays[field][record]) for field in cls.stream_decimals})
+            for record in arrays['record']
+        ]
+
+    @classmethod
+    def get_records_count(cls, db):
+        """Return the number of records stored as streams."""
+        return cls.get_col_sum(db, cls.records) or 0
+
+
 class SportActivities(utilities.DBObject):
     """Base class for all sport based activity tables."""
 
@@ -0,0 +1,298 @@
+"""Declarative specifications of aggregate statistics that are computed with a single query."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+import datetime
+import logging
+from sqlalchemy import func, case, and_, literal, literal_column, distinct, select, extract
+
+from GarminDB.epoch_timestamps import EpochTimestamps
+
+
+logger = logging.getLogger(__name__)
+
+
+class AggregateStat(object):
+    """An aggregate function applied to a table column over a time period."""
+
+    def __init__(self, stat_func, col=None, ignore_le_zero=False, time_col=False, where=None, of_max_per_day=False):
+        """
+        Return an AggregateStat instance.
+
+        Parameters:
+        ----------
+        stat_func (sqlalchemy func): the SQL aggregate function: func.avg, func.min, func.max, func.sum, or func.count
+        col (Column): the column to aggregate, None for counting rows
+        ignore_le_zero (Boolean): ignore values less than or equal to zero
+        time_col (Boolean): the column holds a time of day that is aggregated as seconds and returned as a datetime.time
+        where (expression): only aggregate rows that match the expression
+        of_max_per_day (Boolean): aggregate the maximum value from each day instead of the individual values
+
+        """
+        self.stat_func = stat_func
+        self.col = col
+        self.ignore_le_zero = ignore_le_zero
+        self.time_col = time_col
+        self.where = where
+        self.of_max_per_day = of_max_per_day
+
+    @classmethod
+    def avg(cls, col, ignore_le_zero=False, where=None):
+        """Return a spec for the average value of a column."""
+        return cls(func.avg, col, ignore_le_zero, where=where)
+
+    @classmethod
+    def min(cls, col, ignore_le_zero=False, where=None):
+        """Return a spec for the minimum value of a column."""
+        return cls(func.min, col, ignore_le_zero, where=where)
+
+    @classmethod
+    def max(cls, col, ignore_le_zero=False, where=None):
+        """Return a spec for the maximum value of a column."""
+        return cls(func.max, col, ignore_le_zero, where=where)
+
+    @classmethod
+    def sum(cls, col, ignore_le_zero=False, where=None):
+        """Return a spec for the sum of a column."""
+        return cls(func.sum, col, ignore_le_zero, where=where)
+
+    @classmethod
+    def count(cls, where=None):
+        """Return a spec for the number of rows."""
+        return cls(func.count, where=where)
+
+    @classmethod
+    def time_avg(cls, col, where=None):
+        """Return a spec for the average of a time column."""
+        return cls(func.avg, col, time_col=True, where=where)
+
+    @classmethod
+    def time_min(cls, col, where=None):
+        """Return a spec for the minimum of a time column."""
+        return cls(func.min, col, time_col=True, where=where)
+
+    @classmethod
+    def time_max(cls, col, where=None):
+        """Return a spec for the maximum of a time column."""
+        return cls(func.max, col, time_col=True, where=where)
+
+    @classmethod
+    def time_sum(cls, col, where=None):
+        """Return a spec for the sum of a time column."""
+        return cls(func.sum, col, time_col=True, where=where)
+
+    @classmethod
+    def sum_of_max_per_day(cls, col, where=None):
+        """Return a spec for the sum of the per day maximums of a column."""
+        return cls(func.sum, col, where=where, of_max_per_day=True)
+
+    @classmethod
+    def avg_of_max_per_day(cls, col, where=None):
+        """Return a spec for the average of the per day maximums of a column."""
+        return cls(func.avg, col, where=where, of_max_per_day=True)
+
+    def value_expression(self, table):
+        """Return the expression for the values to be aggregated with rows that should be ignored mapped to NULL."""
+        if self.col is None:
+            value = literal_column('1')
+            conditions = []
+        elif self.time_col:
+            value = table._secs_from_time(self.col)
+            conditions = [value > 0]
+        else:
+            value = self.col
+            conditions = [self.col > 0] if self.ignore_le_zero else []
+        if self.where is not None:
+            conditions.append(self.where)
+        if conditions:
+            return case([(and_(*conditions), value)])
+        return value
+
+    def aggregate_expression(self, table, value):
+        """Return the aggregate expression for the given value expression."""
+        if self.time_col:
+            return table._time_from_secs(self.stat_func(value))
+        return self.stat_func(value)
+
+    def daily_expression(self, table):
+        """Return the aggregate expression for the stat's value for a single day when grouping by day."""
+        # Aggregating the single maximum for a day is just the day's maximum.
+        if self.of_max_per_day:
+            return func.max(self.value_expression(table))
+        return self.aggregate_expression(table, self.value_expression(table))
+
+    def result(self, value):
+        """Convert a query result to the returned stat value."""
+        if self.col is None:
+            return value if value is not None else 0
+        if self.time_col:
+            return datetime.datetime.strptime(value, '%H:%M:%S').time() if value is not None else datetime.time.min
+        return value
+
+
+class AggregateStatsObject(object):
+    """
+    Mixin for database objects that compute a set of aggregate statistics over a time period with a single query.
+
+    Tables that use get_daily_stats_for_period define a _stats_spec classmethod that returns their dict of AggregateStat instances.
+    """
+
+    @classmethod
+    def s_get_aggregate_stats(cls, session, spec, start_ts, end_ts):
+        """Return a dict of stats for the time period given a dict of stat names to AggregateStat instances."""
+        stats = {}
+        per_row_spec = {name: stat for name, stat in spec.items() if not stat.of_max_per_day}
+        if per_row_spec:
+            query = session.query(*[stat.aggregate_expression(cls, stat.value_expression(cls)).label(name) for name, stat in per_row_spec.items()])
+            row = query.filter(cls.time_col >= start_ts).filter(cls.time_col < end_ts).one()
+            stats.update({name: stat.result(getattr(row, name)) for name, stat in per_row_spec.items()})
+        per_day_spec = {name: stat for name, stat in spec.items() if stat.of_max_per_day}
+        if per_day_spec:
+            daily_maxes = session.query(*[func.max(stat.value_expression(cls)).label(name) for name, stat in per_day_spec.items()])
+            daily_maxes = daily_maxes.filter(cls.time_col >= start_ts).filter(cls.time_col < end_ts).group_by(func.date(EpochTimestamps.sql_datetime(cls.time_col))).subquery()
+            row = session.query(*[stat.aggregate_expression(cls, daily_maxes.columns[name]).label(name) for name, stat in per_day_spec.items()]).one()
+            stats.update({name: stat.result(getattr(row, name)) for name, stat in per_day_spec.items()})
+        return stats
+
+    @classmethod
+    def _s_aggregates_by_day_query(cls, session, spec, start_ts, end_ts):
+        """
+        Return a (query, to_aggregates) tuple for the stats of each day with data in the time period.
+
+        The query is a select of a 'day' column and the aggregate columns grouped by day, to_aggregates returns the dict of
+        stats given a mapping of the names of the aggregate columns to a row's values.
+        """
+        day_col = func.date(EpochTimestamps.sql_datetime(cls.time_col))
+        columns = [stat.daily_expression(cls).label(name) for name, stat in spec.items()]
+        query = select([day_col.label('day')] + columns).where(cls.time_col >= start_ts).where(cls.time_col < end_ts).group_by(day_col)
+        return (query, lambda values: {name: stat.result(values[name]) for name, stat in spec.items()})
+
+    @classmethod
+    def s_get_aggregate_stats_by_day(cls, session, spec, start_ts, end_ts):
+        """Return a dict, keyed by day, of dicts of stats for each day in the time period with a single GROUP BY day query."""
+        (query, to_aggregates) = cls._s_aggregates_by_day_query(session, spec, start_ts, end_ts)
+        return {cls._day_from_row(row.day): to_aggregates(row) for row in session.execute(query)}
+
+    @classmethod
+    def _day_from_row(cls, day):
+        # SQLite returns date() results as strings
+        return datetime.datetime.strptime(day, '%Y-%m-%d').date() if isinstance(day, str) else day
+
+    @classmethod
+    def __days_subquery(cls, session):
+        return session.query(func.date(EpochTimestamps.sql_datetime(cls.time_col)).label('day')).distinct().subquery()
+
+    @classmethod
+    def s_get_time_span(cls, session):
+        """Return a (first, last) tuple of the earliest and latest time column values in the table, (None, None) if it's empty."""
+        return tuple(session.query(func.min(cls.time_col), func.max(cls.time_col)).one())
+
+    @classmethod
+    def __day_number(cls, session, day):
+        # consecutive days have consecutive numbers
+        if session.get_bind().dialect.name == 'sqlite':
+            return func.julianday(day)
+        return func.to_days(day)
+
+    @classmethod
+    def s_get_coverage_by_year(cls, session):
+        """Return a list of rows with the number of days, the span in days, and the months with data for each year with data."""
+        day = cls.__days_subquery(session).c.day
+        year = extract('year', day)
+        query = session.query(
+            year.label('year'),
+            func.count(day).label('days'),
+            (cls.__day_number(session, func.max(day)) - cls.__day_number(session, func.min(day)) + 1).label('span'),
+            func.group_concat(distinct(extract('month', day))).label('months')
+        )
+        return [
+            (int(row.year), row.days, int(row.span), sorted(int(month) for month in row.months.split(',')))
+            for row in query.group_by(year).order_by(year).all()
+        ]
+
+    @classmethod
+    def s_get_day_gaps(cls, session):
+        """Return a list of (last day, next day) tuples for the gaps in days with data within each year."""
+        day = cls.__days_subquery(session).c.day
+        previous_day = func.lag(day).over(partition_by=extract('year', day), order_by=day)
+        days = session.query(previous_day.label('previous_day'), day.label('day')).subquery()
+        query = session.query(days.c.previous_day, days.c.day).filter(cls.__day_number(session, days.c.day) - cls.__day_number(session, days.c.previous_day) > 1)
+        return [(cls._day_from_row(row.previous_day), cls._day_from_row(row.day)) for row in query.order_by(days.c.day).all()]
+
+    @classmethod
+    def _stats_from_aggregates(cls, aggregates, *args):
+        """Return the table's stats derived from the aggregate values computed from its stats spec."""
+        return aggregates
+
+    @classmethod
+    def get_daily_stats_for_period(cls, session, start_ts, end_ts, *args, days=None):
+        """
+        Return a dict, keyed by day, of stats dicts for each day in the time period.
+
+        Parameters:
+        ----------
+        session (Session): the session for the table's database
+        start_ts (datetime): the start of the time period
+        end_ts (datetime): the end of the time period
+        args: any additional arguments the table's stats spec needs
+        days (list): return stats for these days, including days without data, instead of only the days with data
+
+        """
+        spec = cls._stats_spec(*args)
+        return cls._daily_stats(spec, cls.s_get_aggregate_stats_by_day(session, spec, start_ts, end_ts), days, *args)
+
+    @classmethod
+    def _daily_stats(cls, spec, aggregates_by_day, days, *args):
+        daily_stats = {}
+        for day in (days if days is not None else aggregates_by_day.keys()):
+            aggregates = aggregates_by_day.get(day)
+            if aggregates is None:
+                aggregates = {name: stat.result(None) for name, stat in spec.items()}
+            stats = cls._stats_from_aggregates(aggregates, *args)
+            stats['day'] = day
+            daily_stats[day] = stats
+        return daily_stats
+
+
+def get_daily_stats_for_tables(attached, tables, start_ts, end_ts, days):
+    """
+    Return a list, in the order of the tables, of dicts keyed by day of the stats dicts of each of the days, with one statement.
+
+    The tables' GROUP BY day queries are joined on day in a single statement over the attached databases, so the daily stats
+    of tables from different databases are computed by SQLite without a query per table.
+
+    Parameters:
+    ----------
+    attached (AttachedDatabases): a session on the databases of the tables
+    tables (list): tuples of a table, a session for the table's own database, and any additional arguments the table's stats spec needs
+    start_ts (date): the start of the time period
+    end_ts (date): the end of the time period
+    days (list): return stats for these days, including days without data
+
+    """
+    # every day of the time period, the tables' queries are left joined to it
+    all_days = select([func.date(literal(str(start_ts))).label('day')]).cte('all_days', recursive=True)
+    all_days = all_days.union_all(select([func.date(all_days.c.day, '+1 day')]).where(all_days.c.day < func.date(literal(str(end_ts)), '-1 day')))
+    subqueries = []
+    columns = [all_days.c.day]
+    from_clause = all_days
+    for index, (table, session, *args) in enumerate(tables):
+        spec = table._stats_spec(*args)
+        (query, to_aggregates) = table._s_aggregates_by_day_query(session, spec, start_ts, end_ts)
+        subquery = attached.adapt(query).alias(f'stats_{index}')
+        subqueries.append((subquery, spec, to_aggregates))
+        columns += [column.label(f'{subquery.name}_{column.name}') for column in subquery.columns]
+        from_clause = from_clause.outerjoin(subquery, subquery.c.day == all_days.c.day)
+    aggregates_by_day = [{} for _ in tables]
+    for row in attached.session.execute(select(columns).select_from(from_clause)):
+        for (subquery, spec, to_aggregates), table_aggregates in zip(subqueries, aggregates_by_day):
+            if row[f'{subquery.name}_day'] is not None:
+                values = {column.name: row[f'{subquery.name}_{column.name}'] for column in subquery.columns}
+                table_aggregates[AggregateStatsObject._day_from_row(row.day)] = to_aggregates(values)
+    return [
+        table._daily_stats(spec, table_aggregates, days, *args)
+        for (table, session, *args), (subquery, spec, to_aggregates), table_aggregates in zip(tables, subqueries, aggregates_by_day)
+    ]
@@ -0,0 +1,104 @@
+"""Compact encoding of numeric arrays as varints of the deltas between successive values."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+import logging
+import zlib
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaVarintCodec(object):
+    """
+    Encodes arrays of numbers, with missing values, as zigzag varints of the deltas between successive values.
+
+    Values are stored as integers after scaling by 10 ** decimals, so slowly changing series, like sensor readings, encode to
+    one or two bytes per value. The encoding is: a flags byte, then optionally zlib compressed, a varint count of values, a
+    varint number of decimals, a bitmap of the values that are present, and the varints of the present values.
+    """
+
+    compressed_flag = 0x01
+    max_varint_bytes = 10
+
+    @classmethod
+    def __varint_bytes(cls, values):
+        # Split each value into 7 bit groups, least significant first, with the high bit set on all but the last group.
+        groups = np.array([(values >> np.uint64(7 * group)) & np.uint64(0x7f) for group in range(cls.max_varint_bytes)], dtype=np.uint8).T
+        lengths = 1 + sum(((values >> np.uint64(7 * group)) != 0).astype(int) for group in range(1, cls.max_varint_bytes))
+        group_numbers = np.arange(cls.max_varint_bytes)
+        groups |= np.where(group_numbers < (lengths - 1)[:, np.newaxis], 0x80, 0).astype(np.uint8)
+        return groups[group_numbers < lengths[:, np.newaxis]].tobytes()
+
+    @classmethod
+    def __varints(cls, data):
+        data = np.frombuffer(data, dtype=np.uint8)
+        if not len(data):
+            return np.zeros(0, dtype=np.uint64)
+        ends = (data & 0x80) == 0
+        value_index = np.concatenate(([0], np.cumsum(ends)[:-1]))
+        starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+        shifts = (7 * (np.arange(len(data)) - starts[value_index])).astype(np.uint64)
+        values = np.zeros(len(starts), dtype=np.uint64)
+        np.bitwise_or.at(values, value_index, (data & 0x7f).astype(np.uint64) << shifts)
+        return values
+
+    @classmethod
+    def __read_varint(cls, data, offset):
+        value = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return (value, offset)
+
+    @classmethod
+    def encode(cls, values, decimals=0, compress=True):
+        """
+        Return the encoding of an array of numbers.
+
+        Parameters:
+        ----------
+        values (list or ndarray): the values, None or NaN for missing values
+        decimals (int): the number of decimal places that are kept
+        compress (Boolean): zlib compress the encoded values
+
+        """
+        values = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        present = ~np.isnan(values)
+        scaled = np.round(values[present] * 10 ** decimals).astype(np.int64)
+        deltas = np.diff(scaled, prepend=np.int64(0))
+        zigzags = ((deltas << np.int64(1)) ^ (deltas >> np.int64(63))).astype(np.uint64)
+        header = np.array([len(values), decimals], dtype=np.uint64)
+        payload = cls.__varint_bytes(header) + np.packbits(present).tobytes() + cls.__varint_bytes(zigzags)
+        if compress:
+            return bytes([cls.compressed_flag]) + zlib.compress(payload)
+        return bytes([0]) + payload
+
+    @classmethod
+    def decode_with_decimals(cls, data):
+        """Return a (values, decimals) tuple for an encoded array, values is a float array with NaN for missing values."""
+        payload = data[1:]
+        if data[0] & cls.compressed_flag:
+            payload = zlib.decompress(payload)
+        (count, offset) = cls.__read_varint(payload, 0)
+        (decimals, offset) = cls.__read_varint(payload, offset)
+        bitmap_bytes = (count + 7) // 8
+        present = np.unpackbits(np.frombuffer(payload, dtype=np.uint8, count=bitmap_bytes, offset=offset), count=count).astype(bool)
+        zigzags = cls.__varints(payload[offset + bitmap_bytes:])
+        deltas = (zigzags >> np.uint64(1)).astype(np.int64) ^ -(zigzags & np.uint64(1)).astype(np.int64)
+        values = np.full(count, np.nan)
+        values[present] = np.cumsum(deltas) / 10 ** decimals
+        return (values, decimals)
+
+    @classmethod
+    def decode(cls, data):
+        """Return the float array, with NaN for missing values, for an encoded array."""
+        return cls.decode_with_decimals(data)[0]
@@ -0,0 +1,249 @@
+"""Optional storage of timestamps as integer seconds since the epoch for the high volume tables."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+import datetime
+import calendar
+import logging
+from sqlalchemy import DateTime, Time, Integer, TypeDecorator, func, extract, type_coerce, literal_column, inspect, create_engine
+from sqlalchemy.orm import synonym
+
+
+logger = logging.getLogger(__name__)
+
+
+class EpochTimestamps(object):
+    """
+    The process wide choice of how EpochDateTime and EpochTime columns are stored.
+
+    By default they are stored like DateTime and Time columns, as text in SQLite. With epoch timestamps enabled, they are
+    stored as integer seconds since the epoch and integer seconds. Timestamps are naive local times, as everywhere else, and
+    are stored as if they were UTC. Microseconds are dropped. The choice is made from the database parameters when the first
+    database is opened and all databases opened by the process have to use the same storage.
+    """
+
+    enabled = False
+    __configured = False
+    epoch = datetime.datetime(1970, 1, 1)
+
+    @classmethod
+    def configure(cls, db_params):
+        """Set the timestamp storage from the database parameters."""
+        enabled = getattr(db_params, 'epoch_timestamps', False)
+        if cls.__configured and enabled != cls.enabled:
+            raise ValueError(f'Epoch timestamps are {"enabled" if cls.enabled else "disabled"} for the databases already opened')
+        cls.enabled = enabled
+        cls.__configured = True
+
+    @classmethod
+    def migrate_db(cls, db_class, db_params, tables):
+        """
+        Convert the tables of a SQLite database to the timestamp storage chosen by db_params.
+
+        Parameters:
+        ----------
+        db_class (DB): the class of the database, it doesn't have to be open
+        db_params (DbParams): configuration data for accessing the database
+        tables (list): the EpochTimestampsObject table classes of the database
+
+        """
+        cls.configure(db_params)
+        engine = create_engine('sqlite:///' + db_class._sqlite_path(db_params))
+        try:
+            migrated = [table.migrate_storage(engine) for table in tables]
+            if any(migrated):
+                # give the space freed by the smaller rows back to the file system
+                engine.execute('VACUUM')
+        finally:
+            engine.dispose()
+
+    @classmethod
+    def to_secs(cls, value):
+        """Return the epoch seconds for a datetime or date."""
+        return calendar.timegm(value.timetuple())
+
+    @classmethod
+    def from_secs(cls, secs):
+        """Return the datetime for epoch seconds."""
+        return cls.epoch + datetime.timedelta(seconds=secs)
+
+    @classmethod
+    def __epoch_type(cls, col, col_type):
+        return cls.enabled and isinstance(col.type, col_type)
+
+    @classmethod
+    def sql_datetime(cls, col):
+        """Return an expression for a timestamp column as text, as DateTime columns are stored, for SQLite's date and time functions."""
+        if cls.__epoch_type(col, EpochDateTime):
+            return func.strftime(literal_column("'%Y-%m-%d %H:%M:%S.000000'"), col, literal_column("'unixepoch'"))
+        return col
+
+    @classmethod
+    def sql_epoch_secs(cls, col):
+        """Return an expression for a timestamp column as epoch seconds."""
+        if cls.__epoch_type(col, EpochDateTime):
+            return type_coerce(col, Integer)
+        return func.strftime('%s', col)
+
+    @classmethod
+    def sql_add_secs(cls, col, secs):
+        """Return an expression for a timestamp column plus a number of seconds that compares with the column's values."""
+        if cls.__epoch_type(col, EpochDateTime):
+            return type_coerce(type_coerce(col, Integer) + secs, col.type)
+        return func.datetime(col, f'+{secs} seconds')
+
+    @classmethod
+    def sql_secs_from_time(cls, col):
+        """Return an expression for a time column as seconds if it's stored as seconds, None if it isn't."""
+        if cls.__epoch_type(col, EpochTime):
+            return type_coerce(col, Integer)
+        return None
+
+
+class EpochDateTime(TypeDecorator):
+    """A DateTime column that is stored as integer seconds since the epoch when epoch timestamps are enabled."""
+
+    impl = DateTime
+
+    def load_dialect_impl(self, dialect):
+        """Return the storage type for the column."""
+        return dialect.type_descriptor(Integer() if EpochTimestamps.enabled else DateTime())
+
+    def process_bind_param(self, value, dialect):
+        """Convert datetimes and dates to epoch seconds."""
+        if EpochTimestamps.enabled and isinstance(value, datetime.date):
+            return EpochTimestamps.to_secs(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        """Convert epoch seconds to datetimes."""
+        if EpochTimestamps.enabled and value is not None:
+            return EpochTimestamps.from_secs(value)
+        return value
+
+
+class EpochTime(TypeDecorator):
+    """A Time column that is stored as integer seconds when epoch timestamps are enabled."""
+
+    impl = Time
+
+    def load_dialect_impl(self, dialect):
+        """Return the storage type for the column."""
+        return dialect.type_descriptor(Integer() if EpochTimestamps.enabled else Time())
+
+    def process_bind_param(self, value, dialect):
+        """Convert times to seconds."""
+        if EpochTimestamps.enabled and isinstance(value, datetime.time):
+            return (value.hour * 60 + value.minute) * 60 + value.second
+        return value
+
+    def process_result_value(self, value, dialect):
+        """Convert seconds to times."""
+        if EpochTimestamps.enabled and value is not None:
+            return (datetime.datetime.min + datetime.timedelta(seconds=value)).time()
+        return value
+
+
+class EpochTimestampsObject(object):
+    """
+    Mixin for tables with EpochDateTime and EpochTime columns.
+
+    The Python interface of the table doesn't change with the storage. With epoch timestamps enabled, a <table>_view view
+    shows the timestamps and times as text for use from SQL. The mixin has to come before the DBObject base class.
+    """
+
+    @classmethod
+    def setup(cls, db):
+        """Initialize per table data and check that the table's storage matches the configured storage."""
+        super().setup(db)
+        if cls.time_col_name is None:
+            # DBObject only recognizes DateTime columns as the time column
+            cls.time_col_name = cls.__epoch_cols(EpochDateTime)[0].name
+            cls.time_col = synonym(cls.time_col_name)
+        if db.db_params.db_type == 'sqlite':
+            stored_as_epoch = cls.stored_as_epoch(db.engine)
+            if stored_as_epoch is not None and stored_as_epoch != EpochTimestamps.enabled:
+                raise ValueError(f'{cls.__tablename__} in {db.db_name} is stored {"with" if stored_as_epoch else "without"} epoch timestamps, migrate the databases first')
+            if EpochTimestamps.enabled:
+                cls.create_epoch_view(db)
+
+    @classmethod
+    def __epoch_cols(cls, col_type):
+        return [col for col in cls.__table__.columns if isinstance(col.type, col_type)]
+
+    @classmethod
+    def stored_as_epoch(cls, engine):
+        """Return if the table stores timestamps as epoch seconds, None if the table doesn't exist."""
+        inspector = inspect(engine)
+        if cls.__tablename__ not in inspector.get_table_names():
+            return None
+        col_types = {col['name']: col['type'] for col in inspector.get_columns(cls.__tablename__)}
+        return isinstance(col_types[cls.__epoch_cols(EpochDateTime)[0].name], Integer)
+
+    @classmethod
+    def create_epoch_view(cls, db):
+        """Create a view of the table with the timestamps and times as text."""
+        selectable = []
+        for col in cls.__table__.columns:
+            if isinstance(col.type, EpochDateTime):
+                selectable.append(func.datetime(col, literal_column("'unixepoch'")).label(col.name))
+            elif isinstance(col.type, EpochTime):
+                selectable.append(func.time(col, literal_column("'unixepoch'")).label(col.name))
+            else:
+                selectable.append(col)
+        cls._create_view_from_selectable(db, cls._get_default_view_name(), selectable, cls.time_col.desc())
+
+    @classmethod
+    def _secs_from_time(cls, col):
+        secs = EpochTimestamps.sql_secs_from_time(col)
+        return secs if secs is not None else super()._secs_from_time(col)
+
+    @classmethod
+    def get_years(cls, db):
+        """Return a list of the unique years present in the time column."""
+        with db.managed_session() as session:
+            return cls._rows_to_ints_not_none(session.query(extract('year', EpochTimestamps.sql_datetime(cls.time_col))).distinct().all())
+
+    @classmethod
+    def s_get_months(cls, session, year):
+        """Return a list of months as indexes, for the given year, present in the table."""
+        time_col = EpochTimestamps.sql_datetime(cls.time_col)
+        return cls._rows_to_ints_not_none(session.query(extract('month', time_col)).filter(extract('year', time_col) == str(year)).distinct().all())
+
+    @classmethod
+    def s_get_days(cls, session, year):
+        """Return a list of days as indexes, for the given year, present in the table."""
+        time_col = EpochTimestamps.sql_datetime(cls.time_col)
+        return cls._rows_to_ints(session.query(func.strftime("%j", time_col)).filter(extract('year', time_col) == str(year)).distinct().all())
+
+    @classmethod
+    def __convert_col(cls, col, to_epoch):
+        if isinstance(col.type, EpochDateTime):
+            return f"CAST(strftime('%s', {col.name}) AS INTEGER)" if to_epoch else f"strftime('%Y-%m-%d %H:%M:%S.000000', {col.name}, 'unixepoch')"
+        if isinstance(col.type, EpochTime):
+            return f"CAST(strftime('%s', '1970-01-01 ' || {col.name}) AS INTEGER)" if to_epoch else f"strftime('%H:%M:%S.000000', {col.name}, 'unixepoch')"
+        return col.name
+
+    @classmethod
+    def migrate_storage(cls, engine):
+        """Convert the table, in the SQLite database of the engine, to the configured timestamp storage."""
+        stored_as_epoch = cls.stored_as_epoch(engine)
+        if stored_as_epoch is None or stored_as_epoch == EpochTimestamps.enabled:
+            return False
+        logger.info("Converting %s to %s timestamps", cls.__tablename__, 'epoch' if EpochTimestamps.enabled else 'text')
+        legacy_table_name = f'{cls.__tablename__}_legacy'
+        col_names = ', '.join(col.name for col in cls.__table__.columns)
+        converted_cols = ', '.join(cls.__convert_col(col, EpochTimestamps.enabled) for col in cls.__table__.columns)
+        with engine.begin() as connection:
+            connection.execute(f'DROP VIEW IF EXISTS {cls._get_default_view_name()}')
+            # the secondary indexes keep their names when the table is renamed
+            for index in cls.__table__.indexes:
+                connection.execute(f'DROP INDEX IF EXISTS {index.name}')
+            connection.execute(f'ALTER TABLE {cls.__tablename__} RENAME TO {legacy_table_name}')
+            cls.__table__.create(connection)
+            connection.execute(f'INSERT INTO {cls.__tablename__} ({col_names}) SELECT {converted_cols} FROM {legacy_table_name}')
+            connection.execute(f'DROP TABLE {legacy_table_name}')
+        return True
@@ -7,13 +7,17 @@ __license__ = "GPL"
 import os
 import datetime
 import logging
-from sqlalchemy import Column, Integer, Date, DateTime, Time, Float, String, Enum, ForeignKey, func, PrimaryKeyConstraint
+from sqlalchemy import Column, Integer, Date, DateTime, Time, Float, String, Enum, ForeignKey, func, and_, PrimaryKeyConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 
 import Fit
 import Fit.conversions as conversions
 import utilities
+from GarminDB.aggregate_stats import AggregateStat, AggregateStatsObject
+from GarminDB.hourly_rollup import HourlyRollupBase, HourlyRollupStateBase, HourlyRollupObject
+from GarminDB.secondary_indexes import SecondaryIndexesObject
+from GarminDB.epoch_timestamps import EpochTimestamps, EpochDateTime, EpochTimestampsObject
 
 
 logger = logging.getLogger(__name__)
@@ -31,6 +35,11 @@ class GarminDB(utilities.DB):
     class _DbVersion(Base, utilities.DbVersionObject):
         """Stores version information for this databse and it's tables."""
 
+    def __init__(self, db_params, debug_level=0):
+        """Return an instance of the database with its timestamps stored as configured in db_params."""
+        EpochTimestamps.configure(db_params)
+        super().__init__(db_params, debug_level)
+
 
 class Attributes(GarminDB.Base, utilities.KeyValueObject):
     """Object representing generic key-value data from a Garmin device."""
@@ -80,7 +89,7 @@ class Device(GarminDB.Base, utilities.DBObject):
         return '%s%06d' % (serial_number, device_type.value)
 
 
-class DeviceInfo(GarminDB.Base, utilities.DBObject):
+class DeviceInfo(GarminDB.Base, SecondaryIndexesObject, utilities.DBObject):
     """Class representing a Garmin device info message from a FIT file."""
 
     __tablename__ = 'device_info'
@@ -99,6 +108,9 @@ class DeviceInfo(GarminDB.Base, utilities.DBObject):
 
     __table_args__ = (
         PrimaryKeyConstraint('timestamp', 'serial_number'),
+        # the files view join and lookups by device
+        Index('ix_device_info_file_id', 'file_id'),
+        Index('ix_device_info_serial_number', 'serial_number'),
     )
 
     @classmethod
@@ -179,7 +191,7 @@ class File(GarminDB.Base, utilities.DBObject):
         return os.path.basename(pathname).split('.')[0]
 
 
-class Weight(GarminDB.Base, utilities.DBObject):
+class Weight(GarminDB.Base, utilities.DBObject, AggregateStatsObject):
     """Class representing a weight entry."""
 
     __tablename__ = 'weight'
@@ -190,38 +202,66 @@ class Weight(GarminDB.Base, utilities.DBObject):
     day = Column(Date, primary_key=True)
     weight = Column(Float, nullable=False)
 
+    @classmethod
+    def _stats_spec(cls):
+        return {
+            'weight_avg' : AggregateStat.avg(cls.weight, True),
+            'weight_min' : AggregateStat.min(cls.weight, True),
+            'weight_max' : AggregateStat.max(cls.weight),
+        }
+
     @classmethod
     def get_stats(cls, session, start_ts, end_ts):
         """Return a dictionary of aggregate statistics for the given time period."""
-        stats = {
-            'weight_avg' : cls.s_get_col_avg(session, cls.weight, start_ts, end_ts, True),
-            'weight_min' : cls.s_get_col_min(session, cls.weight, start_ts, end_ts, True),
-            'weight_max' : cls.s_get_col_max(session, cls.weight, start_ts, end_ts),
-        }
-        return stats
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
+
+
+class HourlyRollupState(GarminDB.Base, HourlyRollupStateBase):
+    """Class representing which of the hourly rollup tables are complete."""
 
+    __tablename__ = 'hourly_rollups_state'
+
+    db = GarminDB
+    table_version = 1
 
-class Stress(GarminDB.Base, utilities.DBObject):
+
+class StressHourly(GarminDB.Base, HourlyRollupBase):
+    """Class representing stress readings rolled up per hour."""
+
+    __tablename__ = 'stress_hourly'
+
+    db = GarminDB
+    table_version = 1
+
+
+class Stress(GarminDB.Base, EpochTimestampsObject, utilities.DBObject, HourlyRollupObject, AggregateStatsObject):
     """Class representing a stress reading."""
 
     __tablename__ = 'stress'
 
     db = GarminDB
     table_version = 1
+    hourly_rollup = StressHourly
+    hourly_rollup_state = HourlyRollupState
+    rollup_col_name = 'stress'
+    rollup_stat_names = {'avg': 'stress_avg'}
 
-    timestamp = Column(DateTime, primary_key=True, unique=True)
+    timestamp = Column(EpochDateTime, primary_key=True, unique=True)
     stress = Column(Integer, nullable=False)
 
+    @classmethod
+    def _stats_spec(cls):
+        return {
+            'stress_avg' : AggregateStat.avg(cls.stress, True),
+        }
+
     @classmethod
     def get_stats(cls, session, start_ts, end_ts):
         """Return a dictionary of aggregate statistics for the given time period."""
-        stats = {
-            'stress_avg' : cls.s_get_col_avg(session, cls.stress, start_ts, end_ts, True),
-        }
-        return stats
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
 
 
-class Sleep(GarminDB.Base, utilities.DBObject):
+class Sleep(GarminDB.Base, utilities.DBObject, AggregateStatsObject):
     """Class representing a sleep session."""
 
     __tablename__ = 'sleep'
@@ -239,17 +279,21 @@ class Sleep(GarminDB.Base, utilities.DBObject):
     awake = Column(Time, nullable=False, default=datetime.time.min)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dictionary of aggregate statistics for the given time period."""
+    def _stats_spec(cls):
         return {
-            'sleep_avg'     : cls.s_get_time_col_avg(session, cls.total_sleep, start_ts, end_ts),
-            'sleep_min'     : cls.s_get_time_col_min(session, cls.total_sleep, start_ts, end_ts),
-            'sleep_max'     : cls.s_get_time_col_max(session, cls.total_sleep, start_ts, end_ts),
-            'rem_sleep_avg' : cls.s_get_time_col_avg(session, cls.rem_sleep, start_ts, end_ts),
-            'rem_sleep_min' : cls.s_get_time_col_min(session, cls.rem_sleep, start_ts, end_ts),
-            'rem_sleep_max' : cls.s_get_time_col_max(session, cls.rem_sleep, start_ts, end_ts),
+            'sleep_avg'     : AggregateStat.time_avg(cls.total_sleep),
+            'sleep_min'     : AggregateStat.time_min(cls.total_sleep),
+            'sleep_max'     : AggregateStat.time_max(cls.total_sleep),
+            'rem_sleep_avg' : AggregateStat.time_avg(cls.rem_sleep),
+            'rem_sleep_min' : AggregateStat.time_min(cls.rem_sleep),
+            'rem_sleep_max' : AggregateStat.time_max(cls.rem_sleep),
         }
 
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts):
+        """Return a dictionary of aggregate statistics for the given time period."""
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
+
 
 class SleepEvents(GarminDB.Base, utilities.DBObject):
     """Table that stores events recorded druing sleep."""
@@ -273,7 +317,7 @@ class SleepEvents(GarminDB.Base, utilities.DBObject):
             return values[0][0]
 
 
-class RestingHeartRate(GarminDB.Base, utilities.DBObject):
+class RestingHeartRate(GarminDB.Base, utilities.DBObject, AggregateStatsObject):
     """Class representing a daily resting heart rate reading."""
 
     __tablename__ = 'resting_hr'
@@ -284,18 +328,21 @@ class RestingHeartRate(GarminDB.Base, utilities.DBObject):
     day = Column(Date, primary_key=True)
     resting_heart_rate = Column(Float)
 
+    @classmethod
+    def _stats_spec(cls):
+        return {
+            'rhr_avg' : AggregateStat.avg(cls.resting_heart_rate, ignore_le_zero=True),
+            'rhr_min' : AggregateStat.min(cls.resting_heart_rate, ignore_le_zero=True),
+            'rhr_max' : AggregateStat.max(cls.resting_heart_rate),
+        }
+
     @classmethod
     def get_stats(cls, session, start_ts, end_ts):
         """Return a dictionary of aggregate statistics for the given time period."""
-        stats = {
-            'rhr_avg' : cls.s_get_col_avg(session, cls.resting_heart_rate, start_ts, end_ts, ignore_le_zero=True),
-            'rhr_min' : cls.s_get_col_min(session, cls.resting_heart_rate, start_ts, end_ts, ignore_le_zero=True),
-            'rhr_max' : cls.s_get_col_max(session, cls.resting_heart_rate, start_ts, end_ts),
-        }
-        return stats
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
 
 
-class DailySummary(GarminDB.Base, utilities.DBObject):
+class DailySummary(GarminDB.Base, utilities.DBObject, AggregateStatsObject):
     """Class representing a Garmin daily summary."""
 
     __tablename__ = 'daily_summary'
@@ -379,38 +426,42 @@ class DailySummary(GarminDB.Base, utilities.DBObject):
         return func.round((cls.floors_up * 100) / cls.floors_goal)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dictionary of aggregate statistics for the given time period."""
+    def _stats_spec(cls):
         return {
-            'rhr_avg'                   : cls.s_get_col_avg(session, cls.rhr, start_ts, end_ts),
-            'rhr_min'                   : cls.s_get_col_min(session, cls.rhr, start_ts, end_ts),
-            'rhr_max'                   : cls.s_get_col_max(session, cls.rhr, start_ts, end_ts),
-            'stress_avg'                : cls.s_get_col_avg(session, cls.stress_avg, start_ts, end_ts),
-            'steps'                     : cls.s_get_col_sum(session, cls.steps, start_ts, end_ts),
-            'steps_goal'                : cls.s_get_col_sum(session, cls.step_goal, start_ts, end_ts),
-            'floors'                    : cls.s_get_col_sum(session, cls.floors_up, start_ts, end_ts),
-            'floors_goal'               : cls.s_get_col_sum(session, cls.floors_goal, start_ts, end_ts),
-            'intensity_time'            : cls.s_get_time_col_avg(session, cls.intensity_time, start_ts, end_ts),
-            'moderate_activity_time'    : cls.s_get_time_col_avg(session, cls.moderate_activity_time, start_ts, end_ts),
-            'vigorous_activity_time'    : cls.s_get_time_col_sum(session, cls.vigorous_activity_time, start_ts, end_ts),
-            'intensity_time_goal'       : cls.s_get_time_col_avg(session, cls.intensity_time_goal, start_ts, end_ts),
-            'calories_goal'             : cls.s_get_col_sum(session, cls.calories_goal, start_ts, end_ts),
-            'calories_avg'              : cls.s_get_col_avg(session, cls.calories_total, start_ts, end_ts),
-            'calories_bmr_avg'          : cls.s_get_col_avg(session, cls.calories_bmr, start_ts, end_ts),
-            'calories_active_avg'       : cls.s_get_col_avg(session, cls.calories_active, start_ts, end_ts),
-            'calories_consumed_avg'     : cls.s_get_col_avg(session, cls.calories_consumed, start_ts, end_ts),
-            'hydration_goal'            : cls.s_get_col_sum(session, cls.hydration_goal, start_ts, end_ts),
-            'hydration_avg'             : cls.s_get_col_avg(session, cls.hydration_intake, start_ts, end_ts),
-            'hydration_intake'          : cls.s_get_col_sum(session, cls.hydration_intake, start_ts, end_ts),
-            'sweat_loss_avg'            : cls.s_get_col_avg(session, cls.sweat_loss, start_ts, end_ts),
-            'sweat_loss'                : cls.s_get_col_sum(session, cls.sweat_loss, start_ts, end_ts),
-            'spo2_avg'                  : cls.s_get_col_avg(session, cls.spo2_avg, start_ts, end_ts),
-            'spo2_min'                  : cls.s_get_col_min(session, cls.spo2_min, start_ts, end_ts),
-            'rr_waking_avg'             : cls.s_get_col_avg(session, cls.rr_waking_avg, start_ts, end_ts),
-            'rr_max'                    : cls.s_get_col_max(session, cls.rr_max, start_ts, end_ts),
-            'rr_min'                    : cls.s_get_col_min(session, cls.rr_min, start_ts, end_ts),
+            'rhr_avg'                   : AggregateStat.avg(cls.rhr),
+            'rhr_min'                   : AggregateStat.min(cls.rhr),
+            'rhr_max'                   : AggregateStat.max(cls.rhr),
+            'stress_avg'                : AggregateStat.avg(cls.stress_avg),
+            'steps'                     : AggregateStat.sum(cls.steps),
+            'steps_goal'                : AggregateStat.sum(cls.step_goal),
+            'floors'                    : AggregateStat.sum(cls.floors_up),
+            'floors_goal'               : AggregateStat.sum(cls.floors_goal),
+            'intensity_time'            : AggregateStat.time_avg(cls.intensity_time),
+            'moderate_activity_time'    : AggregateStat.time_avg(cls.moderate_activity_time),
+            'vigorous_activity_time'    : AggregateStat.time_sum(cls.vigorous_activity_time),
+            'intensity_time_goal'       : AggregateStat.time_avg(cls.intensity_time_goal),
+            'calories_goal'             : AggregateStat.sum(cls.calories_goal),
+            'calories_avg'              : AggregateStat.avg(cls.calories_total),
+            'calories_bmr_avg'          : AggregateStat.avg(cls.calories_bmr),
+            'calories_active_avg'       : AggregateStat.avg(cls.calories_active),
+            'calories_consumed_avg'     : AggregateStat.avg(cls.calories_consumed),
+            'hydration_goal'            : AggregateStat.sum(cls.hydration_goal),
+            'hydration_avg'             : AggregateStat.avg(cls.hydration_intake),
+            'hydration_intake'          : AggregateStat.sum(cls.hydration_intake),
+            'sweat_loss_avg'            : AggregateStat.avg(cls.sweat_loss),
+            'sweat_loss'                : AggregateStat.sum(cls.sweat_loss),
+            'spo2_avg'                  : AggregateStat.avg(cls.spo2_avg),
+            'spo2_min'                  : AggregateStat.min(cls.spo2_min),
+            'rr_waking_avg'             : AggregateStat.avg(cls.rr_waking_avg),
+            'rr_max'                    : AggregateStat.max(cls.rr_max),
+            'rr_min'                    : AggregateStat.min(cls.rr_min),
         }
 
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts):
+        """Return a dictionary of aggregate statistics for the given time period."""
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
+
     @classmethod
     def get_daily_stats(cls, session, day_ts):
         """Return a dictionary of aggregate statistics for the given day."""
@@ -420,24 +471,26 @@ class DailySummary(GarminDB.Base, utilities.DBObject):
         stats['day'] = day_ts
         return stats
 
+    @classmethod
+    def _stats_from_aggregates(cls, aggregates):
+        # used for the daily stats: intensity_time_goal is a weekly goal, so the daily value is 1/7 of the weekly goal
+        stats = dict(aggregates)
+        stats['intensity_time_goal'] = conversions.secs_to_dt_time(int(conversions.time_to_secs(stats['intensity_time_goal']) / 7))
+        return stats
+
     @classmethod
     def get_monthly_stats(cls, session, first_day_ts, last_day_ts):
         """Return a dictionary of aggregate statistics for the given month."""
-        stats = cls.get_stats(session, first_day_ts, last_day_ts)
         # intensity time is a weekly goal, so sum up the weekly average values
-        first_week_end = first_day_ts + datetime.timedelta(7)
-        second_week_end = first_day_ts + datetime.timedelta(14)
-        third_week_end = first_day_ts + datetime.timedelta(21)
-        fourth_week_end = first_day_ts + datetime.timedelta(28)
-        stats['intensity_time_goal'] = Fit.conversions.add_time(
-            Fit.conversions.add_time(
-                cls.s_get_time_col_avg(session, cls.intensity_time_goal, first_day_ts, first_week_end),
-                cls.s_get_time_col_avg(session, cls.intensity_time_goal, first_week_end, second_week_end)
-            ),
-            Fit.conversions.add_time(
-                cls.s_get_time_col_avg(session, cls.intensity_time_goal, second_week_end, third_week_end),
-                cls.s_get_time_col_avg(session, cls.intensity_time_goal, third_week_end, fourth_week_end)
-            )
-        )
+        spec = cls._stats_spec()
+        week_goals = [f'intensity_time_goal_week_{week}' for week in range(4)]
+        for week, week_goal in enumerate(week_goals):
+            week_start = first_day_ts + datetime.timedelta(7 * week)
+            week_end = week_start + datetime.timedelta(7)
+            spec[week_goal] = AggregateStat.time_avg(cls.intensity_time_goal, and_(cls.day >= week_start, cls.day < week_end))
+        stats = cls.s_get_aggregate_stats(session, spec, first_day_ts, last_day_ts)
+        stats['intensity_time_goal'] = datetime.time.min
+        for week_goal in week_goals:
+            stats['intensity_time_goal'] = Fit.conversions.add_time(stats['intensity_time_goal'], stats.pop(week_goal))
         stats['first_day'] = first_day_ts
         return stats
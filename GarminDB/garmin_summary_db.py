@@ -5,11 +5,16 @@ __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
 import logging
+import datetime
+import numpy as np
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, Date, DateTime
+from sqlalchemy import Column, Integer, Date, DateTime, String, PrimaryKeyConstraint, event, and_, select, func, type_coerce
 
 import HealthDB
 import utilities
+from GarminDB.aggregate_stats import AggregateStat, AggregateStatsObject
+from GarminDB.epoch_timestamps import EpochTimestamps
+from GarminDB.time_series import TimeSeries
 
 
 logger = logging.getLogger(__name__)
@@ -88,24 +93,95 @@ class WeeksSummary(GarminSummaryDB.Base, HealthDB.SummaryBase):
         cls.create_weeks_view(db)
 
 
-class DaysSummary(GarminSummaryDB.Base, HealthDB.SummaryBase):
+class DaysSummary(GarminSummaryDB.Base, HealthDB.SummaryBase, AggregateStatsObject):
     """A table holding summarizzed data with one row per day."""
 
     __tablename__ = 'days_summary'
 
     db = GarminSummaryDB
-    table_version = 4
+    table_version = 5
     view_version = HealthDB.SummaryBase.view_version
 
     day = Column(Date, primary_key=True)
+    # The number of heart rate samples behind the day's averages so that the averages can be weighted when rolled up.
+    hr_count = Column(Integer)
+    inactive_hr_count = Column(Integer)
 
     @classmethod
     def create_view(cls, db):
         """Create the default database view for the table."""
         cls.create_days_view(db)
 
+    @classmethod
+    def _stats_spec(cls, sum_times=True):
+        time_stat = AggregateStat.time_sum if sum_times else AggregateStat.time_avg
+        return {
+            'hr_weighted_sum'           : AggregateStat.sum(cls.hr_avg * cls.hr_count),
+            'hr_count'                  : AggregateStat.sum(cls.hr_count),
+            'hr_min'                    : AggregateStat.min(cls.hr_min),
+            'hr_max'                    : AggregateStat.max(cls.hr_max),
+            'rhr_avg'                   : AggregateStat.avg(cls.rhr_avg),
+            'rhr_min'                   : AggregateStat.min(cls.rhr_min),
+            'rhr_max'                   : AggregateStat.max(cls.rhr_max),
+            'inactive_hr_weighted_sum'  : AggregateStat.sum(cls.inactive_hr_avg * cls.inactive_hr_count),
+            'inactive_hr_count'         : AggregateStat.sum(cls.inactive_hr_count),
+            'inactive_hr_min'           : AggregateStat.min(cls.inactive_hr_min),
+            'inactive_hr_max'           : AggregateStat.max(cls.inactive_hr_max),
+            'weight_avg'                : AggregateStat.avg(cls.weight_avg),
+            'weight_min'                : AggregateStat.min(cls.weight_min),
+            'weight_max'                : AggregateStat.max(cls.weight_max),
+            'intensity_time'            : time_stat(cls.intensity_time),
+            'moderate_activity_time'    : time_stat(cls.moderate_activity_time),
+            'vigorous_activity_time'    : time_stat(cls.vigorous_activity_time),
+            'intensity_time_goal'       : time_stat(cls.intensity_time_goal),
+            # the daily values are already the maximum per day
+            'steps'                     : AggregateStat.sum(cls.steps),
+            'steps_goal'                : AggregateStat.sum(cls.steps_goal),
+            'floors'                    : AggregateStat.sum(cls.floors),
+            'floors_goal'               : AggregateStat.sum(cls.floors_goal),
+            'sleep_avg'                 : AggregateStat.time_avg(cls.sleep_avg),
+            'sleep_min'                 : AggregateStat.time_min(cls.sleep_min),
+            'sleep_max'                 : AggregateStat.time_max(cls.sleep_max),
+            'rem_sleep_avg'             : AggregateStat.time_avg(cls.rem_sleep_avg),
+            'rem_sleep_min'             : AggregateStat.time_min(cls.rem_sleep_min),
+            'rem_sleep_max'             : AggregateStat.time_max(cls.rem_sleep_max),
+            'stress_avg'                : AggregateStat.avg(cls.stress_avg),
+            'calories_avg'              : AggregateStat.avg(cls.calories_avg),
+            'calories_bmr_avg'          : AggregateStat.avg(cls.calories_bmr_avg),
+            'calories_active_avg'       : AggregateStat.avg(cls.calories_active_avg),
+            'calories_consumed_avg'     : AggregateStat.avg(cls.calories_consumed_avg),
+            'calories_goal'             : AggregateStat.sum(cls.calories_goal),
+            'activities'                : AggregateStat.sum(cls.activities),
+            'activities_calories'       : AggregateStat.sum(cls.activities_calories),
+            'activities_distance'       : AggregateStat.sum(cls.activities_distance),
+            'hydration_goal'            : AggregateStat.sum(cls.hydration_goal),
+            'hydration_avg'             : AggregateStat.avg(cls.hydration_avg),
+            'hydration_intake'          : AggregateStat.sum(cls.hydration_intake),
+            'sweat_loss_avg'            : AggregateStat.avg(cls.sweat_loss_avg),
+            'sweat_loss'                : AggregateStat.sum(cls.sweat_loss),
+            'spo2_avg'                  : AggregateStat.avg(cls.spo2_avg),
+            'spo2_min'                  : AggregateStat.min(cls.spo2_min),
+            'rr_waking_avg'             : AggregateStat.avg(cls.rr_waking_avg),
+            'rr_max'                    : AggregateStat.max(cls.rr_max),
+            'rr_min'                    : AggregateStat.min(cls.rr_min),
+        }
+
+    @classmethod
+    def _stats_from_aggregates(cls, aggregates, sum_times=True):
+        stats = dict(aggregates)
+        for name in ['hr', 'inactive_hr']:
+            weighted_sum = stats.pop(f'{name}_weighted_sum')
+            count = stats.pop(f'{name}_count')
+            stats[f'{name}_avg'] = weighted_sum / count if weighted_sum is not None and count else None
+        return stats
+
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts, sum_times=True):
+        """Return a dictionary of statistics for the time period rolled up from the daily summaries."""
+        return cls._stats_from_aggregates(cls.s_get_aggregate_stats(session, cls._stats_spec(sum_times), start_ts, end_ts), sum_times)
+
 
-class IntensityHR(GarminSummaryDB.Base, utilities.DBObject):
+class IntensityHR(GarminSummaryDB.Base, utilities.DBObject, AggregateStatsObject):
     """Monitoring heart rate values that fall within a intensity period."""
 
     __tablename__ = 'intensity_hr'
@@ -118,10 +194,167 @@ class IntensityHR(GarminSummaryDB.Base, utilities.DBObject):
     heart_rate = Column(Integer, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dictionary of aggregate statistics for the given time period."""
+    def _stats_spec(cls):
         return {
-            'inactive_hr_avg' : cls.s_get_col_avg_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
-            'inactive_hr_min' : cls.s_get_col_min_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
-            'inactive_hr_max' : cls.s_get_col_max_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
+            'inactive_hr_avg'   : AggregateStat.avg(cls.heart_rate, True, cls.intensity == 0),
+            'inactive_hr_min'   : AggregateStat.min(cls.heart_rate, True, cls.intensity == 0),
+            'inactive_hr_max'   : AggregateStat.max(cls.heart_rate, True, cls.intensity == 0),
+            'inactive_hr_count' : AggregateStat.count(and_(cls.heart_rate > 0, cls.intensity == 0)),
         }
+
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts):
+        """Return a dictionary of aggregate statistics for the given time period."""
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
+
+    # Heart rate value is for one minute, reported at the end of the minute. Only take HR values where the measurement period
+    # falls within the activity period: the time from one intensity sample to the next, both on the same day, that has the
+    # intensity of the sample that ends it. Both of the methods below apply this rule and must return the same rows.
+    hr_sample_secs = 60
+
+    @classmethod
+    def entries_from_series(cls, intensity, hr, days):
+        """
+        Return the rows for the given days, as dicts, by matching monitoring intensity and heart rate series with vectorized searches.
+
+        Parameters:
+        ----------
+        intensity (TimeSeries): the monitoring intensity values over the period of the days
+        hr (TimeSeries): the monitoring heart rate values over the period of the days
+        days (list): the dates of the days to return rows for
+
+        """
+        if len(intensity) < 2 or not len(hr):
+            return []
+        period_index = np.searchsorted(intensity.timestamps, hr.timestamps, side='right') - 1
+        in_period = (period_index >= 0) & (period_index < len(intensity) - 1)
+        period_index = np.where(in_period, period_index, 0)
+        period_start = intensity.timestamps[period_index]
+        period_end = intensity.timestamps[period_index + 1]
+        period_day = period_start // TimeSeries.secs_per_day
+        day_numbers = [TimeSeries.epoch_secs(day) // TimeSeries.secs_per_day for day in days]
+        matches = in_period & (hr.timestamps < period_start + cls.hr_sample_secs) & (period_end - period_start > cls.hr_sample_secs) & \
+            (period_day == period_end // TimeSeries.secs_per_day) & np.isin(period_day, day_numbers)
+        timestamps = TimeSeries.to_datetimes(hr.timestamps[matches])
+        intensities = intensity.values[period_index[matches] + 1].astype(int).tolist()
+        heart_rates = hr.values[matches].astype(int).tolist()
+        return [
+            {'timestamp' : timestamp, 'intensity' : period_intensity, 'heart_rate' : heart_rate}
+            for timestamp, period_intensity, heart_rate in zip(timestamps, intensities, heart_rates)
+        ]
+
+    @classmethod
+    def select_from_tables(cls, monitoring, hr, start_ts, end_ts, days):
+        """
+        Return a select of the rows for the given days, with timestamp, intensity, and heart_rate columns, from the monitoring tables.
+
+        Parameters:
+        ----------
+        monitoring (Table): the monitoring table, under its schema when it's in an attached database
+        hr (Table): the monitoring heart rate table, under its schema when it's in an attached database
+        start_ts (datetime): the start of the first day
+        end_ts (datetime): the end of the last day
+        days (list): the dates of the days to return rows for
+
+        """
+        periods = select([
+            monitoring.c.timestamp.label('start'),
+            func.lead(monitoring.c.timestamp, type_=monitoring.c.timestamp.type).over(order_by=monitoring.c.timestamp).label('end'),
+            func.lead(monitoring.c.intensity).over(order_by=monitoring.c.timestamp).label('intensity')
+        ]).where(and_(monitoring.c.intensity != None, monitoring.c.timestamp >= start_ts, monitoring.c.timestamp < end_ts)).alias('periods')  # noqa
+        # Compare epoch seconds, text timestamps have microseconds.
+        start_day = func.date(EpochTimestamps.sql_datetime(periods.c.start))
+        return select([
+            type_coerce(EpochTimestamps.sql_datetime(hr.c.timestamp), DateTime).label('timestamp'),
+            periods.c.intensity.label('intensity'),
+            hr.c.heart_rate.label('heart_rate')
+        ]).select_from(
+            periods.join(hr, and_(hr.c.timestamp >= periods.c.start, hr.c.timestamp < EpochTimestamps.sql_add_secs(periods.c.start, cls.hr_sample_secs)))
+        ).where(and_(
+            EpochTimestamps.sql_epoch_secs(periods.c.end) - EpochTimestamps.sql_epoch_secs(periods.c.start) > cls.hr_sample_secs,
+            start_day == func.date(EpochTimestamps.sql_datetime(periods.c.end)),
+            start_day.in_([str(day_date) for day_date in days])
+        ))
+
+    @classmethod
+    def s_delete_days(cls, session, days):
+        """Delete the rows for the given days."""
+        for day_date in days:
+            start_ts = datetime.datetime.combine(day_date, datetime.time.min)
+            session.query(cls).filter(cls.timestamp >= start_ts).filter(cls.timestamp < start_ts + datetime.timedelta(1)).delete(synchronize_session=False)
+
+
+class DirtyDays(GarminSummaryDB.Base, utilities.DBObject):
+    """Days with source data that changed since the summary tables were last generated."""
+
+    __tablename__ = 'dirty_days'
+
+    db = GarminSummaryDB
+    table_version = 1
+
+    table_name = Column(String, nullable=False)
+    day = Column(Date, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("table_name", "day"),
+    )
+
+    @classmethod
+    def add_days(cls, db, table_name, days):
+        """Record days with changed data in the given table."""
+        with db.managed_session() as session:
+            existing_days = {row[0] for row in session.query(cls.day).filter(cls.table_name == table_name).all()}
+            session.bulk_insert_mappings(cls, [{'table_name': table_name, 'day': day} for day in set(days) - existing_days])
+
+    @classmethod
+    def get_days(cls, db):
+        """Return a sorted list of all days with changed data in any table."""
+        with db.managed_session() as session:
+            return sorted({row[0] for row in session.query(cls.day).distinct().all()})
+
+    @classmethod
+    def clear_period(cls, db, start_day, end_day):
+        """Forget the changed days from start_day up to, but not including, end_day."""
+        with db.managed_session() as session:
+            session.query(cls).filter(cls.day >= start_day).filter(cls.day < end_day).delete(synchronize_session=False)
+
+
+class DirtyDaysTracker(object):
+    """Tracks the days of the rows written to a set of tables so that only the changed days are summarized."""
+
+    def __init__(self, tables):
+        """Start tracking the rows written to the given tables."""
+        self.tables = tables
+        self.days = {}
+        for table in self.tables:
+            event.listen(table, 'after_insert', self.__row_written)
+            event.listen(table, 'after_update', self.__row_written)
+        HealthDB.BulkWriter.add_listener(self.__rows_bulk_written)
+
+    def __add_day(self, table, timestamp):
+        if timestamp is not None:
+            day = timestamp.date() if isinstance(timestamp, datetime.datetime) else timestamp
+            self.days.setdefault(table.__tablename__, set()).add(day)
+
+    def __row_written(self, mapper, connection, target):
+        self.__add_day(type(target), getattr(target, target.time_col_name, None))
+
+    def __rows_bulk_written(self, session, table, rows):
+        if table in self.tables:
+            for row in rows:
+                self.__add_day(table, row.get(table.time_col_name))
+
+    def day_count(self):
+        """Return the number of different days that rows were written for."""
+        return len(set().union(*self.days.values()))
+
+    def save(self, db_params):
+        """Stop tracking and record the days that were written in the summary database."""
+        for table in self.tables:
+            event.remove(table, 'after_insert', self.__row_written)
+            event.remove(table, 'after_update', self.__row_written)
+        HealthDB.BulkWriter.remove_listener(self.__rows_bulk_written)
+        garmin_sum_db = HealthDB.DbRegistry.get(GarminSummaryDB, db_params)
+        for table_name, days in self.days.items():
+            logger.info("%s changed on %d days", table_name, len(days))
+            DirtyDays.add_days(garmin_sum_db, table_name, days)
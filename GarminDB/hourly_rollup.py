@@ -0,0 +1,168 @@
+"""Hourly rollup tables that are kept up to date as high rate monitoring samples are written."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+import datetime
+import logging
+from sqlalchemy import Column, DateTime, Integer, Float, String, Boolean, func, case, select, event
+from sqlalchemy.orm import Session, object_session
+
+import utilities
+import HealthDB
+from GarminDB.epoch_timestamps import EpochTimestamps
+
+
+logger = logging.getLogger(__name__)
+
+
+class HourlyRollupBase(utilities.DBObject):
+    """Base class for tables holding the count, sum, minimum, and maximum of a column's values for each hour."""
+
+    hour = Column(DateTime, primary_key=True)
+    samples = Column(Integer)
+    total = Column(Float)
+    minimum = Column(Float)
+    maximum = Column(Float)
+
+
+class HourlyRollupStateBase(utilities.DBObject):
+    """Base class for tables recording which rollup tables have been built from all of their table's data."""
+
+    table_name = Column(String(64), primary_key=True)
+    complete = Column(Boolean, nullable=False, default=False)
+
+
+class HourlyRollupObject(object):
+    """
+    Mixin for tables whose values are rolled up per hour into a HourlyRollupBase table.
+
+    Classes using the mixin set hourly_rollup to the rollup table, hourly_rollup_state to the database's HourlyRollupStateBase
+    table, rollup_col_name to the column that is rolled up, and rollup_stat_names to a dict mapping some of 'avg', 'min',
+    'max', and 'count' to the names of the table's stats. Once the rollups have been built from all of the table's data,
+    stats requests for exactly those stats over periods on hour boundaries are answered from the rollups. Values less than or
+    equal to zero are ignored for the count, average, and minimum as the table's stats do. The mixin has to come before
+    AggregateStatsObject in the base classes.
+    """
+
+    @classmethod
+    def _hour(cls, timestamp):
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def __hour_aligned(cls, timestamp):
+        return not isinstance(timestamp, datetime.datetime) or timestamp == cls._hour(timestamp)
+
+    @classmethod
+    def __hour_col(cls, session):
+        if session.get_bind().dialect.name == 'sqlite':
+            return func.strftime('%Y-%m-%d %H:00:00', EpochTimestamps.sql_datetime(cls.time_col))
+        return func.date_format(cls.time_col, '%Y-%m-%d %H:00:00')
+
+    @classmethod
+    def s_rollup_complete(cls, session):
+        """Return True if the hourly rollups have been built from all of the table's data."""
+        state = session.query(cls.hourly_rollup_state).filter(cls.hourly_rollup_state.table_name == cls.hourly_rollup.__tablename__).one_or_none()
+        return state is not None and state.complete
+
+    @classmethod
+    def s_update_hourly_rollup(cls, session, start_ts, end_ts):
+        """Recompute the hourly rollups for the hours from start_ts up to, but not including, end_ts."""
+        hour_col = cls.__hour_col(session)
+        rollup_col = getattr(cls, cls.rollup_col_name)
+        value = case([(rollup_col > 0, rollup_col)])
+        query = session.query(hour_col, func.count(value), func.sum(value), func.min(value), func.max(rollup_col))
+        query = query.filter(cls.time_col >= start_ts).filter(cls.time_col < end_ts).group_by(hour_col)
+        rollups = [
+            {'hour' : cls.__datetime(hour), 'samples' : samples, 'total' : total, 'minimum' : minimum, 'maximum' : maximum}
+            for hour, samples, total, minimum, maximum in query.all()
+        ]
+        session.query(cls.hourly_rollup).filter(cls.hourly_rollup.hour >= start_ts).filter(cls.hourly_rollup.hour < end_ts).delete(synchronize_session=False)
+        session.bulk_insert_mappings(cls.hourly_rollup, rollups)
+
+    @classmethod
+    def __datetime(cls, hour):
+        # strftime and date_format return the hour as text
+        return datetime.datetime.strptime(hour, '%Y-%m-%d %H:%M:%S') if isinstance(hour, str) else hour
+
+    @classmethod
+    def backfill_hourly_rollup(cls, db):
+        """Build the hourly rollups for all of the table's data if they haven't been built since the table was created."""
+        with db.managed_session() as session:
+            if cls.s_rollup_complete(session):
+                return
+            first_ts = session.query(func.min(cls.time_col)).scalar()
+            if first_ts is not None:
+                logger.info("Building the hourly rollups for %s", cls.__tablename__)
+                last_ts = session.query(func.max(cls.time_col)).scalar()
+                cls.s_update_hourly_rollup(session, cls._hour(first_ts), cls._hour(last_ts) + datetime.timedelta(hours=1))
+            session.merge(cls.hourly_rollup_state(table_name=cls.hourly_rollup.__tablename__, complete=True))
+
+    @classmethod
+    def __rollup_stats(cls, samples, total, minimum, maximum):
+        values = {
+            'avg'   : total / samples if samples else None,
+            'min'   : minimum,
+            'max'   : maximum,
+            'count' : samples if samples is not None else 0,
+        }
+        return {name: values[stat] for stat, name in cls.rollup_stat_names.items()}
+
+    @classmethod
+    def __rollup_columns(cls):
+        rollup = cls.hourly_rollup
+        return [func.sum(rollup.samples), func.sum(rollup.total), func.min(rollup.minimum), func.max(rollup.maximum)]
+
+    @classmethod
+    def __use_rollup(cls, session, spec, start_ts, end_ts):
+        return (set(spec) == set(cls.rollup_stat_names.values()) and cls.__hour_aligned(start_ts) and cls.__hour_aligned(end_ts)
+                and cls.s_rollup_complete(session))
+
+    @classmethod
+    def s_get_aggregate_stats(cls, session, spec, start_ts, end_ts):
+        """Return a dict of stats for the time period, from the hourly rollups if the time period is on hour boundaries."""
+        if not cls.__use_rollup(session, spec, start_ts, end_ts):
+            return super().s_get_aggregate_stats(session, spec, start_ts, end_ts)
+        rollup = cls.hourly_rollup
+        row = session.query(*cls.__rollup_columns()).filter(rollup.hour >= start_ts).filter(rollup.hour < end_ts).one()
+        return cls.__rollup_stats(*row)
+
+    @classmethod
+    def _s_aggregates_by_day_query(cls, session, spec, start_ts, end_ts):
+        """Return a (query, to_aggregates) tuple for the stats of each day in the time period, from the hourly rollups if possible."""
+        if not cls.__use_rollup(session, spec, start_ts, end_ts):
+            return super()._s_aggregates_by_day_query(session, spec, start_ts, end_ts)
+        rollup = cls.hourly_rollup
+        day_col = func.date(rollup.hour)
+        columns = [column.label(name) for column, name in zip(cls.__rollup_columns(), ['samples', 'total', 'minimum', 'maximum'])]
+        query = select([day_col.label('day')] + columns).where(rollup.hour >= start_ts).where(rollup.hour < end_ts).group_by(day_col)
+        return (query, lambda values: cls.__rollup_stats(values['samples'], values['total'], values['minimum'], values['maximum']))
+
+
+def __row_written(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        timestamp = getattr(target, target.time_col_name)
+        session.info.setdefault('hourly_rollup_hours', {}).setdefault(type(target), set()).add(target._hour(timestamp))
+
+
+def __update_hourly_rollups(session):
+    # Flush first so that the hours written by the last flush are known.
+    session.flush()
+    for table, hours in session.info.pop('hourly_rollup_hours', {}).items():
+        table.s_update_hourly_rollup(session, min(hours), max(hours) + datetime.timedelta(hours=1))
+
+
+def __rows_bulk_written(session, table, rows):
+    # bulk written rows don't fire the ORM events, so their hours are rolled up as each batch is written
+    if issubclass(table, HourlyRollupObject):
+        hours = [table._hour(row[table.time_col_name]) for row in rows]
+        table.s_update_hourly_rollup(session, min(hours), max(hours) + datetime.timedelta(hours=1))
+
+
+event.listen(HourlyRollupObject, 'after_insert', __row_written, propagate=True)
+event.listen(HourlyRollupObject, 'after_update', __row_written, propagate=True)
+event.listen(Session, 'before_commit', __update_hourly_rollups)
+HealthDB.BulkWriter.add_listener(__rows_bulk_written)
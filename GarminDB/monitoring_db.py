@@ -5,14 +5,21 @@ __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
 
+import os
+import re
 import logging
 import datetime
-from sqlalchemy import Column, Integer, DateTime, Time, Float, Enum, FLOAT, UniqueConstraint, PrimaryKeyConstraint
+from sqlalchemy import Column, Integer, DateTime, Float, Enum, FLOAT, UniqueConstraint, PrimaryKeyConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 
 import Fit
 import utilities
+from GarminDB.aggregate_stats import AggregateStat, AggregateStatsObject
+from GarminDB.hourly_rollup import HourlyRollupBase, HourlyRollupStateBase, HourlyRollupObject
+from GarminDB.secondary_indexes import SecondaryIndexesObject
+from GarminDB.time_series import TimeSeries
+from GarminDB.epoch_timestamps import EpochTimestamps, EpochDateTime, EpochTime, EpochTimestampsObject
 
 
 logger = logging.getLogger(__name__)
@@ -30,8 +37,34 @@ class MonitoringDB(utilities.DB):
     class _DbVersion(Base, utilities.DbVersionObject):
         """Stores version information for this databse and it's tables."""
 
+    def __init__(self, db_params, debug_level=0):
+        """Return an instance of the database with its timestamps stored as configured in db_params."""
+        EpochTimestamps.configure(db_params)
+        super().__init__(db_params, debug_level)
 
-class MonitoringInfo(MonitoringDB.Base, utilities.DBObject):
+    @classmethod
+    def _sqlite_path(cls, db_params):
+        year = getattr(db_params, 'monitoring_year', None)
+        if year is None:
+            return super()._sqlite_path(db_params)
+        return f'{db_params.db_path}/{cls.db_name}_{year}.db'
+
+    @classmethod
+    def _sqlite_delete(cls, db_params):
+        super()._sqlite_delete(db_params)
+        # deleting the monitoring database deletes the databases of all of the years
+        if getattr(db_params, 'monitoring_year', None) is None:
+            for year in cls.sqlite_years(db_params):
+                super()._sqlite_delete(utilities.DbParams(**dict(vars(db_params), monitoring_year=year)))
+
+    @classmethod
+    def sqlite_years(cls, db_params):
+        """Return the years that have a monitoring year file, oldest first."""
+        pattern = re.compile(cls.db_name + r'_(\d{4})\.db$')
+        return sorted(int(match.group(1)) for match in map(pattern.match, os.listdir(db_params.db_path)) if match)
+
+
+class MonitoringInfo(MonitoringDB.Base, utilities.DBObject, AggregateStatsObject):
     """Class representing data from a health monitoring file."""
 
     __tablename__ = 'monitoring_info'
@@ -60,43 +93,82 @@ class MonitoringInfo(MonitoringDB.Base, utilities.DBObject):
         """Return the base metabolic rate for the given day."""
         return cls.get_col_avg_of_max_per_day(db, cls.resting_metabolic_rate, day_ts, day_ts + datetime.timedelta(1))
 
+    @classmethod
+    def _stats_spec(cls):
+        return {
+            'calories_bmr_avg' : AggregateStat.avg(cls.resting_metabolic_rate),
+        }
+
     @classmethod
     def get_stats(cls, session, start_ts, end_ts):
         """Return a dict of stats for table entries within the time span."""
-        stats = {
-            'calories_bmr_avg' : cls.s_get_col_avg(session, cls.resting_metabolic_rate, start_ts, end_ts),
-        }
-        return stats
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
+
+
+class MonitoringHourlyRollupState(MonitoringDB.Base, HourlyRollupStateBase):
+    """Class that represents a database table recording which of the hourly rollup tables are complete."""
+
+    __tablename__ = 'hourly_rollups_state'
+
+    db = MonitoringDB
+    table_version = 1
+
 
+class MonitoringHeartRateHourly(MonitoringDB.Base, HourlyRollupBase):
+    """Class that represents a database table holding heart rate data rolled up per hour."""
 
-class MonitoringHeartRate(MonitoringDB.Base, utilities.DBObject):
+    __tablename__ = 'monitoring_hr_hourly'
+
+    db = MonitoringDB
+    table_version = 1
+
+
+class MonitoringHeartRate(MonitoringDB.Base, EpochTimestampsObject, utilities.DBObject, HourlyRollupObject, AggregateStatsObject):
     """Class that reprsents a database table holding resting heart rate data."""
 
     __tablename__ = 'monitoring_hr'
 
     db = MonitoringDB
     table_version = 1
+    hourly_rollup = MonitoringHeartRateHourly
+    hourly_rollup_state = MonitoringHourlyRollupState
+    rollup_col_name = 'heart_rate'
+    rollup_stat_names = {'avg': 'hr_avg', 'min': 'hr_min', 'max': 'hr_max', 'count': 'hr_count'}
 
-    timestamp = Column(DateTime, primary_key=True)
+    timestamp = Column(EpochDateTime, primary_key=True)
     heart_rate = Column(Integer, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
+    def _stats_spec(cls):
         return {
-            'hr_avg' : cls.s_get_col_avg(session, cls.heart_rate, start_ts, end_ts, True),
-            'hr_min' : cls.s_get_col_min(session, cls.heart_rate, start_ts, end_ts, True),
-            'hr_max' : cls.s_get_col_max(session, cls.heart_rate, start_ts, end_ts),
+            'hr_avg'    : AggregateStat.avg(cls.heart_rate, True),
+            'hr_min'    : AggregateStat.min(cls.heart_rate, True),
+            'hr_max'    : AggregateStat.max(cls.heart_rate),
+            'hr_count'  : AggregateStat.count(cls.heart_rate > 0),
         }
 
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts):
+        """Return a dict of stats for table entries within the time span."""
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
+
     @classmethod
     def get_resting_heartrate(cls, db, wake_ts):
         """Return a resting heart rate value for the day specified."""
         start_ts = wake_ts - datetime.timedelta(0, 0, 0, 0, 10)
-        return cls.get_col_min(db, cls.heart_rate, start_ts, wake_ts, True)
+        return TimeSeries.get(db, cls, cls.heart_rate, start_ts, wake_ts, ignore_le_zero=True).percentile(0)
+
+    # a resting heart rate is the lowest mean of this many consecutive samples, not a single low sample
+    resting_hr_window = 10
 
+    @classmethod
+    def s_get_resting_heart_rates(cls, session, start_ts, end_ts):
+        """Return a dict, keyed by day, of the resting heart rate of each day with data in the time period."""
+        hr = TimeSeries.s_get(session, cls, cls.heart_rate, start_ts, end_ts, ignore_le_zero=True)
+        return hr.rolling_mean(cls.resting_hr_window).per_day('min')
 
-class MonitoringIntensity(MonitoringDB.Base, utilities.DBObject):
+
+class MonitoringIntensity(MonitoringDB.Base, EpochTimestampsObject, utilities.DBObject, AggregateStatsObject):
     """Class representing monitoring data about cardio minutes."""
 
     __tablename__ = 'monitoring_intensity'
@@ -104,9 +176,9 @@ class MonitoringIntensity(MonitoringDB.Base, utilities.DBObject):
     db = MonitoringDB
     table_version = 1
 
-    timestamp = Column(DateTime, primary_key=True)
-    moderate_activity_time = Column(Time, nullable=False, default=datetime.time.min)
-    vigorous_activity_time = Column(Time, nullable=False, default=datetime.time.min)
+    timestamp = Column(EpochDateTime, primary_key=True)
+    moderate_activity_time = Column(EpochTime, nullable=False, default=datetime.time.min)
+    vigorous_activity_time = Column(EpochTime, nullable=False, default=datetime.time.min)
 
     __table_args__ = (
         UniqueConstraint("timestamp", "moderate_activity_time", "vigorous_activity_time"),
@@ -122,16 +194,20 @@ class MonitoringIntensity(MonitoringDB.Base, utilities.DBObject):
         return cls._time_from_secs(2 * cls._secs_from_time(cls.vigorous_activity_time) + cls._secs_from_time(cls.moderate_activity_time))
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
+    def _stats_spec(cls):
         return {
-            'intensity_time'            : cls.s_get_time_col_sum(session, cls.intensity_time, start_ts, end_ts),
-            'moderate_activity_time'    : cls.s_get_time_col_sum(session, cls.moderate_activity_time, start_ts, end_ts),
-            'vigorous_activity_time'    : cls.s_get_time_col_sum(session, cls.vigorous_activity_time, start_ts, end_ts),
+            'intensity_time'            : AggregateStat.time_sum(cls.intensity_time),
+            'moderate_activity_time'    : AggregateStat.time_sum(cls.moderate_activity_time),
+            'vigorous_activity_time'    : AggregateStat.time_sum(cls.vigorous_activity_time),
         }
 
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts):
+        """Return a dict of stats for table entries within the time span."""
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
+
 
-class MonitoringClimb(MonitoringDB.Base, utilities.DBObject):
+class MonitoringClimb(MonitoringDB.Base, EpochTimestampsObject, utilities.DBObject, AggregateStatsObject):
     """Class representing monitoring data about elvation gained."""
 
     __tablename__ = 'monitoring_climb'
@@ -142,7 +218,7 @@ class MonitoringClimb(MonitoringDB.Base, utilities.DBObject):
     feet_to_floors = 10
     meters_to_floors = 3
 
-    timestamp = Column(DateTime, primary_key=True)
+    timestamp = Column(EpochDateTime, primary_key=True)
     # meters or feet
     ascent = Column(Float)
     descent = Column(Float)
@@ -154,9 +230,13 @@ class MonitoringClimb(MonitoringDB.Base, utilities.DBObject):
     )
 
     @classmethod
-    def get_stats(cls, session, func, start_ts, end_ts, measurement_system):
-        """Return a dict of stats for table entries within the time span."""
-        cum_ascent = func(session, cls.cum_ascent, start_ts, end_ts)
+    def _stats_spec(cls, measurement_system):
+        # cum_ascent resets daily, so the sum of the daily maximums is the ascent for the period
+        return {'cum_ascent' : AggregateStat.sum_of_max_per_day(cls.cum_ascent)}
+
+    @classmethod
+    def _stats_from_aggregates(cls, aggregates, measurement_system):
+        cum_ascent = aggregates['cum_ascent']
         if cum_ascent:
             if measurement_system is Fit.field_enums.DisplayMeasure.metric:
                 floors = cum_ascent / cls.feet_to_floors
@@ -166,24 +246,29 @@ class MonitoringClimb(MonitoringDB.Base, utilities.DBObject):
             floors = 0
         return {'floors' : floors}
 
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts, measurement_system):
+        """Return a dict of stats for table entries within the time span."""
+        return cls._stats_from_aggregates(cls.s_get_aggregate_stats(session, cls._stats_spec(measurement_system), start_ts, end_ts), measurement_system)
+
     @classmethod
     def get_daily_stats(cls, session, day_ts, measurement_system):
         """Return a dict of stats for table entries for the given day."""
-        stats = cls.get_stats(session, cls.s_get_col_max, day_ts, day_ts + datetime.timedelta(1), measurement_system)
+        stats = cls.get_stats(session, day_ts, day_ts + datetime.timedelta(1), measurement_system)
         stats['day'] = day_ts
         return stats
 
     @classmethod
     def get_weekly_stats(cls, session, first_day_ts, measurement_system):
         """Return a dict of stats for table entries for the week day."""
-        stats = cls.get_stats(session, cls.s_get_col_sum_of_max_per_day, first_day_ts, first_day_ts + datetime.timedelta(7), measurement_system)
+        stats = cls.get_stats(session, first_day_ts, first_day_ts + datetime.timedelta(7), measurement_system)
         stats['first_day'] = first_day_ts
         return stats
 
     @classmethod
     def get_monthly_stats(cls, session, first_day_ts, last_day_ts, measurement_system):
         """Return a dict of stats for table entries for the month."""
-        stats = cls.get_stats(session, cls.s_get_col_sum_of_max_per_day, first_day_ts, last_day_ts, measurement_system)
+        stats = cls.get_stats(session, first_day_ts, last_day_ts, measurement_system)
         stats['first_day'] = first_day_ts
         return stats
 
@@ -191,12 +276,12 @@ class MonitoringClimb(MonitoringDB.Base, utilities.DBObject):
     def get_yearly_stats(cls, session, year, measurement_system):
         """Return a dict of stats for table entries for the year."""
         first_day_ts = datetime.datetime(year, 1, 1)
-        stats = cls.get_stats(session, cls.s_get_col_sum_of_max_per_day, first_day_ts, first_day_ts + datetime.timedelta(365), measurement_system)
+        stats = cls.get_stats(session, first_day_ts, first_day_ts + datetime.timedelta(365), measurement_system)
         stats['first_day'] = first_day_ts
         return stats
 
 
-class Monitoring(MonitoringDB.Base, utilities.DBObject):
+class Monitoring(MonitoringDB.Base, EpochTimestampsObject, SecondaryIndexesObject, utilities.DBObject, AggregateStatsObject):
     """A table containing monitoring data."""
 
     __tablename__ = 'monitoring'
@@ -204,12 +289,12 @@ class Monitoring(MonitoringDB.Base, utilities.DBObject):
     db = MonitoringDB
     table_version = 2
 
-    timestamp = Column(DateTime, nullable=False)
+    timestamp = Column(EpochDateTime, nullable=False)
     activity_type = Column(Enum(Fit.field_enums.ActivityType))
     intensity = Column(Integer)
-    duration = Column(Time, nullable=False, default=datetime.time.min)
+    duration = Column(EpochTime, nullable=False, default=datetime.time.min)
     distance = Column(Float)
-    cum_active_time = Column(Time, nullable=False, default=datetime.time.min)
+    cum_active_time = Column(EpochTime, nullable=False, default=datetime.time.min)
     active_calories = Column(Integer)
     steps = Column(Integer)
     strokes = Column(Integer)
@@ -217,6 +302,8 @@ class Monitoring(MonitoringDB.Base, utilities.DBObject):
 
     __table_args__ = (
         PrimaryKeyConstraint("timestamp", "activity_type"),
+        # covers the intensity series read when matching heart rate to intensity periods
+        Index('ix_monitoring_timestamp_intensity', 'timestamp', 'intensity'),
     )
 
     @classmethod
@@ -227,80 +314,125 @@ class Monitoring(MonitoringDB.Base, utilities.DBObject):
     @classmethod
     def get_active_calories(cls, session, activity_type, start_ts, end_ts):
         """Return the total calories burned during activity during the indicated period."""
-        active_calories = cls.s_get_col_avg_of_max_per_day_for_value(session, cls.active_calories, cls.activity_type, activity_type, start_ts, end_ts)
+        spec = {'active_calories' : AggregateStat.avg_of_max_per_day(cls.active_calories, cls.activity_type == activity_type)}
+        active_calories = cls.s_get_aggregate_stats(session, spec, start_ts, end_ts)['active_calories']
         return active_calories if active_calories is not None else 0
 
+    active_calories_activity_types = [Fit.field_enums.ActivityType.running, Fit.field_enums.ActivityType.cycling, Fit.field_enums.ActivityType.walking]
+
     @classmethod
-    def get_stats(cls, session, func, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
+    def _stats_spec(cls):
+        # steps and active calories are cumulative over the day, so use the daily maximums
+        spec = {'steps' : AggregateStat.sum_of_max_per_day(cls.steps)}
+        for activity_type in cls.active_calories_activity_types:
+            spec[activity_type.name] = AggregateStat.avg_of_max_per_day(cls.active_calories, cls.activity_type == activity_type)
+        return spec
+
+    @classmethod
+    def _stats_from_aggregates(cls, aggregates):
         return {
-            'steps': func(session, cls.steps, start_ts, end_ts),
-            'calories_active_avg': (
-                cls.get_active_calories(session, Fit.field_enums.ActivityType.running, start_ts, end_ts)
-                + cls.get_active_calories(session, Fit.field_enums.ActivityType.cycling, start_ts, end_ts)
-                + cls.get_active_calories(session, Fit.field_enums.ActivityType.walking, start_ts, end_ts)
-            )
+            'steps': aggregates['steps'],
+            'calories_active_avg': sum(aggregates[activity_type.name] or 0 for activity_type in cls.active_calories_activity_types)
         }
 
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts):
+        """Return a dict of stats for table entries within the time span."""
+        return cls._stats_from_aggregates(cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts))
+
     @classmethod
     def get_daily_stats(cls, session, day_ts):
         """Return a dict of stats for table entries for the given day."""
-        stats = cls.get_stats(session, cls.s_get_col_max, day_ts, day_ts + datetime.timedelta(1))
+        stats = cls.get_stats(session, day_ts, day_ts + datetime.timedelta(1))
         stats['day'] = day_ts
         return stats
 
     @classmethod
     def get_weekly_stats(cls, session, first_day_ts):
         """Return a dict of stats for table entries for the given week."""
-        stats = cls.get_stats(session, cls.s_get_col_sum_of_max_per_day, first_day_ts, first_day_ts + datetime.timedelta(7))
+        stats = cls.get_stats(session, first_day_ts, first_day_ts + datetime.timedelta(7))
         stats['first_day'] = first_day_ts
         return stats
 
     @classmethod
     def get_monthly_stats(cls, session, first_day_ts, last_day_ts):
         """Return a dict of stats for table entries for the given week."""
-        stats = cls.get_stats(session, cls.s_get_col_sum_of_max_per_day, first_day_ts, last_day_ts)
+        stats = cls.get_stats(session, first_day_ts, last_day_ts)
         stats['first_day'] = first_day_ts
         return stats
 
 
-class MonitoringRespirationRate(MonitoringDB.Base, utilities.DBObject):
+class MonitoringRespirationRateHourly(MonitoringDB.Base, HourlyRollupBase):
+    """Class that represents a database table holding respiration rate data rolled up per hour."""
+
+    __tablename__ = 'monitoring_rr_hourly'
+
+    db = MonitoringDB
+    table_version = 1
+
+
+class MonitoringRespirationRate(MonitoringDB.Base, EpochTimestampsObject, utilities.DBObject, HourlyRollupObject, AggregateStatsObject):
     """Class that represents a database table holding respiration rate measured in breaths per minute."""
 
     __tablename__ = 'monitoring_rr'
 
     db = MonitoringDB
     table_version = 1
+    hourly_rollup = MonitoringRespirationRateHourly
+    hourly_rollup_state = MonitoringHourlyRollupState
+    rollup_col_name = 'rr'
+    rollup_stat_names = {'avg': 'rr_avg', 'min': 'rr_min', 'max': 'rr_max'}
 
-    timestamp = Column(DateTime, primary_key=True)
+    timestamp = Column(EpochDateTime, primary_key=True)
     rr = Column(Float, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
+    def _stats_spec(cls):
         return {
-            'rr_avg' : cls.s_get_col_avg(session, cls.rr, start_ts, end_ts, True),
-            'rr_min' : cls.s_get_col_min(session, cls.rr, start_ts, end_ts, True),
-            'rr_max' : cls.s_get_col_max(session, cls.rr, start_ts, end_ts),
+            'rr_avg' : AggregateStat.avg(cls.rr, True),
+            'rr_min' : AggregateStat.min(cls.rr, True),
+            'rr_max' : AggregateStat.max(cls.rr),
         }
 
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts):
+        """Return a dict of stats for table entries within the time span."""
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
+
+
+class MonitoringPulseOxHourly(MonitoringDB.Base, HourlyRollupBase):
+    """Class that represents a database table holding pulse ox data rolled up per hour."""
 
-class MonitoringPulseOx(MonitoringDB.Base, utilities.DBObject):
+    __tablename__ = 'monitoring_pulse_ox_hourly'
+
+    db = MonitoringDB
+    table_version = 1
+
+
+class MonitoringPulseOx(MonitoringDB.Base, EpochTimestampsObject, utilities.DBObject, HourlyRollupObject, AggregateStatsObject):
     """Class that represents a database table holding pulse ox measurements in percent."""
 
     __tablename__ = 'monitoring_pulse_ox'
 
     db = MonitoringDB
     table_version = 1
+    hourly_rollup = MonitoringPulseOxHourly
+    hourly_rollup_state = MonitoringHourlyRollupState
+    rollup_col_name = 'pulse_ox'
+    rollup_stat_names = {'avg': 'pulse_ox_avg', 'min': 'pulse_ox_min', 'max': 'pulse_ox_max'}
 
-    timestamp = Column(DateTime, primary_key=True)
+    timestamp = Column(EpochDateTime, primary_key=True)
     pulse_ox = Column(Float, nullable=False)
 
     @classmethod
-    def get_stats(cls, session, start_ts, end_ts):
-        """Return a dict of stats for table entries within the time span."""
+    def _stats_spec(cls):
         return {
-            'pulse_ox_avg' : cls.s_get_col_avg(session, cls.pulse_ox, start_ts, end_ts, True),
-            'pulse_ox_min' : cls.s_get_col_min(session, cls.pulse_ox, start_ts, end_ts, True),
-            'pulse_ox_max' : cls.s_get_col_max(session, cls.pulse_ox, start_ts, end_ts),
+            'pulse_ox_avg' : AggregateStat.avg(cls.pulse_ox, True),
+            'pulse_ox_min' : AggregateStat.min(cls.pulse_ox, True),
+            'pulse_ox_max' : AggregateStat.max(cls.pulse_ox),
         }
+
+    @classmethod
+    def get_stats(cls, session, start_ts, end_ts):
+        """Return a dict of stats for table entries within the time span."""
+        return cls.s_get_aggregate_stats(session, cls._stats_spec(), start_ts, end_ts)
@@ -0,0 +1,190 @@
+"""Routing of monitoring data to per year database files."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+import datetime
+import logging
+from contextlib import contextmanager, ExitStack
+
+import HealthDB
+import utilities
+from GarminDB.monitoring_db import MonitoringDB, MonitoringHourlyRollupState
+
+
+logger = logging.getLogger(__name__)
+
+
+class MonitoringUnionDB(object):
+    """
+    Read only access to the monitoring data of several years as if it was in one database.
+
+    Sessions are made on the database of the first year with the other years attached. TEMP views named like the monitoring
+    tables, which SQLite resolves before the tables, union the years' tables so that the usual queries span all of the years.
+    """
+
+    def __init__(self, year_dbs):
+        """Return an instance of MonitoringUnionDB for a dict of years and their databases."""
+        self.year_dbs = year_dbs
+
+    @classmethod
+    def union_view_sql(cls, table_name, schemas):
+        """Return the statement that creates a TEMP view of a table that unions the table from all of the schemas."""
+        selects = ' UNION ALL '.join(f'SELECT * FROM {schema}.{table_name}' for schema in schemas)
+        if table_name == MonitoringHourlyRollupState.__tablename__:
+            # a rollup table is only complete if it's complete in all of the years
+            return (f'CREATE TEMP VIEW {table_name} AS SELECT table_name, min(complete) AS complete FROM ({selects}) '
+                    f'GROUP BY table_name HAVING count(*) = {len(schemas)}')
+        return f'CREATE TEMP VIEW {table_name} AS {selects}'
+
+    @contextmanager
+    def managed_session(self):
+        """Return a session whose queries of the monitoring tables span all of the years."""
+        years = sorted(self.year_dbs)
+        attached_dbs = {f'y{year}': self.year_dbs[year] for year in years[1:]}
+        table_names = [table.name for table in MonitoringDB.Base.metadata.sorted_tables]
+        with HealthDB.AttachedDatabases(self.year_dbs[years[0]], attached_dbs) as attached:
+            try:
+                for table_name in table_names:
+                    attached.connection.execute(self.union_view_sql(table_name, ['main'] + list(attached_dbs)))
+                yield attached.session
+            finally:
+                # the views would hide the tables from later users of the pooled connection
+                for table_name in table_names:
+                    attached.connection.execute(f'DROP VIEW IF EXISTS temp.{table_name}')
+
+
+class MonitoringYears(object):
+    """
+    The monitoring databases, one per year when monitoring year files are enabled.
+
+    With year files, garmin_monitoring_<year>.db holds the monitoring data timestamped in that year, matching the
+    monitoring/<year> layout of the downloaded files. A year can be rebuilt on its own and queries of recent periods don't pay
+    for the size of the old data. Without year files all years map to the one garmin_monitoring.db. Reading never creates a
+    year's database, it's created when monitoring data for the year is written.
+    """
+
+    # SQLite's default limit on the number of attached databases
+    max_attached_dbs = 10
+    union_script_name = 'garmin_monitoring_years.sql'
+
+    def __init__(self, db_params, debug_level=0, open_db=None):
+        """
+        Return an instance of MonitoringYears.
+
+        Parameters:
+        ----------
+        db_params (DbParams): configuration data for accessing the databases
+        debug_level (int): debug level used when opening the databases
+        open_db (function): called with a database class and db_params to open a database, the shared instances are used by default
+
+        """
+        self.db_params = db_params
+        self.enabled = getattr(db_params, 'monitoring_year_files', False)
+        self.open_db = open_db or (lambda db_class, db_params: HealthDB.DbRegistry.get(db_class, db_params, debug_level))
+        self.dbs = {}
+
+    def year_db_params(self, year):
+        """Return the db_params of the monitoring database of a year."""
+        if not self.enabled:
+            return self.db_params
+        return utilities.DbParams(**dict(vars(self.db_params), monitoring_year=year))
+
+    def years(self):
+        """Return the years that have a monitoring database, oldest first, [None] when there is one database for all years."""
+        if not self.enabled:
+            return [None]
+        return MonitoringDB.sqlite_years(self.db_params)
+
+    def __open(self, year):
+        key = year if self.enabled else None
+        if key not in self.dbs:
+            self.dbs[key] = self.open_db(MonitoringDB, self.year_db_params(year))
+        return self.dbs[key]
+
+    def db(self, year):
+        """Return the monitoring database of a year, None if the year doesn't have one. Only writes, with managed_sessions, create databases."""
+        key = year if self.enabled else None
+        if key not in self.dbs and key not in self.years():
+            return None
+        return self.__open(year)
+
+    def all_db_params(self):
+        """Return the db_params of all of the existing monitoring databases."""
+        return [self.year_db_params(year) for year in self.years()]
+
+    def all_dbs(self):
+        """Return all of the existing monitoring databases, oldest first."""
+        return [self.db(year) for year in self.years()]
+
+    def latest_db(self):
+        """Return the monitoring database of the latest year with data, None if there isn't one."""
+        years = self.years()
+        return self.db(years[-1]) if years else None
+
+    @classmethod
+    def __last_year(cls, end_ts):
+        # periods run up to, but don't include, end_ts
+        before_end = datetime.timedelta(microseconds=1) if isinstance(end_ts, datetime.datetime) else datetime.timedelta(days=1)
+        return (end_ts - before_end).year
+
+    def for_period(self, start_ts, end_ts):
+        """
+        Return a database for reading the monitoring data of a period, a union of the years' databases if the period spans years.
+
+        None is returned if none of the years of the period have a database.
+        """
+        if not self.enabled:
+            return self.db(None)
+        existing_years = self.years()
+        years = [year for year in range(start_ts.year, self.__last_year(end_ts) + 1) if year in existing_years]
+        if not years:
+            return None
+        if len(years) == 1:
+            return self.db(years[0])
+        if len(years) > self.max_attached_dbs + 1:
+            raise ValueError(f'The period {start_ts} to {end_ts} spans more than {self.max_attached_dbs + 1} monitoring years')
+        return MonitoringUnionDB({year: self.db(year) for year in years})
+
+    @contextmanager
+    def managed_sessions(self):
+        """Return a function that returns the session of the monitoring database for a timestamp. All of the sessions are committed on exit."""
+        with ExitStack() as stack:
+            sessions = {}
+
+            def session(timestamp):
+                year = timestamp.year if self.enabled else None
+                if year not in sessions:
+                    sessions[year] = stack.enter_context(self.__open(year).managed_session())
+                return sessions[year]
+
+            yield session
+
+    def row_count(self, table):
+        """Return the number of rows in a monitoring table over all of the years."""
+        return sum(table.row_count(db) for db in self.all_dbs())
+
+    def get_coverage(self, table):
+        """Return the coverage by year and the gaps in days with data within each year of a monitoring table."""
+        coverage = []
+        gaps = []
+        for db in self.all_dbs():
+            with db.managed_session() as session:
+                coverage += table.s_get_coverage_by_year(session)
+                gaps += table.s_get_day_gaps(session)
+        return (coverage, gaps)
+
+    def write_union_script(self):
+        """Write a SQLite script that attaches the latest years and creates union views of the monitoring tables, for use with sqlite3 -init."""
+        years = self.years()[-self.max_attached_dbs:]
+        if not self.enabled or not years:
+            return
+        schemas = [f'y{year}' for year in years]
+        statements = [f"ATTACH DATABASE '{MonitoringDB._sqlite_path(self.year_db_params(year))}' AS {schema}" for year, schema in zip(years, schemas)]
+        statements += [MonitoringUnionDB.union_view_sql(table.name, schemas) for table in MonitoringDB.Base.metadata.sorted_tables]
+        filename = f'{self.db_params.db_path}/{self.union_script_name}'
+        logger.info("Writing the union views of monitoring years %s to %s", years, filename)
+        with open(filename, 'w') as file:
+            file.write(';\n'.join(statements) + ';\n')
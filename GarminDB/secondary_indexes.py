@@ -0,0 +1,56 @@
+"""Secondary indexes that are declared with a table and created in existing databases."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+import logging
+from sqlalchemy import inspect
+
+
+logger = logging.getLogger(__name__)
+
+
+class SecondaryIndexesObject(object):
+    """
+    Mixin for tables with secondary indexes declared as Index instances in __table_args__.
+
+    New databases get the indexes when the tables are created. Tables created before an index was declared get it when the
+    database is opened, so adding an index doesn't need a table version change and a rebuild of the database. The mixin has
+    to come before the DBObject base class.
+    """
+
+    @classmethod
+    def setup(cls, db):
+        """Initialize per table data and create any missing secondary indexes."""
+        super().setup(db)
+        cls.create_missing_indexes(db)
+
+    @classmethod
+    def secondary_indexes(cls):
+        """Return the table's declared secondary indexes."""
+        return sorted(cls.__table__.indexes, key=lambda index: index.name)
+
+    @classmethod
+    def __existing_index_names(cls, db):
+        return {index['name'] for index in inspect(db.engine).get_indexes(cls.__tablename__)}
+
+    @classmethod
+    def create_missing_indexes(cls, db):
+        """Create the declared secondary indexes that don't exist in the database."""
+        existing_index_names = cls.__existing_index_names(db)
+        for index in cls.secondary_indexes():
+            if index.name not in existing_index_names:
+                logger.info("Creating index %s on %s", index.name, cls.__tablename__)
+                index.create(db.engine)
+
+    @classmethod
+    def rebuild_indexes(cls, db):
+        """Drop and recreate the declared secondary indexes."""
+        existing_index_names = cls.__existing_index_names(db)
+        for index in cls.secondary_indexes():
+            logger.info("Rebuilding index %s on %s", index.name, cls.__tablename__)
+            if index.name in existing_index_names:
+                index.drop(db.engine)
+            index.create(db.engine)
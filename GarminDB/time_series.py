@@ -0,0 +1,197 @@
+"""Time series of monitoring table columns held as NumPy arrays for vectorized statistics."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+import collections
+import logging
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import HealthDB
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimeSeries(object):
+    """
+    A table column over a time period as arrays of timestamps, in seconds since the epoch, and values.
+
+    Timestamps are the naive local times the databases store, counted as if they were UTC, so whole days are multiples of
+    86400 seconds. Loaded series are kept in a small LRU cache that is cleared for a database when a session flushes to it
+    or BulkWriter writes rows to it.
+    """
+
+    cache_size = 16
+    __cache = collections.OrderedDict()
+    secs_per_day = 86400
+
+    def __init__(self, timestamps, values):
+        """Return a TimeSeries instance given sorted arrays of epoch seconds and values."""
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.timestamps.setflags(write=False)
+        self.values.setflags(write=False)
+
+    def __len__(self):
+        """Return the number of samples in the series."""
+        return len(self.timestamps)
+
+    @classmethod
+    def epoch_secs(cls, timestamp):
+        """Return a datetime or date as seconds since the epoch."""
+        return int(np.datetime64(timestamp, 's').astype(np.int64))
+
+    @classmethod
+    def to_datetimes(cls, timestamps):
+        """Return a list of datetimes for an array of epoch seconds."""
+        return np.asarray(timestamps, dtype='datetime64[s]').tolist()
+
+    @classmethod
+    def to_days(cls, timestamps):
+        """Return a list of dates for an array of epoch seconds."""
+        return np.asarray(timestamps, dtype='datetime64[s]').astype('datetime64[D]').tolist()
+
+    @classmethod
+    def db_urls(cls, session):
+        """Return the urls of the databases a session reads, all of the databases for a session on attached databases."""
+        if 'db_urls' in session.info:
+            return session.info['db_urls']
+        bind = session.get_bind()
+        # sessions may be bound to a connection instead of an engine
+        return (str(getattr(bind, 'engine', bind).url),)
+
+    @classmethod
+    def __cache_key(cls, session, table, col, start_ts, end_ts, ignore_le_zero):
+        return (cls.db_urls(session), table.__tablename__, col.key, start_ts, end_ts, ignore_le_zero)
+
+    @classmethod
+    def clear_cache(cls, url=None):
+        """Forget the cached series, only those read from the database at url if given."""
+        for key in [key for key in cls.__cache if url is None or url in key[0]]:
+            del cls.__cache[key]
+
+    @classmethod
+    def s_get(cls, session, table, col, start_ts, end_ts, ignore_le_zero=False):
+        """
+        Return a TimeSeries for a table column from start_ts up to, but not including, end_ts.
+
+        Parameters:
+        ----------
+        session (Session): the session for the table's database
+        table (DBObject): the table to load the series from
+        col (Column): the column with the series values, rows where it is NULL are skipped
+        start_ts (datetime): the start of the time period
+        end_ts (datetime): the end of the time period
+        ignore_le_zero (Boolean): skip rows where the column value is less than or equal to zero
+
+        """
+        key = cls.__cache_key(session, table, col, start_ts, end_ts, ignore_le_zero)
+        series = cls.__cache.get(key)
+        if series is not None:
+            cls.__cache.move_to_end(key)
+            return series
+        query = session.query(table.time_col, col).filter(table.time_col >= start_ts).filter(table.time_col < end_ts).filter(col != None)  # noqa
+        if ignore_le_zero:
+            query = query.filter(col > 0)
+        rows = query.order_by(table.time_col).all()
+        series = cls(np.array([row[0] for row in rows], dtype='datetime64[s]').astype(np.int64), [row[1] for row in rows])
+        logger.debug("Loaded %d samples of %s.%s", len(series), table.__tablename__, col.key)
+        cls.__cache[key] = series
+        if len(cls.__cache) > cls.cache_size:
+            cls.__cache.popitem(last=False)
+        return series
+
+    @classmethod
+    def get(cls, db, table, col, start_ts, end_ts, ignore_le_zero=False):
+        """Return a TimeSeries for a table column from start_ts up to, but not including, end_ts."""
+        with db.managed_session() as session:
+            return cls.s_get(session, table, col, start_ts, end_ts, ignore_le_zero)
+
+    def datetimes(self):
+        """Return the timestamps as a list of datetimes."""
+        return self.to_datetimes(self.timestamps)
+
+    def index_range(self, start_ts, end_ts):
+        """Return the (first, last) slice indexes of the samples from start_ts up to, but not including, end_ts."""
+        return tuple(np.searchsorted(self.timestamps, [self.epoch_secs(start_ts), self.epoch_secs(end_ts)]))
+
+    def between(self, start_ts, end_ts):
+        """Return the part of the series from start_ts up to, but not including, end_ts."""
+        first, last = self.index_range(start_ts, end_ts)
+        return TimeSeries(self.timestamps[first:last], self.values[first:last])
+
+    def __reduce_per_bin(self, bins, ufunc):
+        # The timestamps are sorted so each bin's samples are contiguous and reduceat can aggregate them all at once.
+        starts = np.flatnonzero(np.diff(bins, prepend=bins[0] - 1))
+        return (bins[starts], ufunc.reduceat(self.values, starts), np.diff(np.append(starts, len(bins))))
+
+    def resample(self, period_secs, how='mean'):
+        """Return a series with one sample per period with data, the mean, min, max, or sum of the period's samples, timestamped at the period's start."""
+        if not len(self):
+            return self
+        bins = self.timestamps // period_secs
+        ufunc = {'mean': np.add, 'sum': np.add, 'min': np.minimum, 'max': np.maximum}[how]
+        bin_numbers, values, counts = self.__reduce_per_bin(bins, ufunc)
+        if how == 'mean':
+            values = values / counts
+        return TimeSeries(bin_numbers * period_secs, values)
+
+    def __windows(self, window):
+        return np.lib.stride_tricks.sliding_window_view(self.values, window)
+
+    def rolling_min(self, window):
+        """Return a series of the minimum of each window of samples, timestamped at the window's last sample."""
+        if len(self) < window:
+            return TimeSeries([], [])
+        return TimeSeries(self.timestamps[window - 1:], self.__windows(window).min(axis=1))
+
+    def rolling_mean(self, window):
+        """Return a series of the mean of each window of samples, timestamped at the window's last sample."""
+        if len(self) < window:
+            return TimeSeries([], [])
+        return TimeSeries(self.timestamps[window - 1:], self.__windows(window).mean(axis=1))
+
+    def per_day(self, how):
+        """Return a dict, keyed by day, of the mean, min, max, or sum of the values of each day with data."""
+        daily = self.resample(self.secs_per_day, how)
+        return dict(zip(self.to_days(daily.timestamps), daily.values.tolist()))
+
+    def max_per_day(self):
+        """Return a dict, keyed by day, of the maximum value for each day with data."""
+        return self.per_day('max')
+
+    def sum_of_max_per_day(self):
+        """Return the sum of the daily maximums, the total for a counter that accumulates over each day."""
+        return float(sum(self.max_per_day().values()))
+
+    def percentile(self, percentiles):
+        """Return the given percentile, or list of percentiles, of the values."""
+        if not len(self):
+            return None
+        result = np.percentile(self.values, percentiles)
+        return result.tolist() if np.ndim(result) else float(result)
+
+
+def __clear_session_cache(session):
+    for url in TimeSeries.db_urls(session):
+        TimeSeries.clear_cache(url)
+
+
+def __session_flushed(session, flush_context):
+    # The session wrote to its database, so any series loaded from that database may be stale.
+    if session.bind is not None:
+        __clear_session_cache(session)
+
+
+def __rows_bulk_written(session, table, rows):
+    # bulk written rows are executed, not flushed
+    __clear_session_cache(session)
+
+
+event.listen(Session, 'after_flush', __session_flushed)
+HealthDB.BulkWriter.add_listener(__rows_bulk_written)
@@ -8,3 +8,10 @@ __license__ = "GPL"
 
 from HealthDB.summary_base import SummaryBase
 from HealthDB.summary_db import SummaryDB, Summary, YearsSummary, MonthsSummary, WeeksSummary, DaysSummary
+from HealthDB.attached_databases import AttachedDatabases
+from HealthDB.summary_copy import copy_summary_rows
+from HealthDB.db_registry import DbRegistry
+from HealthDB.sqlite_profile import SqliteProfile
+from HealthDB.bulk_writer import BulkWriter
+from HealthDB.sqlite_maintenance import SqliteMaintenance
+from HealthDB.view_definitions import ViewDefinitions
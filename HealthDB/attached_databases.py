@@ -0,0 +1,96 @@
+"""A session on a SQLite database with other databases attached so that statements can span databases."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+from sqlalchemy import MetaData, Table, Column, text
+from sqlalchemy.sql import visitors
+from sqlalchemy.orm import Session
+
+
+logger = logging.getLogger(__name__)
+
+
+class AttachedDatabases(object):
+    """
+    A session on one connection to a SQLite database with other SQLite databases ATTACHed under schema names.
+
+    Used as a context manager. The session is committed on exit, unless an exception was raised, and the databases are
+    detached before the connection is returned to the pool. The session's info['db_urls'] lists the urls of all of the
+    databases it reads, since its bind is a connection to the main database only. table() returns a table under the schema of its database so that
+    statements can join and copy between tables of different databases and adapt() rewrites a statement built on the tables of
+    the attached databases to use them under their schemas.
+    """
+
+    def __init__(self, main_db, attached_dbs):
+        """
+        Return an instance of AttachedDatabases.
+
+        Parameters:
+        ----------
+        main_db (DB): the database that the connection is made to, its tables are used without a schema
+        attached_dbs (dict): schema names mapped to the databases that are attached under them
+
+        """
+        self.main_db = main_db
+        self.attached_dbs = attached_dbs
+        self.metadata = MetaData()
+        self.connection = None
+        self.session = None
+
+    def __enter__(self):
+        """Open the connection, attach the databases, and start a session."""
+        self.connection = self.main_db.engine.connect()
+        # SQLite can't attach a database inside of a transaction
+        for schema, db in self.attached_dbs.items():
+            logger.debug("Attaching %s as %s", db.db_name, schema)
+            self.connection.execute(text(f'ATTACH DATABASE :path AS {schema}'), path=db._sqlite_path(db.db_params))
+        db_urls = tuple(str(db.engine.url) for db in [self.main_db] + list(self.attached_dbs.values()))
+        self.session = Session(bind=self.connection, info={'db_urls': db_urls})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Commit or rollback the session, detach the databases, and close the connection."""
+        try:
+            if exc_type is None:
+                self.session.commit()
+            else:
+                self.session.rollback()
+        finally:
+            self.session.close()
+            for schema in self.attached_dbs:
+                self.connection.execute(text(f'DETACH DATABASE {schema}'))
+            self.connection.close()
+
+    def __attached_table(self, schema, table):
+        key = f'{schema}.{table.name}'
+        if key in self.metadata.tables:
+            return self.metadata.tables[key]
+        return table.tometadata(self.metadata, schema=schema)
+
+    def __schema(self, table):
+        for schema, db in self.attached_dbs.items():
+            if table.metadata is db.Base.metadata:
+                return schema
+
+    def table(self, table_class):
+        """Return the Table for a database object class, under its database's schema if it's in an attached database."""
+        for schema, db in self.attached_dbs.items():
+            if isinstance(db, table_class.db):
+                return self.__attached_table(schema, table_class.__table__)
+        return table_class.__table__
+
+    def adapt(self, clause):
+        """Return a copy of a statement with the tables of the attached databases, and their columns, under their schemas."""
+        def replace(element):
+            if isinstance(element, Table) and element.schema is None:
+                schema = self.__schema(element)
+                if schema is not None:
+                    return self.__attached_table(schema, element)
+            elif isinstance(element, Column) and isinstance(element.table, Table) and element.table.schema is None:
+                schema = self.__schema(element.table)
+                if schema is not None:
+                    return self.__attached_table(schema, element.table).c[element.key]
+        return visitors.replacement_traverse(clause, {}, replace)
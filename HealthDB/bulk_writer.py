@@ -0,0 +1,95 @@
+"""Batched writes of rows to MySQL databases."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import mysql
+
+
+logger = logging.getLogger(__name__)
+
+
+class BulkWriter(object):
+    """
+    Insert or update rows with multi-row INSERT ... ON DUPLICATE KEY UPDATE statements on MySQL.
+
+    insert_or_update costs a SELECT and an INSERT or UPDATE round trip per row, which dominates imports over a network
+    connection. On MySQL rows are buffered in the session, grouped by table and by the columns that have values, and written
+    batch_rows at a time and when the session is committed. Columns a row has no value for keep their existing values. On
+    other databases rows are written with the table's s_insert_or_update as before.
+
+    The ORM events aren't fired for bulk written rows. Functions that need to know about written rows register with
+    add_listener and are called with the session, the table, and the list of row dicts after each batch is written.
+    """
+
+    batch_rows = 1000
+    __listeners = []
+
+    @classmethod
+    def add_listener(cls, listener):
+        """Call listener(session, table, rows) after each batch of rows is written."""
+        cls.__listeners.append(listener)
+
+    @classmethod
+    def remove_listener(cls, listener):
+        """Stop calling a listener added with add_listener."""
+        cls.__listeners.remove(listener)
+
+    @classmethod
+    def enabled(cls, session):
+        """Return True if rows written to the session are batched."""
+        return session.get_bind().dialect.name == 'mysql'
+
+    @classmethod
+    def s_insert_or_update(cls, session, table, values_dict, ignore_none=True):
+        """
+        Insert or update a row of a table, keyed by the table's primary key.
+
+        Parameters:
+        ----------
+        session (Session): the session the row is written with
+        table (DBObject): the table the row is written to
+        values_dict (dict): the row's values keyed by column name
+        ignore_none (Boolean): columns whose value is None aren't written
+
+        """
+        if not cls.enabled(session):
+            table.s_insert_or_update(session, values_dict, ignore_none=ignore_none)
+            return
+        if ignore_none:
+            values_dict = {key: value for key, value in values_dict.items() if value is not None}
+        # rows in a multi-row INSERT have to have the same columns
+        key = (table, tuple(sorted(values_dict)))
+        pending = session.info.setdefault('bulk_writer_rows', {})
+        pending.setdefault(key, []).append(values_dict)
+        if len(pending[key]) >= cls.batch_rows:
+            cls.__s_write(session, table, pending.pop(key))
+
+    @classmethod
+    def s_flush(cls, session):
+        """Write all of the rows buffered in the session."""
+        for (table, columns), rows in session.info.pop('bulk_writer_rows', {}).items():
+            cls.__s_write(session, table, rows)
+
+    @classmethod
+    def __s_write(cls, session, table, rows):
+        insert = mysql.insert(table.__table__).values(rows)
+        primary_keys = [col.name for col in table.__table__.primary_key.columns]
+        updates = {col: insert.inserted[col] for col in rows[0] if col not in primary_keys}
+        # a row of only primary key values updates nothing, but ON DUPLICATE KEY UPDATE needs at least one column
+        session.execute(insert.on_duplicate_key_update(updates or {col: insert.inserted[col] for col in primary_keys}))
+        logger.debug("Wrote %d rows to %s", len(rows), table.__tablename__)
+        for listener in cls.__listeners:
+            listener(session, table, rows)
+
+
+def __discard_rows(session, previous_transaction):
+    session.info.pop('bulk_writer_rows', None)
+
+
+event.listen(Session, 'before_commit', BulkWriter.s_flush)
+event.listen(Session, 'after_soft_rollback', __discard_rows)
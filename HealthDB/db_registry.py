@@ -0,0 +1,85 @@
+"""A process wide registry of open databases."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+
+logger = logging.getLogger(__name__)
+
+
+class DbRegistry(object):
+    """
+    Hands out one instance of each database per set of database parameters for the life of the process.
+
+    Opening a database creates its engine and runs the schema, version, and view checks. The registry does that once per
+    database instead of every time a database object is needed. The debug level of the first request for a database is the
+    one used.
+    """
+
+    __dbs = {}
+    # SQLite engines default to opening a new connection for every session, repeating the connect time setup each time.
+    sqlite_pool_size = 5
+    mysql_pool_size = 5
+    mysql_pool_recycle = 3600
+
+    @classmethod
+    def __key(cls, db_class, db_params):
+        return (db_class, tuple(sorted(vars(db_params).items())))
+
+    @classmethod
+    def __use_engine(cls, db, engine):
+        # The database's sessions are made by its sessionmaker, so it has to be bound to the pooled engine too.
+        db.engine.dispose()
+        db.engine = engine
+        db.session_maker.configure(bind=engine)
+
+    @classmethod
+    def __pool_sqlite_connections(cls, db):
+        # Connections are only used by one thread at a time, but may be returned to the pool from a different thread.
+        engine = create_engine(db.engine.url, echo=db.engine.echo, poolclass=QueuePool, pool_size=cls.sqlite_pool_size,
+                               connect_args={'check_same_thread': False})
+        cls.__use_engine(db, engine)
+
+    @classmethod
+    def __pool_mysql_connections(cls, db):
+        # Pre-ping replaces connections the server dropped while they were idle in the pool, recycling replaces them before
+        # the server's wait_timeout drops them.
+        db_params = db.db_params
+        engine = create_engine(db.engine.url, echo=db.engine.echo,
+                               pool_size=getattr(db_params, 'db_pool_size', cls.mysql_pool_size),
+                               max_overflow=getattr(db_params, 'db_max_overflow', cls.mysql_pool_size),
+                               pool_pre_ping=getattr(db_params, 'db_pool_pre_ping', True),
+                               pool_recycle=getattr(db_params, 'db_pool_recycle', cls.mysql_pool_recycle))
+        cls.__use_engine(db, engine)
+
+    @classmethod
+    def get(cls, db_class, db_params, debug=0):
+        """Return the shared instance of db_class for db_params, opening it if this is the first request for it."""
+        key = cls.__key(db_class, db_params)
+        db = cls.__dbs.get(key)
+        if db is None:
+            logger.debug("Opening %s", db_class.__name__)
+            db = db_class(db_params, debug)
+            if db_params.db_type == 'sqlite':
+                cls.__pool_sqlite_connections(db)
+            elif db_params.db_type == 'mysql':
+                cls.__pool_mysql_connections(db)
+            cls.__dbs[key] = db
+        return db
+
+    @classmethod
+    def dispose(cls):
+        """Close the pooled connections of all of the shared databases, new connections are made as they're needed."""
+        for db in cls.__dbs.values():
+            db.engine.dispose()
+
+    @classmethod
+    def clear(cls):
+        """Close and forget all of the shared databases, for instance before their files are deleted."""
+        cls.dispose()
+        cls.__dbs.clear()
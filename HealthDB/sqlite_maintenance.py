@@ -0,0 +1,103 @@
+"""Maintenance of SQLite database files: planner statistics, vacuuming, integrity checks, and size reports."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteMaintenance(object):
+    """
+    Maintenance operations on the SQLite file of a database.
+
+    Years of upserts leave the files fragmented and, without ANALYZE, the query planner has no statistics to choose between
+    indexes with. The operations run on their own connection outside of any session since VACUUM can't run in a transaction.
+    """
+
+    # PRAGMA auto_vacuum values
+    auto_vacuum_incremental = 2
+
+    @classmethod
+    def __execute(cls, db, statement):
+        with db.engine.connect() as connection:
+            connection.execute(statement)
+
+    @classmethod
+    def __pragma(cls, db, pragma):
+        with db.engine.connect() as connection:
+            return connection.execute(f'PRAGMA {pragma}').scalar()
+
+    @classmethod
+    def analyze(cls, db, analysis_limit=None):
+        """
+        Gather the query planner statistics for all of the tables and indexes.
+
+        Parameters:
+        ----------
+        db (DB): the database to analyze
+        analysis_limit (int): if not None, the approximate number of rows of each index that are examined, for fast approximate statistics
+
+        """
+        with db.engine.connect() as connection:
+            if analysis_limit is not None:
+                connection.execute(f'PRAGMA analysis_limit = {analysis_limit}')
+            connection.execute('ANALYZE')
+
+    @classmethod
+    def optimize(cls, db):
+        """Refresh the query planner statistics that SQLite considers out of date."""
+        cls.__execute(db, 'PRAGMA optimize')
+
+    @classmethod
+    def vacuum(cls, db):
+        """
+        Return the pages freed by vacuuming the database file.
+
+        The first vacuum of a file rebuilds it with incremental auto vacuum enabled, later vacuums only release the free pages.
+        """
+        before_pages = cls.__pragma(db, 'page_count')
+        if cls.__pragma(db, 'auto_vacuum') == cls.auto_vacuum_incremental:
+            with db.engine.connect() as connection:
+                # executescript steps the statement to completion, each step of incremental_vacuum only frees one page
+                connection.connection.executescript('PRAGMA incremental_vacuum')
+        else:
+            with db.engine.connect() as connection:
+                # only takes effect on the rebuild of the file
+                connection.execute(f'PRAGMA auto_vacuum = {cls.auto_vacuum_incremental}')
+                connection.execute('VACUUM')
+        return before_pages - cls.__pragma(db, 'page_count')
+
+    @classmethod
+    def integrity_check(cls, db):
+        """Return a list of the problems found in the database file, empty if there are none."""
+        with db.engine.connect() as connection:
+            return [row[0] for row in connection.execute('PRAGMA integrity_check') if row[0] != 'ok']
+
+    @classmethod
+    def file_size(cls, db):
+        """Return the size, in bytes, of the database file."""
+        return cls.__pragma(db, 'page_count') * cls.__pragma(db, 'page_size')
+
+    @classmethod
+    def table_sizes(cls, db):
+        """Return a list of dicts of the name, row count, page count, and table and index size in bytes of each table, largest first."""
+        with db.engine.connect() as connection:
+            objects = connection.execute("SELECT name, tbl_name, type FROM sqlite_master WHERE type IN ('table', 'index')").fetchall()
+            # dbstat has a row per page of each table and index
+            pages = {name: (page_count, size) for name, page_count, size in connection.execute('SELECT name, count(*), sum(pgsize) FROM dbstat GROUP BY name')}
+            tables = {}
+            for name, table_name, object_type in objects:
+                # SQLite's own tables, like sqlite_stat1, aren't reported, the indexes it makes for unique constraints are
+                if object_type == 'table' and not name.startswith('sqlite_'):
+                    rows = connection.execute(f'SELECT count(*) FROM "{name}"').scalar()
+                    tables[name] = {'table': name, 'rows': rows, 'pages': 0, 'table_bytes': 0, 'index_bytes': 0}
+            for name, table_name, object_type in objects:
+                if table_name in tables:
+                    (page_count, size) = pages.get(name, (0, 0))
+                    tables[table_name]['pages'] += page_count
+                    tables[table_name]['table_bytes' if object_type == 'table' else 'index_bytes'] += size
+        return sorted(tables.values(), key=lambda table: table['table_bytes'] + table['index_bytes'], reverse=True)
@@ -0,0 +1,53 @@
+"""SQLite performance profiles that are applied to new database connections."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+from HealthDB.db_registry import DbRegistry
+
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteProfile(object):
+    """A named set of PRAGMA settings applied to every new SQLite connection while the profile is active."""
+
+    profiles = {
+        # SQLite's defaults: a rollback journal and a sync on every commit.
+        'safe'      : {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'temp_store': 'DEFAULT', 'cache_size': -2000, 'mmap_size': 0},
+        # Readers don't block the writer and reads of large tables are served from a memory map.
+        'query'     : {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'temp_store': 'MEMORY', 'cache_size': -65536, 'mmap_size': 268435456},
+        # Bulk imports and summaries: a large page cache and map. A crash can lose the last commits, but not corrupt the database.
+        'import'    : {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'temp_store': 'MEMORY', 'cache_size': -262144, 'mmap_size': 1073741824},
+    }
+    active = None
+
+    @classmethod
+    def activate(cls, name):
+        """Apply the named profile to SQLite connections made from now on, or SQLite's defaults if name is None."""
+        if name is not None and name not in cls.profiles:
+            raise ValueError(f'Unknown SQLite profile {name}, expected one of {list(cls.profiles)}')
+        logger.info("Using SQLite profile %s", name)
+        cls.active = name
+        # pooled connections were set up with the previous profile
+        DbRegistry.dispose()
+
+    @classmethod
+    def _connected(cls, dbapi_connection, connection_record):
+        if cls.active is None or not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        for pragma, value in cls.profiles[cls.active].items():
+            try:
+                dbapi_connection.execute(f'PRAGMA {pragma} = {value}')
+            except sqlite3.Error as e:
+                # for instance the journal mode can't be changed while another connection has the database open
+                logger.warning("Failed to set %s to %s: %s", pragma, value, e)
+
+
+event.listen(Pool, 'connect', SqliteProfile._connected)
@@ -119,6 +119,17 @@ class SummaryBase(DBObject):
         """Return the percentage of floors goal achieved."""
         return func.round((cls.floors * 100) / cls.floors_goal)
 
+    @classmethod
+    def s_bulk_insert_or_update(cls, session, values_list):
+        """Insert or update many summary rows with a single lookup of the existing rows. None values don't overwrite existing values."""
+        time_col_name = cls.time_col.name
+        rows = [{key: value for key, value in cls.intersection(values).items() if value is not None} for values in values_list]
+        if not rows:
+            return
+        existing = {row[0] for row in session.query(cls.time_col).filter(cls.time_col.in_([row[time_col_name] for row in rows])).all()}
+        session.bulk_update_mappings(cls, [row for row in rows if row[time_col_name] in existing])
+        session.bulk_insert_mappings(cls, [row for row in rows if row[time_col_name] not in existing])
+
     @classmethod
     def create_summary_view(cls, db, selectable):
         """Create a view in the database from the passed in selectable."""
@@ -0,0 +1,61 @@
+"""Functions for copying summary rows between databases."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+from sqlalchemy import select, inspect
+
+from HealthDB.attached_databases import AttachedDatabases
+
+
+logger = logging.getLogger(__name__)
+
+
+def copy_summary_rows(src_db, src_table, dest_db, dest_table, start_ts=None, end_ts=None):
+    """
+    Copy rows from one summary table to another, replacing any destination rows with the same key.
+
+    Parameters:
+    ----------
+    src_db (DB): the database the rows are copied from
+    src_table (DBObject): the table the rows are copied from
+    dest_db (DB): the database the rows are copied to
+    dest_table (DBObject): the table the rows are copied to
+    start_ts (date): if given, only copy rows with a time column value on or after this
+    end_ts (date): if given, only copy rows with a time column value before this
+
+    """
+    col_names = [col_name for col_name in dest_table.col_names if col_name in src_table.col_names]
+    if src_db.db_params.db_type == 'sqlite' and dest_db.db_params.db_type == 'sqlite':
+        __sqlite_copy_rows(src_db, src_table, dest_db, dest_table, col_names, start_ts, end_ts)
+    else:
+        __copy_rows(src_db, src_table, dest_db, dest_table, col_names, start_ts, end_ts)
+
+
+def __sqlite_copy_rows(src_db, src_table, dest_db, dest_table, col_names, start_ts, end_ts):
+    # Copy the rows inside SQLite without fetching them into Python.
+    with AttachedDatabases(src_db, {'dest': dest_db}) as attached:
+        src = attached.table(src_table)
+        query = select([src.c[col_name] for col_name in col_names])
+        if start_ts is not None:
+            query = query.where(src.c[src_table.time_col_name] >= start_ts)
+        if end_ts is not None:
+            query = query.where(src.c[src_table.time_col_name] < end_ts)
+        result = attached.session.execute(attached.table(dest_table).insert().prefix_with('OR REPLACE').from_select(col_names, query))
+        logger.debug("Copied %d rows from %s to %s", result.rowcount, src_table.__tablename__, dest_db.db_name)
+
+
+def __copy_rows(src_db, src_table, dest_db, dest_table, col_names, start_ts, end_ts):
+    with src_db.managed_session() as src_session:
+        query = src_session.query(*[getattr(src_table, col_name) for col_name in col_names])
+        if start_ts is not None:
+            query = query.filter(src_table.time_col >= start_ts)
+        if end_ts is not None:
+            query = query.filter(src_table.time_col < end_ts)
+        rows = [row._asdict() for row in query.all()]
+    primary_key = inspect(dest_table).primary_key[0]
+    with dest_db.managed_session() as dest_session:
+        dest_session.query(dest_table).filter(primary_key.in_([row[primary_key.name] for row in rows])).delete(synchronize_session=False)
+        dest_session.bulk_insert_mappings(dest_table, rows)
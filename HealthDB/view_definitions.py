@@ -0,0 +1,150 @@
+"""Deferred creation of database views that only replaces views whose definitions changed."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import re
+import hashlib
+import logging
+import contextlib
+from sqlalchemy import inspect, text
+
+from utilities import DBObject
+
+
+logger = logging.getLogger(__name__)
+
+
+class _StatementRecorder(object):
+    """Stands in for a database and its sessions, recording the statements executed with them instead of running them."""
+
+    def __init__(self, db):
+        """Record the statements executed with the sessions of db."""
+        self.db = db
+        self.statements = []
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    @contextlib.contextmanager
+    def managed_session(self):
+        """Yield a session of the database whose execute records the statement."""
+        with self.db.managed_session() as session:
+            yield _RecordingSession(session, self.statements)
+
+
+class _RecordingSession(object):
+
+    def __init__(self, session, statements):
+        self.session = session
+        self.statements = statements
+
+    def __getattr__(self, name):
+        # queries are still compiled against the session's database
+        return getattr(self.session, name)
+
+    def execute(self, statement, *args, **kwargs):
+        self.statements.append(str(statement))
+
+
+class ViewDefinitions(object):
+    """
+    Defers the creation and deletion of the views tables define until a program that writes the databases asks for them.
+
+    Tables create their views every time a database is opened, a session and a CREATE VIEW IF NOT EXISTS statement per view,
+    and a view whose definition changed is only replaced if its table's view_version was bumped. While deferred, DBObject's
+    view helpers record their statements instead of running them and create_pending runs them later, dropped views first.
+    A hash of each view's definition is kept in the _view_definitions table of its database and a view is only dropped and
+    recreated when its hash changes.
+    """
+
+    table_name = '_view_definitions'
+    view_helpers = ['create_view_if_doesnt_exist', 'create_join_view', 'create_multi_join_view', '_create_view_from_selectable', 'delete_view']
+    create_view_re = re.compile(r'CREATE VIEW IF NOT EXISTS (\w+) AS ', re.IGNORECASE)
+    drop_view_re = re.compile(r'DROP VIEW IF EXISTS (\w+)', re.IGNORECASE)
+    deferred = False
+    # engine url: (engine, {view name: statement}, {dropped view names})
+    __pending = {}
+
+    @classmethod
+    def defer(cls, deferred=True):
+        """Record the views databases create and delete from now on, instead of running them, until create_pending is called."""
+        cls.deferred = deferred
+
+    @classmethod
+    def pending_views(cls):
+        """Return the names of the views waiting to be created."""
+        return [view_name for engine, views, dropped_views in cls.__pending.values() for view_name in views]
+
+    @classmethod
+    def hook_view_helpers(cls, db_object_class):
+        """Make the view helpers of a DBObject class record their statements while views are deferred."""
+        for helper_name in cls.view_helpers:
+            cls.__hook_view_helper(db_object_class, helper_name)
+
+    @classmethod
+    def __hook_view_helper(cls, db_object_class, helper_name):
+        helper = getattr(db_object_class, helper_name).__func__
+
+        def deferrable_helper(table, db, *args, **kwargs):
+            if not cls.deferred:
+                return helper(table, db, *args, **kwargs)
+            recorder = _StatementRecorder(db)
+            helper(table, recorder, *args, **kwargs)
+            for statement in recorder.statements:
+                cls.__record(db, statement)
+
+        setattr(db_object_class, helper_name, classmethod(deferrable_helper))
+
+    @classmethod
+    def __record(cls, db, statement):
+        (engine, views, dropped_views) = cls.__pending.setdefault(str(db.engine.url), (db.engine, {}, set()))
+        create_match = cls.create_view_re.match(statement)
+        if create_match:
+            views[create_match.group(1)] = statement
+            return
+        drop_match = cls.drop_view_re.match(statement)
+        if drop_match:
+            dropped_views.add(drop_match.group(1))
+            return
+        logger.warning("Unexpected view statement: %s", statement)
+
+    @classmethod
+    def __definition_hash(cls, statement):
+        return hashlib.sha1(statement.encode()).hexdigest()
+
+    @classmethod
+    def __create_views(cls, engine, views, dropped_views):
+        created = 0
+        with engine.connect() as connection:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS {cls.table_name} (name VARCHAR(128) PRIMARY KEY, hash VARCHAR(40))')
+            for view_name in dropped_views:
+                logger.info("Dropping view %s", view_name)
+                connection.execute(f'DROP VIEW IF EXISTS {view_name}')
+            existing_views = set(inspect(connection).get_view_names())
+            hashes = dict(connection.execute(f'SELECT name, hash FROM {cls.table_name}').fetchall())
+            for view_name, statement in views.items():
+                definition_hash = cls.__definition_hash(statement)
+                # views dropped by view version changes are recreated even if their definition is the same
+                if view_name in existing_views and hashes.get(view_name) == definition_hash:
+                    continue
+                logger.info("Creating view %s", view_name)
+                connection.execute(f'DROP VIEW IF EXISTS {view_name}')
+                connection.execute(statement)
+                connection.execute(text(f'DELETE FROM {cls.table_name} WHERE name = :name'), name=view_name)
+                connection.execute(text(f'INSERT INTO {cls.table_name} (name, hash) VALUES (:name, :hash)'), name=view_name, hash=definition_hash)
+                created += 1
+        return created
+
+    @classmethod
+    def create_pending(cls):
+        """Drop the views waiting to be deleted and return the number of views that were created or replaced, out of the views waiting to be created."""
+        created = 0
+        while cls.__pending:
+            (url, (engine, views, dropped_views)) = cls.__pending.popitem()
+            created += cls.__create_views(engine, views, dropped_views)
+        return created
+
+
+ViewDefinitions.hook_view_helpers(DBObject)
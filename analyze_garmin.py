@@ -8,7 +8,9 @@ import sys
 import logging
 import datetime
 import calendar
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+from sqlalchemy import event
 
 import Fit
 import Fit.conversions
@@ -27,19 +29,56 @@ stat_logger.addHandler(logging.FileHandler('stats.txt', 'w'))
 class Analyze(object):
     """Object for analyzing health data from Garmin devices."""
 
-    def __init__(self, db_params, debug):
-        """Return an instance of the Analyze class."""
-        self.garmin_db = GarminDB.GarminDB(db_params, debug)
-        self.garmin_mon_db = GarminDB.MonitoringDB(db_params, debug)
-        self.garmin_sum_db = GarminDB.GarminSummaryDB(db_params, debug)
-        self.sum_db = HealthDB.SummaryDB(db_params, debug)
-        self.garmin_act_db = GarminDB.ActivitiesDB(db_params, debug)
+    def __init__(self, db_params, debug, read_only=False):
+        """
+        Return an instance of the Analyze class.
+
+        Parameters:
+        ----------
+        db_params (DbParams): configuration data for accessing the databases
+        debug (int): debug level
+        read_only (Boolean): only allow queries on the SQLite databases, used by the worker processes of parallel summaries
+
+        """
+        self.db_params = db_params
+        self.debug = debug
+        self.garmin_db = self.__open_db(GarminDB.GarminDB, read_only)
+        self.garmin_mon_dbs = GarminDB.MonitoringYears(db_params, debug, lambda db_class, db_params: self.__open_db(db_class, read_only, db_params))
+        self.garmin_sum_db = self.__open_db(GarminDB.GarminSummaryDB, read_only)
+        self.sum_db = self.__open_db(HealthDB.SummaryDB, read_only)
+        self.garmin_act_db = self.__open_db(GarminDB.ActivitiesDB, read_only)
+        # SQLite databases can be attached to each other and the days computed with statements across them. The worker processes
+        # only read the databases, so they compute the same rows with per database queries and NumPy, and so does MySQL.
+        self.attach_dbs = db_params.db_type == 'sqlite' and not read_only
         self.measurement_system = GarminDB.Attributes.measurements_type(self.garmin_db)
         self.unit_strings = Fit.units.unit_strings[self.measurement_system]
 
+    def __open_db(self, db_class, read_only, db_params=None):
+        db_params = db_params or self.db_params
+        # Read only instances, in worker processes, get their own databases so that they can be restricted to queries.
+        if read_only:
+            db = db_class(db_params, self.debug)
+            if db_params.db_type == 'sqlite':
+                self.__set_query_only(db)
+            return db
+        return HealthDB.DbRegistry.get(db_class, db_params, self.debug)
+
+    @classmethod
+    def __set_query_only(cls, db):
+        event.listen(db.engine, 'connect', lambda dbapi_connection, connection_record: dbapi_connection.execute('PRAGMA query_only = ON'))
+        # drop any pooled connections made before the listener was added
+        db.engine.dispose()
+
     def __save_summary_stat(self, name, value):
-        GarminDB.Summary.set(self.garmin_sum_db, name, value)
-        HealthDB.Summary.set(self.sum_db, name, value)
+        self.summary_stats[name] = value
+
+    def __write_summary_stats(self):
+        # Write the stats to the Garmin summary DB once and then copy them to the health summary DB.
+        timestamp = datetime.datetime.now()
+        with self.garmin_sum_db.managed_session() as garmin_sum_session:
+            for name, value in self.summary_stats.items():
+                GarminDB.Summary.s_insert_or_update(garmin_sum_session, {'timestamp' : timestamp, 'key' : name, 'value' : str(value)})
+        HealthDB.copy_summary_rows(self.garmin_sum_db, GarminDB.Summary, self.sum_db, HealthDB.Summary)
 
     def __report_file_type(self, file_type):
         records = GarminDB.File.row_count(self.garmin_db, GarminDB.File.type, file_type)
@@ -54,12 +93,9 @@ class Analyze(object):
         for file_type_name in [file_type.name for file_type in GarminDB.File.FileType]:
             self.__report_file_type(file_type_name)
 
-    def __report_sport(self, sport_col, sport):
-        Fit.units.unit_strings[self.measurement_system]
-        records = GarminDB.Activities.row_count(self.garmin_act_db, sport_col, sport)
+    def __report_sport(self, sport, records, total_distance):
         if records > 0:
             sport_title = sport.title().replace('_', ' ')
-            total_distance = GarminDB.Activities.get_col_sum_for_value(self.garmin_act_db, GarminDB.Activities.distance, sport_col, sport)
             if total_distance is None:
                 total_distance = 0
                 average_distance = 0
@@ -79,7 +115,7 @@ class Analyze(object):
         laps = GarminDB.ActivityLaps.row_count(self.garmin_act_db)
         stat_logger.info("Activities lap records: %d", laps)
         self.__save_summary_stat('Activity_laps', laps)
-        records = GarminDB.ActivityRecords.row_count(self.garmin_act_db)
+        records = GarminDB.ActivityRecords.row_count(self.garmin_act_db) + GarminDB.ActivityRecordStreams.get_records_count(self.garmin_act_db)
         stat_logger.info("Activity records: %d", records)
         self.__save_summary_stat('Activity_records', records)
         years = GarminDB.Activities.get_years(self.garmin_act_db)
@@ -95,8 +131,8 @@ class Analyze(object):
         stat_logger.info("Sports: %s", ', '.join(sports))
         sub_sports = list_not_none(GarminDB.Activities.get_col_distinct(self.garmin_act_db, GarminDB.Activities.sub_sport))
         stat_logger.info("SubSports: %s", ', '.join(sub_sports))
-        for sport_name in [sport.name for sport in Fit.Sport]:
-            self.__report_sport(GarminDB.Activities.sport, sport_name)
+        for sport, (records, total_distance) in GarminDB.Activities.get_sport_stats(self.garmin_act_db).items():
+            self.__report_sport(sport, records, total_distance)
 
     def __get_col_stats(self, table, col, name, ignore_le_zero=False, time_col=False):
         records = table.row_count(self.garmin_db)
@@ -127,199 +163,330 @@ class Analyze(object):
         self.__get_col_stats(GarminDB.Sleep, GarminDB.Sleep.total_sleep, 'Sleep', True, True)
         self.__get_col_stats(GarminDB.Sleep, GarminDB.Sleep.rem_sleep, 'REM Sleep', True, True)
 
-    def __get_monitoring_days(self, year):
-        days = GarminDB.Monitoring.get_days(self.garmin_mon_db, year)
-        days_count = len(days)
-        if days_count > 0:
-            first_day = days[0]
-            last_day = days[-1]
-            span = last_day - first_day + 1
-        else:
-            span = 0
-        self.__save_summary_stat(str(year) + '_days', days_count)
-        self.__save_summary_stat(str(year) + '_days_span', span)
-        stat_logger.info("%d Days with data (%d count vs %d span): %s", year, days_count, span, days)
-        for index in range(days_count - 1):
-            day = int(days[index])
-            next_day = int(days[index + 1])
-            if next_day != day + 1:
-                day_str = str(Fit.conversions.day_of_the_year_to_datetime(year, day))
-                next_day_str = str(Fit.conversions.day_of_the_year_to_datetime(year, next_day))
-                stat_logger.info("Days gap between %d (%s) and %d (%s)", day, day_str, next_day, next_day_str)
-        return days_count
-
-    def __get_monitoring_months(self, year):
-        months = GarminDB.Monitoring.get_month_names(self.garmin_mon_db, year)
-        self.__save_summary_stat(str(year) + '_months', len(months))
-        stat_logger.info("%s Months with data (%s): %s", year, len(months), months)
-
     def __get_monitoring_years(self):
         stat_logger.info("___Monitoring Records Coverage___")
         stat_logger.info("This shows periods that data has been downloaded for. "
                          "Not seeing data for days you know Garmin has data? "
                          "Change the starting day and the number of days in GarminConnectConfig.json and do a full download.")
-        years = GarminDB.Monitoring.get_years(self.garmin_mon_db)
+        (coverage, gaps) = self.garmin_mon_dbs.get_coverage(GarminDB.Monitoring)
+        years = [year for year, days_count, span, months in coverage]
         self.__save_summary_stat('Monitoring_Years', len(years))
-        stat_logger.info("Monitoring records: %d", GarminDB.Monitoring.row_count(self.garmin_mon_db))
+        stat_logger.info("Monitoring records: %d", self.garmin_mon_dbs.row_count(GarminDB.Monitoring))
         stat_logger.info("Monitoring Years with data (%d): %s", len(years), years)
         total_days = 0
-        for year in years:
-            self.__get_monitoring_months(year)
-            total_days += self.__get_monitoring_days(year)
+        for year, days_count, span, months in coverage:
+            month_names = [calendar.month_abbr[month] for month in months]
+            self.__save_summary_stat(str(year) + '_months', len(months))
+            stat_logger.info("%s Months with data (%s): %s", year, len(months), month_names)
+            self.__save_summary_stat(str(year) + '_days', days_count)
+            self.__save_summary_stat(str(year) + '_days_span', span)
+            stat_logger.info("%d Days with data (%d count vs %d span)", year, days_count, span)
+            # steps accumulate over each day, so the year's total is the sum of the daily maximums
+            steps = GarminDB.TimeSeries.get(self.garmin_mon_dbs.db(year), GarminDB.Monitoring, GarminDB.Monitoring.steps,
+                                            datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)).sum_of_max_per_day()
+            self.__save_summary_stat(str(year) + '_steps', int(steps))
+            stat_logger.info("%d steps: %d", year, steps)
+            for day, next_day in [(day, next_day) for day, next_day in gaps if day.year == year]:
+                stat_logger.info("Days gap between %s and %s", day, next_day)
+            total_days += days_count
         stat_logger.info("Total days with monitoring data: %d", total_days)
 
     def get_stats(self):
         """Calculate summary statistics."""
+        self.summary_stats = {}
         self.__get_files_stats()
         self.__get_activities_stats()
         self.__get_monitoring_stats()
         self.__get_monitoring_years()
+        self.__write_summary_stats()
+
+    @classmethod
+    def __unpopulated_hr_intensity_days(cls, year, days, overwrite, garmin_sum_session):
+        if overwrite:
+            return days
+        populated_days = {datetime.date(year, 1, 1) + datetime.timedelta(day - 1) for day in GarminDB.IntensityHR.s_get_days(garmin_sum_session, year)}
+        return sorted(set(days) - populated_days)
+
+    @classmethod
+    def __days_span(cls, days):
+        return (datetime.datetime.combine(min(days), datetime.time.min), datetime.datetime.combine(max(days), datetime.time.min) + datetime.timedelta(1))
+
+    def __hr_intensity_entries(self, year, days, overwrite, garmin_mon_session, garmin_sum_session):
+        days = self.__unpopulated_hr_intensity_days(year, days, overwrite, garmin_sum_session)
+        if not days:
+            return []
+        # Load the intensity and heart rate series for the whole span and match them up with vectorized searches instead of querying per gap.
+        (start_ts, end_ts) = self.__days_span(days)
+        intensity = GarminDB.TimeSeries.s_get(garmin_mon_session, GarminDB.Monitoring, GarminDB.Monitoring.intensity, start_ts, end_ts)
+        hr = GarminDB.TimeSeries.s_get(garmin_mon_session, GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts)
+        return GarminDB.IntensityHR.entries_from_series(intensity, hr, days)
 
-    def __populate_hr_intensity(self, day_date, garmin_mon_session, garmin_sum_session, overwrite=False):
-        if GarminDB.IntensityHR.s_row_count_for_day(garmin_sum_session, day_date) == 0 or overwrite:
-            monitoring_rows = GarminDB.Monitoring._get_for_day(garmin_mon_session, day_date, not_none_col=GarminDB.Monitoring.intensity)
-            previous_ts = None
-            for monitoring in monitoring_rows:
-                # Heart rate value is for one minute, reported at the end of the minute. Only take HR values where the
-                # measurement period falls within the activity period.
-                if previous_ts is not None and (monitoring.timestamp - previous_ts).total_seconds() > 60:
-                    hr_rows = GarminDB.MonitoringHeartRate.s_get_for_period(garmin_mon_session, previous_ts, previous_ts + datetime.timedelta(seconds=60),
-                                                                            not_none_col=monitoring.timestamp)
-                    for hr in hr_rows:
-                        entry = {
-                            'timestamp'     : hr.timestamp,
-                            'intensity'     : monitoring.intensity,
-                            'heart_rate'    : hr.heart_rate
-                        }
-                        GarminDB.IntensityHR.s_insert_or_update(garmin_sum_session, entry, ignore_none=True)
-                previous_ts = monitoring.timestamp
-
-    def __calculate_day_stats(self, day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = GarminDB.DailySummary.get_daily_stats(garmin_session, day_date)
-        # prefer getting stats from the daily summary.
-        if stats.get('rhr_avg') is None:
-            stats.update(GarminDB.RestingHeartRate.get_daily_stats(garmin_session, day_date))
-        if stats.get('stress_avg') is None:
-            stats.update(GarminDB.Stress.get_daily_stats(garmin_session, day_date))
-        if stats.get('intensity_time') is None:
-            stats.update(GarminDB.MonitoringIntensity.get_daily_stats(garmin_mon_session, day_date))
-        if stats.get('floors') is None:
-            stats.update(GarminDB.MonitoringClimb.get_daily_stats(garmin_mon_session, day_date, self.measurement_system))
-        if stats.get('steps') is None:
-            stats.update(GarminDB.Monitoring.get_daily_stats(garmin_mon_session, day_date))
-        stats.update(GarminDB.MonitoringHeartRate.get_daily_stats(garmin_mon_session, day_date))
-        stats.update(GarminDB.IntensityHR.get_daily_stats(garmin_sum_session, day_date))
-        stats.update(GarminDB.Weight.get_daily_stats(garmin_session, day_date))
-        stats.update(GarminDB.Sleep.get_daily_stats(garmin_session, day_date))
-        stats.update(GarminDB.Activities.get_daily_stats(garmin_act_session, day_date))
-        # save it to the db
-        GarminDB.DaysSummary.s_insert_or_update(garmin_sum_session, stats)
-        HealthDB.DaysSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_days(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        days = GarminDB.Monitoring.s_get_days(garmin_mon_session, year)
-        for day in tqdm(days, unit='days'):
-            day_date = datetime.date(year, 1, 1) + datetime.timedelta(day - 1)
-            self.__populate_hr_intensity(day_date, garmin_mon_session, garmin_sum_session)
-            self.__calculate_day_stats(day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-
-    def __calculate_week_stats(self, day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = GarminDB.DailySummary.get_weekly_stats(garmin_session, day_date)
-        # prefer getting stats from the daily summary.
-        if stats.get('rhr_avg') is None:
-            stats.update(GarminDB.RestingHeartRate.get_weekly_stats(garmin_session, day_date))
-        if stats.get('stress_avg') is None:
-            stats.update(GarminDB.Stress.get_weekly_stats(garmin_session, day_date))
-        if stats.get('intensity_time') is None:
-            stats.update(GarminDB.MonitoringIntensity.get_weekly_stats(garmin_mon_session, day_date))
-        if stats.get('floors') is None:
-            stats.update(GarminDB.MonitoringClimb.get_weekly_stats(garmin_mon_session, day_date, self.measurement_system))
-        if stats.get('steps') is None:
-            stats.update(GarminDB.Monitoring.get_weekly_stats(garmin_mon_session, day_date))
-        stats.update(GarminDB.MonitoringHeartRate.get_weekly_stats(garmin_mon_session, day_date))
-        stats.update(GarminDB.IntensityHR.get_weekly_stats(garmin_sum_session, day_date))
-        stats.update(GarminDB.Weight.get_weekly_stats(garmin_session, day_date))
-        stats.update(GarminDB.Sleep.get_weekly_stats(garmin_session, day_date))
-        stats.update(GarminDB.Activities.get_weekly_stats(garmin_act_session, day_date))
-        # save it to the db
-        GarminDB.WeeksSummary.s_insert_or_update(garmin_sum_session, stats)
-        HealthDB.WeeksSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_weeks(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        for week_starting_day in tqdm(range(1, 365, 7), unit='weeks'):
-            day_date = datetime.date(year, 1, 1) + datetime.timedelta(week_starting_day - 1)
-            if day_date < datetime.datetime.now().date():
-                self.__calculate_week_stats(day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-
-    def __calculate_month_stats(self, start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = GarminDB.DailySummary.get_monthly_stats(garmin_session, start_day_date, end_day_date)
-        # prefer getting stats from the daily summary.
-        if 'rhr_avg' in stats:
-            stats.update(GarminDB.RestingHeartRate.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        if 'stress_avg' in stats:
-            stats.update(GarminDB.Stress.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        if 'intensity_time' in stats:
-            stats.update(GarminDB.MonitoringIntensity.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date))
-        if 'floors' in stats:
-            stats.update(GarminDB.MonitoringClimb.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date, self.measurement_system))
-        if 'steps' in stats:
-            stats.update(GarminDB.Monitoring.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date))
-        stats.update(GarminDB.MonitoringHeartRate.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date))
-        stats.update(GarminDB.IntensityHR.get_monthly_stats(garmin_sum_session, start_day_date, end_day_date))
-        stats.update(GarminDB.Weight.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        stats.update(GarminDB.Sleep.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        stats.update(GarminDB.Activities.get_monthly_stats(garmin_act_session, start_day_date, end_day_date))
-        # save it to the db
-        GarminDB.MonthsSummary.s_insert_or_update(garmin_sum_session, stats)
-        HealthDB.MonthsSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_months(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        months = GarminDB.Monitoring.s_get_months(garmin_mon_session, year)
+    def __save_hr_intensity(self, days, overwrite, entries, garmin_sum_session):
+        if overwrite:
+            GarminDB.IntensityHR.s_delete_days(garmin_sum_session, days)
+        garmin_sum_session.bulk_insert_mappings(GarminDB.IntensityHR, entries)
+
+    def __populate_hr_intensity(self, year, days, overwrite):
+        # The same rows as __hr_intensity_entries, inserted by SQLite with the monitoring DB attached to the summary DB.
+        with HealthDB.AttachedDatabases(self.garmin_sum_db, {'mon': self.garmin_mon_dbs.db(year)}) as attached:
+            days = self.__unpopulated_hr_intensity_days(year, days, overwrite, attached.session)
+            if not days:
+                return
+            if overwrite:
+                GarminDB.IntensityHR.s_delete_days(attached.session, days)
+            (start_ts, end_ts) = self.__days_span(days)
+            query = GarminDB.IntensityHR.select_from_tables(attached.table(GarminDB.Monitoring), attached.table(GarminDB.MonitoringHeartRate), start_ts, end_ts, days)
+            result = attached.session.execute(GarminDB.IntensityHR.__table__.insert().from_select(['timestamp', 'intensity', 'heart_rate'], query))
+            logger.debug("Added %d intensity_hr rows for %s", result.rowcount, year)
+
+    def __daily_stats_by_table(self, year, days, tables, garmin_mon_db):
+        start_ts = datetime.date(year, 1, 1)
+        end_ts = datetime.date(year + 1, 1, 1)
+        if self.attach_dbs:
+            # the GROUP BY day queries of all of the tables in one statement across the databases
+            with HealthDB.AttachedDatabases(self.garmin_sum_db, {'garmin': self.garmin_db, 'mon': garmin_mon_db, 'act': self.garmin_act_db}) as attached:
+                return GarminDB.get_daily_stats_for_tables(attached, tables, start_ts, end_ts, days)
+        # one GROUP BY day query per table
+        return [table.get_daily_stats_for_period(session, start_ts, end_ts, *args, days=days) for table, session, *args in tables]
+
+    def calculate_days(self, year, days, overwrite):
+        """
+        Return the intensity_hr rows and the daily summaries for the given days of a year without writing to the databases.
+
+        With attached SQLite databases the intensity_hr rows are returned as None, __save_year inserts them with one statement.
+        """
+        if not days:
+            # the days are the days with monitoring data, so there may not be a monitoring database for the year
+            return ([], {})
+        garmin_mon_db = self.garmin_mon_dbs.db(year)
+        with self.garmin_db.managed_session() as garmin_session, garmin_mon_db.managed_session() as garmin_mon_session, \
+                self.garmin_act_db.managed_session() as garmin_act_session, self.garmin_sum_db.managed_session() as garmin_sum_session:
+            hr_intensity_entries = None if self.attach_dbs else self.__hr_intensity_entries(year, days, overwrite, garmin_mon_session, garmin_sum_session)
+            # prefer getting stats from the daily summary, the fallback tables only fill in the stats it's missing
+            fallback_tables = [
+                ('rhr_avg',         (GarminDB.RestingHeartRate,      garmin_session)),
+                ('stress_avg',      (GarminDB.Stress,                garmin_session)),
+                ('intensity_time',  (GarminDB.MonitoringIntensity,   garmin_mon_session)),
+                ('floors',          (GarminDB.MonitoringClimb,       garmin_mon_session, self.measurement_system)),
+                ('steps',           (GarminDB.Monitoring,            garmin_mon_session)),
+            ]
+            tables = [
+                (GarminDB.MonitoringHeartRate,  garmin_mon_session),
+                (GarminDB.Weight,               garmin_session),
+                (GarminDB.Sleep,                garmin_session),
+                (GarminDB.Activities,           garmin_act_session),
+            ]
+            all_tables = [(GarminDB.DailySummary, garmin_session)] + [table for stat_name, table in fallback_tables] + tables
+            (daily_stats, *tables_daily_stats) = self.__daily_stats_by_table(year, days, all_tables, garmin_mon_db)
+            for (stat_name, table), table_daily_stats in zip(fallback_tables, tables_daily_stats):
+                for day_date, stats in daily_stats.items():
+                    if stats.get(stat_name) is None:
+                        stats.update(table_daily_stats[day_date])
+            for table_daily_stats in tables_daily_stats[len(fallback_tables):]:
+                for day_date, stats in table_daily_stats.items():
+                    daily_stats[day_date].update(stats)
+            self.__fill_resting_heart_rates(year, daily_stats, garmin_mon_session)
+        return (hr_intensity_entries, daily_stats)
+
+    @classmethod
+    def __fill_resting_heart_rates(cls, year, daily_stats, garmin_mon_session):
+        # Without a resting heart rate from the daily summary or the resting heart rate table, derive it from the monitoring heart rate.
+        missing_days = [day_date for day_date, stats in daily_stats.items() if stats.get('rhr_avg') is None]
+        if missing_days:
+            resting_heart_rates = GarminDB.MonitoringHeartRate.s_get_resting_heart_rates(garmin_mon_session, datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1))
+            for day_date in missing_days:
+                resting_heart_rate = resting_heart_rates.get(day_date)
+                if resting_heart_rate is not None:
+                    daily_stats[day_date].update({'rhr_avg' : resting_heart_rate, 'rhr_min' : resting_heart_rate, 'rhr_max' : resting_heart_rate})
+
+    def __save_days(self, year, days, overwrite, hr_intensity_entries, daily_stats, garmin_sum_session):
+        if hr_intensity_entries is not None:
+            self.__save_hr_intensity(days, overwrite, hr_intensity_entries, garmin_sum_session)
+        # the inactive heart rate stats come from the intensity_hr rows that were just saved
+        start_ts = datetime.date(year, 1, 1)
+        end_ts = datetime.date(year + 1, 1, 1)
+        for day_date, stats in GarminDB.IntensityHR.get_daily_stats_for_period(garmin_sum_session, start_ts, end_ts, days=days).items():
+            daily_stats[day_date].update(stats)
+        GarminDB.DaysSummary.s_bulk_insert_or_update(garmin_sum_session, list(daily_stats.values()))
+
+    def __calculate_period_stats(self, first_day, end_day, garmin_sum_session, sum_times=True):
+        # Roll the period up from the day summaries instead of rescanning the source tables.
+        stats = GarminDB.DaysSummary.get_stats(garmin_sum_session, first_day, end_day, sum_times)
+        stats['first_day'] = first_day
+        return stats
+
+    def __calculate_weeks(self, year, weeks, garmin_sum_session):
+        weeks_stats = []
+        for week in tqdm(weeks, unit='weeks'):
+            day_date = datetime.date(year, 1, 1) + datetime.timedelta(week * 7)
+            weeks_stats.append(self.__calculate_period_stats(day_date, day_date + datetime.timedelta(7), garmin_sum_session))
+        GarminDB.WeeksSummary.s_bulk_insert_or_update(garmin_sum_session, weeks_stats)
+
+    def __calculate_months(self, year, months, garmin_sum_session):
+        months_stats = []
         for month in tqdm(months, unit='months'):
             start_day_date = datetime.date(year, month, 1)
-            end_day_date = datetime.date(year, month, calendar.monthrange(year, month)[1])
-            self.__calculate_month_stats(start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-
-    def __calculate_year_stats(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = GarminDB.DailySummary.get_yearly_stats(garmin_session, year)
-        # prefer getting stats from the daily summary.
-        if 'rhr_avg' in stats:
-            stats.update(GarminDB.RestingHeartRate.get_yearly_stats(garmin_session, year))
-        if 'stress_avg' in stats:
-            stats.update(GarminDB.Stress.get_yearly_stats(garmin_session, year))
-        if 'intensity_time' in stats:
-            stats.update(GarminDB.MonitoringIntensity.get_yearly_stats(garmin_mon_session, year))
-        if 'floors' in stats:
-            stats.update(GarminDB.MonitoringClimb.get_yearly_stats(garmin_mon_session, year, self.measurement_system))
-        if 'steps' in stats:
-            stats.update(GarminDB.Monitoring.get_yearly_stats(garmin_mon_session, year))
-        stats.update(GarminDB.MonitoringHeartRate.get_yearly_stats(garmin_mon_session, year))
-        stats.update(GarminDB.IntensityHR.get_yearly_stats(garmin_sum_session, year))
-        stats.update(GarminDB.Weight.get_yearly_stats(garmin_session, year))
-        stats.update(GarminDB.Sleep.get_yearly_stats(garmin_session, year))
-        stats.update(GarminDB.Activities.get_yearly_stats(garmin_act_session, year))
-        # save it to the db
-        GarminDB.YearsSummary.s_insert_or_update(garmin_sum_session, stats)
-        HealthDB.YearsSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_year(self, year):
-        with self.garmin_db.managed_session() as garmin_session, self.garmin_mon_db.managed_session() as garmin_mon_session, \
-                self.garmin_act_db.managed_session() as garmin_act_session, self.garmin_sum_db.managed_session() as garmin_sum_session, \
-                self.sum_db.managed_session() as sum_session:
-            # calculate part of the years
-            self.__calculate_days(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            self.__calculate_weeks(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            self.__calculate_months(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            # now calculate the year itself
-            self.__calculate_year_stats(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-
-    def summary(self):
-        """Summarize Garmin health data. Daily, weekly, and monthly, tables will be generated."""
+            end_day_date = start_day_date + datetime.timedelta(calendar.monthrange(year, month)[1])
+            months_stats.append(self.__calculate_period_stats(start_day_date, end_day_date, garmin_sum_session))
+        GarminDB.MonthsSummary.s_bulk_insert_or_update(garmin_sum_session, months_stats)
+
+    def __calculate_year_stats(self, year, garmin_sum_session):
+        # Summed activity times would overflow the time of day columns over a year, so use the daily averages instead.
+        year_stats = self.__calculate_period_stats(datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1), garmin_sum_session, sum_times=False)
+        GarminDB.YearsSummary.s_bulk_insert_or_update(garmin_sum_session, [year_stats])
+
+    @classmethod
+    def __week_of_year(cls, day_date):
+        # Weeks in the summary tables start on Jan 1st. The day or two after the 52nd week aren't part of a week.
+        return (day_date - datetime.date(day_date.year, 1, 1)).days // 7
+
+    def __source_tables(self):
+        monitoring_tables = [GarminDB.Monitoring, GarminDB.MonitoringHeartRate, GarminDB.MonitoringIntensity, GarminDB.MonitoringClimb]
+        return [
+            (GarminDB.DailySummary,         self.garmin_db),
+            (GarminDB.RestingHeartRate,     self.garmin_db),
+            (GarminDB.Stress,               self.garmin_db),
+            (GarminDB.Weight,               self.garmin_db),
+            (GarminDB.Sleep,                self.garmin_db),
+            (GarminDB.Activities,           self.garmin_act_db),
+        ] + [(table, garmin_mon_db) for garmin_mon_db in self.garmin_mon_dbs.all_dbs() for table in monitoring_tables]
+
+    @classmethod
+    def __to_date(cls, timestamp):
+        return timestamp.date() if isinstance(timestamp, datetime.datetime) else timestamp
+
+    def __get_coverage(self):
+        # One query per source table for the span of its data. Data dated in the future, from a device with a bad clock, is ignored.
+        today = datetime.date.today()
+        spans = []
+        for table, db in self.__source_tables():
+            with db.managed_session() as session:
+                (first_ts, last_ts) = table.s_get_time_span(session)
+            if first_ts is not None:
+                logger.debug("%s has data from %s to %s", table.__tablename__, first_ts, last_ts)
+                spans.append((self.__to_date(first_ts), min(self.__to_date(last_ts), today)))
+        if not spans:
+            return None
+        first_day = min(first_day for first_day, _ in spans)
+        last_day = max(last_day for _, last_day in spans)
+        return (first_day, last_day) if first_day <= last_day else None
+
+    def __plan_year(self, year, coverage, dirty_days=None):
+        (first_day, last_day) = coverage
+        garmin_mon_db = self.garmin_mon_dbs.db(year)
+        if garmin_mon_db is None:
+            # no monitoring data for the year, only weeks and months with other data that changed are summarized
+            days = []
+        else:
+            with garmin_mon_db.managed_session() as garmin_mon_session:
+                days = [datetime.date(year, 1, 1) + datetime.timedelta(day - 1) for day in GarminDB.Monitoring.s_get_days(garmin_mon_session, year)]
+        days = [day_date for day_date in days if first_day <= day_date <= last_day]
+        if dirty_days is None:
+            period_days = days
+        else:
+            # only recompute the days that changed and the weeks and months that contain them
+            days = [day_date for day_date in days if day_date in dirty_days]
+            period_days = [day_date for day_date in dirty_days if first_day <= day_date <= last_day]
+        # Only summarize the weeks and months with data, none of which are in the future.
+        weeks = sorted({self.__week_of_year(day_date) for day_date in period_days} & set(range(52)))
+        months = sorted({day_date.month for day_date in period_days})
+        if not (days or weeks or months):
+            return None
+        return (days, weeks, months, dirty_days is not None)
+
+    # About how many queries are made for each year regardless of its periods: the inactive heart rate stats, the year roll up,
+    # the summary writes, and the copies. Plus the intensity and heart rate series and the GROUP BY day queries of the source
+    # tables, or with attached databases the intensity_hr insert and the one statement for the source tables.
+    __queries_per_year = 1 + 1 + 5 + 4
+
+    def __estimate_queries(self, plan):
+        (days, weeks, months, overwrite) = plan
+        queries = self.__queries_per_year + (1 + 1 if self.attach_dbs else 2 + 10)
+        # Overwriting deletes the existing intensity rows a day at a time, otherwise the populated days are found with one query.
+        return queries + (len(days) if overwrite else 1) + len(weeks) + len(months)
+
+    def __report_plans(self, plans):
+        total_queries = 0
+        for year, plan in plans.items():
+            (days, weeks, months, overwrite) = plan
+            queries = self.__estimate_queries(plan)
+            total_queries += queries
+            logger.info("%s: %d days, %d weeks, %d months%s, about %d queries", year, len(days), len(weeks), len(months), ' (update)' if overwrite else '', queries)
+        logger.info("Summarizing %d years with about %d queries", len(plans), total_queries)
+
+    def __save_year(self, year, plan, hr_intensity_entries, daily_stats):
+        (days, weeks, months, overwrite) = plan
+        if hr_intensity_entries is None:
+            self.__populate_hr_intensity(year, days, overwrite)
+        with self.garmin_sum_db.managed_session() as garmin_sum_session:
+            self.__save_days(year, days, overwrite, hr_intensity_entries, daily_stats, garmin_sum_session)
+            # roll the days up into the weeks, months, and the year itself
+            self.__calculate_weeks(year, weeks, garmin_sum_session)
+            self.__calculate_months(year, months, garmin_sum_session)
+            self.__calculate_year_stats(year, garmin_sum_session)
+        # The summaries are computed once and written to the Garmin summary DB, then copied to the health summary DB.
+        summary_tables = [
+            (GarminDB.DaysSummary,      HealthDB.DaysSummary),
+            (GarminDB.WeeksSummary,     HealthDB.WeeksSummary),
+            (GarminDB.MonthsSummary,    HealthDB.MonthsSummary),
+            (GarminDB.YearsSummary,     HealthDB.YearsSummary),
+        ]
+        for garmin_table, health_table in summary_tables:
+            HealthDB.copy_summary_rows(self.garmin_sum_db, garmin_table, self.sum_db, health_table, datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1))
+
+    def __calculate_years(self, plans, jobs):
+        if jobs > 1 and len(plans) > 1:
+            # The years are computed in worker processes that only read the databases. The parent does all of the writes.
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = {executor.submit(_calculate_days, self.db_params, self.debug, year, days, overwrite): year for year, (days, weeks, months, overwrite) in plans.items()}
+                for future in as_completed(futures):
+                    year = futures[future]
+                    logger.info("Saving table entries for %s", year)
+                    self.__save_year(year, plans[year], *future.result())
+        else:
+            for year, (days, weeks, months, overwrite) in plans.items():
+                logger.info("Generating table entries for %s", year)
+                self.__save_year(year, plans[year], *self.calculate_days(year, days, overwrite))
+
+    def summary(self, full=False, jobs=1, dry_run=False):
+        """
+        Summarize Garmin health data. Daily, weekly, and monthly, tables will be generated.
+
+        Parameters:
+        ----------
+        full (Boolean): recompute all periods instead of only the periods with data that changed since the last summary
+        jobs (int): the number of processes to use for computing the summaries of different years in parallel
+        dry_run (Boolean): only report the periods that would be summarized and an estimate of the queries needed
+
+        """
         logger.info("Summary Tables Generation:")
-        years = GarminDB.Monitoring.get_years(self.garmin_mon_db)
-        for year in years:
-            logger.info("Generating table entries for %s", year)
-            self.__calculate_year(year)
+        coverage = self.__get_coverage()
+        if coverage is None:
+            logger.info("No data to summarize")
+            return
+        logger.info("Data from %s to %s", *coverage)
+        years = range(coverage[0].year, coverage[1].year + 1)
+        full = full or GarminDB.DaysSummary.row_count(self.garmin_sum_db) == 0
+        if full:
+            plans = {year: self.__plan_year(year, coverage) for year in years}
+        else:
+            dirty_days = GarminDB.DirtyDays.get_days(self.garmin_sum_db)
+            plans = {}
+            for year in {day_date.year for day_date in dirty_days}:
+                year_dirty_days = {day_date for day_date in dirty_days if day_date.year == year}
+                logger.info("Updating table entries for %d changed days in %s", len(year_dirty_days), year)
+                plans[year] = self.__plan_year(year, coverage, year_dirty_days) if year in years else None
+        updated_years = list(plans)
+        plans = {year: plan for year, plan in sorted(plans.items()) if plan is not None}
+        self.__report_plans(plans)
+        if dry_run:
+            return
+        self.__calculate_years(plans, jobs)
+        if full:
+            GarminDB.DirtyDays.clear_period(self.garmin_sum_db, datetime.date.min, datetime.date.max)
+        else:
+            for year in updated_years:
+                GarminDB.DirtyDays.clear_period(self.garmin_sum_db, datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1))
 
     def create_dynamic_views(self):
         """Create database views specific to the data in this database."""
@@ -328,3 +495,8 @@ class Analyze(object):
         if course_ids:
             for course_id in course_ids:
                 GarminDB.StepsActivities.create_course_view(self.garmin_act_db, course_id)
+
+
+def _calculate_days(db_params, debug, year, days, overwrite):
+    """Compute the day summaries for a year in a worker process."""
+    return Analyze(db_params, debug, read_only=True).calculate_days(year, days, overwrite)
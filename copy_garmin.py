@@ -6,7 +6,12 @@ __license__ = "GPL"
 
 import os
 import sys
-import shutil
+import re
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import logging
 
@@ -19,40 +24,144 @@ logger = logging.getLogger(__file__)
 logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 
 
+class CopyManifest(object):
+    """The name, size, mtime, and hash of every file previously copied from a device."""
+
+    def __init__(self, filename):
+        """Return a CopyManifest instance backed by the given JSON file."""
+        self.filename = filename
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.isfile(filename):
+            try:
+                with open(filename, 'r') as file:
+                    self.entries = json.load(file)
+            except ValueError as e:
+                logger.warning("Ignoring unreadable copy manifest %s: %s", filename, e)
+
+    chunk_size = 1024 * 1024
+
+    @classmethod
+    def sha256(cls, filename):
+        """Return the SHA-256 hex digest of a file's contents."""
+        sha256 = hashlib.sha256()
+        with open(filename, 'rb') as file:
+            for chunk in iter(lambda: file.read(cls.chunk_size), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def unchanged(self, src_file, dest_file):
+        """Return True if the source file matches the manifest entry and the copy still exists."""
+        entry = self.entries.get(src_file)
+        if entry is None or entry['dest'] != dest_file or not os.path.isfile(dest_file):
+            return False
+        stat = os.stat(src_file)
+        if entry['size'] != stat.st_size:
+            return False
+        if entry['mtime'] == stat.st_mtime:
+            return True
+        # The mtimes of files on a FAT formatted device shift with time zone and DST changes, so compare the contents.
+        if self.sha256(src_file) != entry['sha256']:
+            return False
+        self.update(src_file, dest_file, stat, entry['sha256'])
+        return True
+
+    def update(self, src_file, dest_file, stat, sha256):
+        """Record a file that was copied."""
+        with self.lock:
+            self.entries[src_file] = {'dest': dest_file, 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256}
+
+    def save(self):
+        """Atomically write the manifest to disk."""
+        temp_filename = f'{self.filename}.tmp'
+        with open(temp_filename, 'w') as file:
+            json.dump(self.entries, file, indent=1, sort_keys=True)
+        os.replace(temp_filename, self.filename)
+
+
 class Copy(object):
     """Class for copying data from a USB mounted Garmin device."""
 
-    def __init__(self, device_mount_dir):
-        """Create a Copy object given the directory where the Garmin USB device is mounted."""
+    chunk_size = 1024 * 1024
+
+    def __init__(self, device_mount_dir, threads=4):
+        """
+        Create a Copy object given the directory where the Garmin USB device is mounted.
+
+        Parameters:
+        ----------
+        device_mount_dir (string): the directory where the Garmin USB device is mounted
+        threads (int): the number of files to copy concurrently
+
+        """
         self.device_mount_dir = device_mount_dir
         if not os.path.exists(self.device_mount_dir):
             raise RuntimeError(f'Device mount directory {self.device_mount_dir} not found')
         if not os.path.isdir(self.device_mount_dir):
             raise RuntimeError(f'Device mount directory {self.device_mount_dir} not a directory')
+        self.threads = threads
+        self.manifest = CopyManifest(GarminDBConfigManager.get_copy_manifest_file(self.device_serial_number()))
+
+    def device_serial_number(self):
+        """Return the serial number of the mounted device, or the name of the mount directory if it can't be read."""
+        device_xml_file = GarminDBConfigManager.device_xml_file(self.device_mount_dir)
+        if os.path.isfile(device_xml_file):
+            with open(device_xml_file, 'r', errors='ignore') as file:
+                match = re.search(r'<Id>(\d+)</Id>', file.read())
+            if match:
+                return match.group(1)
+        logger.warning("Device serial number not found in %s", device_xml_file)
+        return os.path.basename(os.path.normpath(self.device_mount_dir))
+
+    def __copy_file(self, src_file, dest_file, progress):
+        """Copy a file to a temporary file alongside the destination, hashing it on the way, and rename it into place."""
+        stat = os.stat(src_file)
+        sha256 = hashlib.sha256()
+        # a hidden name without the FIT extension, that the import's file name regex doesn't match, so a partial copy is never imported
+        (dest_dir, dest_name) = os.path.split(dest_file)
+        temp_file = os.path.join(dest_dir, f'.{os.path.splitext(dest_name)[0]}.partial')
+        with open(src_file, 'rb') as src, open(temp_file, 'wb') as dest:
+            for chunk in iter(lambda: src.read(self.chunk_size), b''):
+                sha256.update(chunk)
+                dest.write(chunk)
+                progress.update(len(chunk))
+        os.replace(temp_file, dest_file)
+        self.manifest.update(src_file, dest_file, stat, sha256.hexdigest())
 
     def __copy(self, src_dir, dest_dir, latest=False):
-        """Copy FIT files from a USB mounted Garmin device to the given directory."""
+        """Copy new and changed FIT files from a USB mounted Garmin device to the given directory. Returns the list of files copied."""
         file_names = FileProcessor.dir_to_files(src_dir, Fit.file.name_regex, latest)
-        logger.info("Copying files from %s to %s", src_dir, dest_dir)
-        for file in tqdm(file_names, unit='files'):
-            shutil.copy(file, dest_dir)
+        copies = [(file, dest_dir + os.sep + os.path.basename(file)) for file in file_names]
+        changed = [(src_file, dest_file) for src_file, dest_file in copies if not self.manifest.unchanged(src_file, dest_file)]
+        total_bytes = sum(os.path.getsize(src_file) for src_file, _ in changed)
+        logger.info("Copying %d of %d files (%d bytes) from %s to %s", len(changed), len(copies), total_bytes, src_dir, dest_dir)
+        start_time = time.time()
+        with tqdm(total=total_bytes, unit='B', unit_scale=True) as progress:
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                for future in [executor.submit(self.__copy_file, src_file, dest_file, progress) for src_file, dest_file in changed]:
+                    future.result()
+        self.manifest.save()
+        elapsed = time.time() - start_time
+        if changed:
+            logger.info("Copied %d files (%d bytes) in %.1fs: %.2f MB/s", len(changed), total_bytes, elapsed, total_bytes / max(elapsed, 0.001) / (1024 * 1024))
+        return [dest_file for _, dest_file in changed]
 
     def copy_activities(self, activities_dir, latest=False):
         """Copy activites data FIT files from a USB mounted Garmin device to the given directory."""
         device_activities_dir = GarminDBConfigManager.device_activities_dir(self.device_mount_dir)
-        self.__copy(device_activities_dir, activities_dir, latest)
+        return self.__copy(device_activities_dir, activities_dir, latest)
 
     def copy_monitoring(self, monitoring_dir, latest=False):
         """Copy daily monitoring data FIT files from a USB mounted Garmin device to the given directory."""
         device_monitoring_dir = GarminDBConfigManager.device_monitoring_dir(self.device_mount_dir)
-        self.__copy(device_monitoring_dir, monitoring_dir, latest)
+        return self.__copy(device_monitoring_dir, monitoring_dir, latest)
 
     def copy_sleep(self, monitoring_dir, latest=False):
         """Copy daily sleep data FIT files from a USB mounted Garmin device to the given directory."""
         device_sleep_dir = GarminDBConfigManager.device_sleep_dir(self.device_mount_dir)
-        self.__copy(device_sleep_dir, monitoring_dir, latest)
+        return self.__copy(device_sleep_dir, monitoring_dir, latest)
 
     def copy_settings(self, settings_dir):
         """Copy settings FIT files from a USB mounted Garmin device to the given directory."""
         device_settings_dir = GarminDBConfigManager.device_settings_dir(self.device_mount_dir)
-        self.__copy(device_settings_dir, settings_dir)
+        return self.__copy(device_settings_dir, settings_dir)
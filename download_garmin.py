@@ -13,6 +13,7 @@ import time
 import tempfile
 import zipfile
 import json
+import hashlib
 import requests
 from tqdm import tqdm
 
@@ -27,6 +28,75 @@ logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 root_logger = logging.getLogger()
 
 
+class DownloadCache(object):
+    """Persistent store of HTTP validators (ETag, Last-Modified) for previously downloaded files."""
+
+    def __init__(self, filename):
+        """Return a DownloadCache instance backed by the given JSON file."""
+        self.filename = filename
+        self.entries = {}
+        if os.path.isfile(filename):
+            try:
+                with open(filename, 'r') as file:
+                    self.entries = json.load(file)
+            except ValueError as e:
+                logger.warning("Ignoring unreadable download cache %s: %s", filename, e)
+
+    def conditional_headers(self, key):
+        """Return If-None-Match/If-Modified-Since headers for key if all of the files it produced still exist."""
+        entry = self.entries.get(key)
+        if entry is None or not entry['files'] or not all(os.path.isfile(filename) for filename in entry['files']):
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, key, response, files=None):
+        """Record the validators the server returned for key."""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            self.entries[key] = {'etag': etag, 'last_modified': last_modified, 'files': files if files is not None else []}
+        else:
+            self.entries.pop(key, None)
+
+    def add_files(self, key, files):
+        """Record the files that were produced from the download identified by key."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry['files'] = sorted(set(entry['files']) | set(files))
+
+    def save(self):
+        """Write the cache to disk."""
+        write_if_changed(self.filename, json.dumps(self.entries, indent=1, sort_keys=True).encode())
+
+
+def file_hash(filename):
+    """Return the SHA-256 hex digest of a file's contents."""
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(65536), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_if_changed(filename, content):
+    """Atomically write content to a file unless it already holds identical content. Return True if the file was written."""
+    if os.path.isfile(filename) and os.path.getsize(filename) == len(content) and file_hash(filename) == hashlib.sha256(content).hexdigest():
+        root_logger.debug("Unchanged %s", filename)
+        return False
+    # a hidden name without the JSON extension, that the importers' file name regexes don't match, so a partial file is never imported
+    (dirname, basename) = os.path.split(filename)
+    temp_filename = os.path.join(dirname, f'.{os.path.splitext(basename)[0]}.partial')
+    with open(temp_filename, 'wb') as file:
+        file.write(content)
+    os.replace(temp_filename, filename)
+    return True
+
+
 class Download(object):
     """Class for downloading health data from Garmin Connect."""
 
@@ -66,6 +136,7 @@ class Download(object):
         self.download_service_rest_client = RestClient.inherit(self.modern_rest_client, "proxy/download-service/files")
         self.gc_config = GarminConnectConfigManager()
         self.download_days_overlap = self.gc_config.download_days_overlap()
+        self.cache = DownloadCache(GarminDBConfigManager.get_download_cache_file())
 
     def __get_json(self, page_html, key):
         found = re.search(key + r" = JSON.parse\(\"(.*)\"\);", page_html, re.M)
@@ -160,7 +231,7 @@ class Download(object):
             return False
         self.user_prefs = self.__get_json(response.text, 'VIEWER_USERPREFERENCES')
         if profile_dir:
-            self.modern_rest_client.save_json_to_file(f'{profile_dir}/profile.json', self.user_prefs)
+            self.__save_json_to_file(f'{profile_dir}/profile.json', self.user_prefs)
         self.display_name = self.user_prefs['displayName']
         self.social_profile = self.__get_json(response.text, 'VIEWER_SOCIAL_PROFILE')
         self.full_name = self.social_profile['fullName']
@@ -168,17 +239,66 @@ class Download(object):
         return True
 
     def unzip_files(self, outdir):
-        """Unzip and downloaded zipped files into the directory supplied."""
+        """Unzip and downloaded zipped files into the directory supplied. Files whose content hasn't changed are left untouched."""
         logger.info("unzip_files: " + outdir)
         for filename in os.listdir(self.temp_dir):
             match = re.search(r'.*\.zip', filename)
             if match:
                 full_pathname = f'{self.temp_dir}/{filename}'
-                with zipfile.ZipFile(full_pathname, 'r') as files_zip:
-                    try:
-                        files_zip.extractall(outdir)
-                    except Exception as e:
-                        logger.error('Failed to unzip %s to %s: %s', full_pathname, outdir, e)
+                try:
+                    with zipfile.ZipFile(full_pathname, 'r') as files_zip:
+                        extracted = [self.__extract_if_changed(files_zip, zip_info, outdir) for zip_info in files_zip.infolist() if not zip_info.is_dir()]
+                    self.cache.add_files(filename, extracted)
+                    os.remove(full_pathname)
+                except Exception as e:
+                    logger.error('Failed to unzip %s to %s: %s', full_pathname, outdir, e)
+        self.cache.save()
+
+    @classmethod
+    def __extract_if_changed(cls, files_zip, zip_info, outdir):
+        out_filename = os.path.join(outdir, os.path.basename(zip_info.filename))
+        if os.path.isfile(out_filename) and os.path.getsize(out_filename) == zip_info.file_size:
+            content = files_zip.read(zip_info)
+            if file_hash(out_filename) == hashlib.sha256(content).hexdigest():
+                root_logger.debug("Unchanged %s", out_filename)
+                return out_filename
+        else:
+            content = files_zip.read(zip_info)
+        write_if_changed(out_filename, content)
+        return out_filename
+
+    @classmethod
+    def __save_json_to_file(cls, filename, json_data):
+        return write_if_changed(filename, json.dumps(json_data, default=str).encode())
+
+    def __download_json_file(self, rest_client, leaf_route, json_filename, overwite, params=None):
+        """Download JSON data to a file using conditional requests and only replace the file if the content changed."""
+        filename = f'{json_filename}.json'
+        exists = os.path.isfile(filename)
+        if exists and not overwite:
+            root_logger.debug("Ignoring %s (exists)", filename)
+            return
+        response = rest_client.get(leaf_route, self.cache.conditional_headers(filename) if exists else {}, params)
+        if response.status_code == 304:
+            root_logger.info("Not modified %s", filename)
+            return
+        try:
+            json_data = response.json()
+        except Exception as e:
+            raise RestResponseException(e, response, f'failed to save {filename} as json: {e}')
+        if self.__save_json_to_file(filename, json_data):
+            root_logger.info("Wrote %s", filename)
+        self.cache.update(filename, response, [filename])
+
+    def __download_binary_file(self, rest_client, leaf_route, filename, params=None):
+        """Download binary data to a file using conditional requests. The file is not written if the server reports no changes."""
+        key = os.path.basename(filename)
+        response = rest_client.get(leaf_route, self.cache.conditional_headers(key), params)
+        if response.status_code == 304:
+            root_logger.info("Not modified %s", key)
+            return
+        RestClient.save_binary_file(filename, response)
+        self.cache.update(key, response)
 
     def __get_stat(self, stat_function, directory, date, days, overwite):
         for day in tqdm(range(0, days), unit='days'):
@@ -188,6 +308,7 @@ class Download(object):
             stat_function(directory, download_date, overwite or delta.days <= self.download_days_overlap)
             # pause for a second between every page access
             time.sleep(1)
+        self.cache.save()
 
     def __get_summary_day(self, directory, date, overwite=False):
         root_logger.info("get_summary_day: %s", date)
@@ -199,7 +320,7 @@ class Download(object):
         url = f'{self.garmin_connect_daily_summary_url}/{self.display_name}'
         json_filename = f'{directory}/daily_summary_{date_str}'
         try:
-            self.modern_rest_client.download_json_file(url, json_filename, overwite, params)
+            self.__download_json_file(self.modern_rest_client, url, json_filename, overwite, params)
         except RestException as e:
             root_logger.error("Exception geting daily summary: %s", e)
 
@@ -213,7 +334,7 @@ class Download(object):
         zip_filename = f'{self.temp_dir}/{date}.zip'
         url = f'wellness/{date.strftime("%Y-%m-%d")}'
         try:
-            self.download_service_rest_client.download_binary_file(url, zip_filename)
+            self.__download_binary_file(self.download_service_rest_client, url, zip_filename)
         except RestException as e:
             root_logger.error("Exception geting daily summary: %s", e)
 
@@ -236,7 +357,7 @@ class Download(object):
         }
         json_filename = f'{directory}/weight_{date_str}'
         try:
-            self.modern_rest_client.download_json_file(self.garmin_connect_weight_url, json_filename, overwite, params)
+            self.__download_json_file(self.modern_rest_client, self.garmin_connect_weight_url, json_filename, overwite, params)
         except RestException as e:
             root_logger.error("Exception geting daily summary: %s", e)
 
@@ -261,7 +382,7 @@ class Download(object):
         root_logger.debug("save_activity_details")
         json_filename = f'{directory}/activity_details_{activity_id_str}'
         try:
-            self.activity_service_rest_client.download_json_file(activity_id_str, json_filename, overwite)
+            self.__download_json_file(self.activity_service_rest_client, activity_id_str, json_filename, overwite)
         except RestException as e:
             root_logger.error("Exception geting daily summary %s", e)
 
@@ -270,7 +391,7 @@ class Download(object):
         zip_filename = f'{self.temp_dir}/activity_{activity_id_str}.zip'
         url = f'activity/{activity_id_str}'
         try:
-            self.download_service_rest_client.download_binary_file(url, zip_filename)
+            self.__download_binary_file(self.download_service_rest_client, url, zip_filename)
         except RestException as e:
             root_logger.error("Exception downloading activity file: %s", e)
 
@@ -286,20 +407,22 @@ class Download(object):
             if not os.path.isfile(json_filename) or overwite:
                 root_logger.info("get_activities: %s <- %r", json_filename, activity)
                 self.__save_activity_details(directory, activity_id_str, overwite)
-                self.modern_rest_client.save_json_to_file(json_filename, activity)
+                self.__save_json_to_file(json_filename, activity)
                 if not os.path.isfile(f'{directory}/{activity_id_str}.fit') or overwite:
                     self.__save_activity_file(activity_id_str)
                 # pause for a second between every page access
                 time.sleep(1)
+        self.cache.save()
 
     def get_activity_types(self, directory, overwite):
         """Download the activity types from Garmin Connect and save to a JSON file."""
         root_logger.info("get_activity_types: '%s'", directory)
         json_filename = f'{directory}/activity_types'
         try:
-            self.activity_service_rest_client.download_json_file('activityTypes', json_filename, overwite)
+            self.__download_json_file(self.activity_service_rest_client, 'activityTypes', json_filename, overwite)
         except RestException as e:
             root_logger.error("Exception geting activity types: %s", e)
+        self.cache.save()
 
     def __get_sleep_day(self, directory, date, overwite=False):
         json_filename = f'{directory}/sleep_{date}'
@@ -309,7 +432,7 @@ class Download(object):
         }
         url = f'{self.garmin_connect_sleep_daily_url}/{self.display_name}'
         try:
-            self.modern_rest_client.download_json_file(url, json_filename, overwite, params)
+            self.__download_json_file(self.modern_rest_client, url, json_filename, overwite, params)
         except RestException as e:
             root_logger.error("Exception geting daily summary: %s", e)
 
@@ -328,7 +451,7 @@ class Download(object):
         }
         url = f'{self.garmin_connect_rhr}/{self.display_name}'
         try:
-            self.modern_rest_client.download_json_file(url, json_filename, overwite, params)
+            self.__download_json_file(self.modern_rest_client, url, json_filename, overwite, params)
         except RestException as e:
             root_logger.error("Exception geting daily summary %s", e)
 
@@ -342,7 +465,7 @@ class Download(object):
         json_filename = f'{directory}/hydration_{date_str}'
         url = f'{self.garmin_connect_daily_hydration_url}/{date_str}'
         try:
-            self.modern_rest_client.download_json_file(url, json_filename, overwite)
+            self.__download_json_file(self.modern_rest_client, url, json_filename, overwite)
         except RestException as e:
             root_logger.error("Exception geting hydration: %s", e)
 
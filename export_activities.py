@@ -7,6 +7,7 @@ __license__ = "GPL"
 import os
 
 from Fit import Distance, Speed
+import HealthDB
 import GarminDB
 from garmin_db_tcx import GarminDbTcx
 
@@ -23,7 +24,7 @@ class ActivityExporter(object):
 
     def process(self, db_params):
         """Process database data for an activity into a an XML tree in TCX format."""
-        garmin_act_db = GarminDB.ActivitiesDB(db_params, self.debug - 1)
+        garmin_act_db = HealthDB.DbRegistry.get(GarminDB.ActivitiesDB, db_params, self.debug - 1)
         with garmin_act_db.managed_session() as garmin_act_db_session:
             activity = GarminDB.Activities.s_get(garmin_act_db_session, self.activity_id)
             self.tcx = GarminDbTcx()
@@ -38,7 +39,7 @@ class ActivityExporter(object):
                         alititude = Distance.from_meters_or_feet(record.altitude, self.measurement_system)
                         speed = Speed.from_kph_or_mph(record.speed, self.measurement_system)
                         self.tcx.add_point(track, record.timestamp, record.position, alititude, record.hr, speed)
-        garmindb = GarminDB.GarminDB(db_params)
+        garmindb = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params)
         with garmindb.managed_session() as garmin_db_session:
             file = GarminDB.File.s_get(garmin_db_session, self.activity_id)
             device = GarminDB.Device.s_get(garmin_db_session, file.serial_number)
@@ -0,0 +1,207 @@
+"""Objects for exporting Garmin database tables to Parquet files."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import re
+import logging
+import datetime
+import enum
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, Integer, Float, String, Boolean, DateTime, Date, Time, Enum
+
+import HealthDB
+import GarminDB
+from GarminDB.epoch_timestamps import EpochDateTime, EpochTime
+
+
+logger = logging.getLogger(__name__)
+
+
+class ParquetExporter(object):
+    """
+    Export tables of the Garmin databases to Parquet files partitioned by year and month.
+
+    Each table is written to <directory>/<table>/year=<year>/month=<month>/<table>.parquet, a layout Arrow, pandas, and
+    most query engines read as one partitioned dataset. Rows are streamed from the database and written in chunks so
+    memory use is bounded by the chunk size. Incremental exports skip the partitions that were already exported, except
+    for the latest one that may have grown since. Activity records stored as record streams are decoded and written to
+    activity_record_streams partitions, by the month their activity started, with the columns of activity_records. It's
+    the way for tools other than GarminDB to read them.
+    """
+
+    chunk_rows = 65536
+    arrow_types = [
+        (EpochDateTime,     pa.timestamp('us')),
+        (EpochTime,         pa.time64('us')),
+        (DateTime,          pa.timestamp('us')),
+        (Date,              pa.date32()),
+        (Time,              pa.time64('us')),
+        (Enum,              pa.string()),
+        (Boolean,           pa.bool_()),
+        (Integer,           pa.int64()),
+        (Float,             pa.float64()),
+        (String,            pa.string()),
+    ]
+
+    def __init__(self, directory, db_params, debug):
+        """
+        Return an instance of ParquetExporter.
+
+        Parameters:
+        ----------
+        directory (string): the directory the table directories are written to
+        db_params (DbParams): configuration data for accessing the databases
+        debug (int): debug level
+
+        """
+        self.directory = directory
+        self.db_params = db_params
+        self.debug = debug
+
+    def __tables(self):
+        garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, self.db_params, self.debug)
+        garmin_act_db = HealthDB.DbRegistry.get(GarminDB.ActivitiesDB, self.db_params, self.debug)
+        garmin_sum_db = HealthDB.DbRegistry.get(GarminDB.GarminSummaryDB, self.db_params, self.debug)
+        garmin_mon_dbs = GarminDB.MonitoringYears(self.db_params, self.debug).all_dbs()
+        return [
+            (GarminDB.MonitoringHeartRate,  garmin_mon_dbs),
+            (GarminDB.Monitoring,           garmin_mon_dbs),
+            (GarminDB.Stress,               [garmin_db]),
+            (GarminDB.Activities,           [garmin_act_db]),
+            (GarminDB.ActivityRecords,      [garmin_act_db]),
+            (GarminDB.DaysSummary,          [garmin_sum_db]),
+            (GarminDB.WeeksSummary,         [garmin_sum_db]),
+            (GarminDB.MonthsSummary,        [garmin_sum_db]),
+            (GarminDB.YearsSummary,         [garmin_sum_db]),
+            (GarminDB.IntensityHR,          [garmin_sum_db]),
+        ]
+
+    def export(self, full=False):
+        """Export all of the tables, all of their partitions if full is True, otherwise only the new and latest partitions."""
+        for table, dbs in self.__tables():
+            for db in dbs:
+                self.export_table(db, table, full)
+        self.export_record_streams(HealthDB.DbRegistry.get(GarminDB.ActivitiesDB, self.db_params, self.debug), full)
+
+    @classmethod
+    def arrow_schema(cls, table):
+        """Return the Arrow schema for the columns of a table."""
+        return pa.schema([(col.name, cls.__arrow_type(col.type)) for col in table.__table__.columns])
+
+    @classmethod
+    def __arrow_type(cls, col_type):
+        for sql_type, arrow_type in cls.arrow_types:
+            if isinstance(col_type, sql_type):
+                return arrow_type
+        return pa.string()
+
+    @classmethod
+    def __arrow_value(cls, value):
+        if isinstance(value, enum.Enum):
+            return value.name
+        return value
+
+    def __partition_dir(self, table, year, month):
+        return os.path.join(self.directory, table.__tablename__, f'year={year}', f'month={month:02d}')
+
+    def exported_partitions(self, table):
+        """Return the (year, month) partitions of a table that have been exported."""
+        table_dir = os.path.join(self.directory, table.__tablename__)
+        partitions = []
+        if os.path.isdir(table_dir):
+            for year_dir in os.listdir(table_dir):
+                year_match = re.match(r'year=(\d+)$', year_dir)
+                if year_match:
+                    for month_dir in os.listdir(os.path.join(table_dir, year_dir)):
+                        month_match = re.match(r'month=(\d+)$', month_dir)
+                        if month_match and os.path.exists(os.path.join(table_dir, year_dir, month_dir, f'{table.__tablename__}.parquet')):
+                            partitions.append((int(year_match.group(1)), int(month_match.group(1))))
+        return sorted(partitions)
+
+    def __partitions_to_export(self, table, partitions, full):
+        exported = self.exported_partitions(table)
+        if not full and exported:
+            # the latest exported partition may have had rows added since it was exported
+            partitions = [partition for partition in partitions if partition not in exported or partition >= exported[-1]]
+        logger.info("Exporting %d partitions of %s", len(partitions), table.__tablename__)
+        return sorted(partitions)
+
+    def export_table(self, db, table, full=False):
+        """Export the partitions of a table in a database, all of them if full is True, otherwise only the new and latest partitions."""
+        with db.managed_session() as session:
+            partitions = [(year, month) for year in table.get_years(db) for month in table.s_get_months(session, year)]
+        for year, month in self.__partitions_to_export(table, partitions, full):
+            self.export_partition(db, table, year, month)
+
+    @classmethod
+    def __month_span(cls, year, month):
+        return (datetime.date(year, month, 1), datetime.date(year + month // 12, month % 12 + 1, 1))
+
+    def __write_partition(self, table, schema, year, month, chunks):
+        partition_dir = self.__partition_dir(table, year, month)
+        os.makedirs(partition_dir, exist_ok=True)
+        filename = os.path.join(partition_dir, f'{table.__tablename__}.parquet')
+        # written to a temporary file first so that an interrupted export doesn't leave a partial partition behind
+        temp_filename = filename + '.tmp'
+        rows = 0
+        with pq.ParquetWriter(temp_filename, schema, compression='zstd') as writer:
+            for chunk in chunks:
+                columns = [[self.__arrow_value(value) for value in col_values] for col_values in zip(*chunk)]
+                writer.write_batch(pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+                rows += len(chunk)
+        os.replace(temp_filename, filename)
+        logger.debug("Exported %d rows of %s for %d-%02d", rows, table.__tablename__, year, month)
+
+    def export_partition(self, db, table, year, month):
+        """Write the rows of a table from a month to the month's Parquet file, replacing the file if it exists."""
+        time_col = table.__table__.columns[table.time_col_name]
+        (start_ts, end_ts) = self.__month_span(year, month)
+        if not isinstance(time_col.type, Date):
+            start_ts = datetime.datetime.combine(start_ts, datetime.time.min)
+            end_ts = datetime.datetime.combine(end_ts, datetime.time.min)
+        query = select(table.__table__.columns).where(time_col >= start_ts).where(time_col < end_ts).order_by(time_col)
+
+        def chunks(result):
+            while True:
+                chunk = result.fetchmany(self.chunk_rows)
+                if not chunk:
+                    break
+                yield chunk
+
+        with db.engine.connect() as connection:
+            self.__write_partition(table, self.arrow_schema(table), year, month, chunks(connection.execution_options(stream_results=True).execute(query)))
+
+    @classmethod
+    def __record_streams_start_times(cls, session, start_ts=None, end_ts=None):
+        query = session.query(GarminDB.Activities.activity_id, GarminDB.Activities.start_time).join(
+            GarminDB.ActivityRecordStreams, GarminDB.ActivityRecordStreams.activity_id == GarminDB.Activities.activity_id)
+        if start_ts is not None:
+            query = query.filter(GarminDB.Activities.start_time >= start_ts).filter(GarminDB.Activities.start_time < end_ts)
+        return query.order_by(GarminDB.Activities.start_time).all()
+
+    def export_record_streams(self, db, full=False):
+        """Export the decoded activity record streams, all of their partitions if full is True, otherwise only the new and latest partitions."""
+        with db.managed_session() as session:
+            partitions = {(start_time.year, start_time.month) for activity_id, start_time in self.__record_streams_start_times(session) if start_time is not None}
+        for year, month in self.__partitions_to_export(GarminDB.ActivityRecordStreams, partitions, full):
+            self.export_record_streams_partition(db, year, month)
+
+    def export_record_streams_partition(self, db, year, month):
+        """Write the decoded records of the activities with record streams that started in a month to the month's Parquet file."""
+        (start_ts, end_ts) = self.__month_span(year, month)
+        columns = GarminDB.ActivityRecords.__table__.columns
+
+        def chunks(session):
+            # one chunk per activity, the records of an activity are decoded together
+            for activity_id, start_time in self.__record_streams_start_times(session, datetime.datetime.combine(start_ts, datetime.time.min),
+                                                                             datetime.datetime.combine(end_ts, datetime.time.min)):
+                records = GarminDB.ActivityRecordStreams.s_get_records(session, activity_id)
+                if records:
+                    yield [tuple(getattr(record, col.key) for col in columns) for record in records]
+
+        with db.managed_session() as session:
+            self.__write_partition(GarminDB.ActivityRecordStreams, self.arrow_schema(GarminDB.ActivityRecords), year, month, chunks(session))
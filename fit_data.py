@@ -5,7 +5,9 @@ __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
 
+import os
 import sys
+import re
 import logging
 from tqdm import tqdm
 
@@ -22,7 +24,7 @@ root_logger = logging.getLogger()
 class FitData(object):
     """Class for importing FIT files into a database."""
 
-    def __init__(self, input_dir, debug, latest=False, recursive=False, fit_types=None, measurement_system=Fit.field_enums.DisplayMeasure.metric):
+    def __init__(self, input_dir, debug, latest=False, recursive=False, fit_types=None, measurement_system=Fit.field_enums.DisplayMeasure.metric, file_names=None):
         """
         Return an instance of FitData.
 
@@ -32,13 +34,18 @@ class FitData(object):
         latest (Boolean): check for latest files only
         fit_types (Fit.field_enums.FileType): check for this file type only
         measurement_system (enum): which measurement system to use when importing the files
+        file_names (list): import these files instead of searching input_dir
 
         """
-        logger.info("Processing %s FIT data from %s", fit_types, input_dir)
         self.measurement_system = measurement_system
         self.debug = debug
         self.fit_types = fit_types
-        self.file_names = FileProcessor.dir_to_files(input_dir, Fit.file.name_regex, latest, recursive)
+        if file_names is not None:
+            logger.info("Processing %s FIT data from %d files", fit_types, len(file_names))
+            self.file_names = [file_name for file_name in file_names if re.search(Fit.file.name_regex, os.path.basename(file_name))]
+        else:
+            logger.info("Processing %s FIT data from %s", fit_types, input_dir)
+            self.file_names = FileProcessor.dir_to_files(input_dir, Fit.file.name_regex, latest, recursive)
 
     def file_count(self):
         """Return the number of files that will be processed."""
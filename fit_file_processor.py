@@ -10,6 +10,7 @@ import traceback
 import datetime
 
 import Fit
+import HealthDB
 import GarminDB
 import utilities
 
@@ -32,9 +33,11 @@ class FitFileProcessor(object):
         """
         root_logger.info("Debug: %s", debug)
         self.debug = debug
-        self.garmin_db = GarminDB.GarminDB(db_params, debug - 1)
-        self.garmin_mon_db = GarminDB.MonitoringDB(db_params, self.debug - 1)
-        self.garmin_act_db = GarminDB.ActivitiesDB(db_params, self.debug - 1)
+        self.garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params, debug - 1)
+        # monitoring data is written to the database of the year of its timestamp when monitoring year files are enabled
+        self.garmin_mon_dbs = GarminDB.MonitoringYears(db_params, self.debug - 1)
+        self.garmin_act_db = HealthDB.DbRegistry.get(GarminDB.ActivitiesDB, db_params, self.debug - 1)
+        self.record_streams = getattr(db_params, 'record_streams', False)
 
     def __write_generic(self, fit_file, message_type, messages):
         """Write all messages of a given message type to the database."""
@@ -68,9 +71,14 @@ class FitFileProcessor(object):
             self._write_lap_entry(fit_file, message.fields, lap_num)
 
     def _write_record(self, fit_file, message_type, messages):
-        """Write all record messages to the database."""
-        for record_num, message in enumerate(messages):
-            self._write_record_entry(fit_file, message.fields, record_num)
+        """Write all record messages to the database, as one stream row for the activity if record streams are enabled."""
+        if self.record_streams:
+            activity_id = GarminDB.File.id_from_path(fit_file.filename)
+            records = [self.__record(fit_file, message.fields, record_num) for record_num, message in enumerate(messages)]
+            GarminDB.ActivityRecordStreams.s_insert_or_replace(self.garmin_act_db_session, activity_id, records)
+        else:
+            for record_num, message in enumerate(messages):
+                self._write_record_entry(fit_file, message.fields, record_num)
 
     def __write_message_type(self, fit_file, message_type):
         messages = fit_file[message_type]
@@ -94,12 +102,11 @@ class FitFileProcessor(object):
 
     def write_file(self, fit_file):
         """Given a Fit File object, write all of its messages to the DB."""
-        with self.garmin_db.managed_session() as self.garmin_db_session, self.garmin_mon_db.managed_session() as self.garmin_mon_db_session, \
+        with self.garmin_db.managed_session() as self.garmin_db_session, self.garmin_mon_dbs.managed_sessions() as self.garmin_mon_db_session, \
                 self.garmin_act_db.managed_session() as self.garmin_act_db_session:
             self.__write_message_types(fit_file, fit_file.message_types)
             # Now write a file's worth of data to the DB
             self.garmin_act_db_session.commit()
-            self.garmin_mon_db_session.commit()
             self.garmin_db_session.commit()
 
     def __get_field_value(self, message_fields, field_name):
@@ -442,26 +449,28 @@ class FitFileProcessor(object):
     def _write_zones_target_entry(self, fit_file, message_fields):
         root_logger.debug("zones target message: %r", message_fields)
 
+    def __record(self, fit_file, message_fields, record_num):
+        return {
+            'activity_id'                       : GarminDB.File.id_from_path(fit_file.filename),
+            'record'                            : record_num,
+            'timestamp'                         : fit_file.utc_datetime_to_local(message_fields.timestamp),
+            'position_lat'                      : self.__get_field_value(message_fields, 'position_lat'),
+            'position_long'                     : self.__get_field_value(message_fields, 'position_long'),
+            'distance'                          : self.__get_field_value(message_fields, 'distance'),
+            'cadence'                           : self.__get_field_value(message_fields, 'cadence'),
+            'hr'                                : self.__get_field_value(message_fields, 'heart_rate'),
+            'rr'                                : self.__get_field_value(message_fields, 'respiration_rate'),
+            'altitude'                          : self.__get_field_value(message_fields, 'altitude'),
+            'speed'                             : self.__get_field_value(message_fields, 'speed'),
+            'temperature'                       : self.__get_field_value(message_fields, 'temperature'),
+        }
+
     def _write_record_entry(self, fit_file, message_fields, record_num):
         # We don't get record data from multiple sources so we don't need to coellesce data in the DB.
         # It's fastest to just write the new data out if it doesn't currently exist.
         activity_id = GarminDB.File.id_from_path(fit_file.filename)
         if not GarminDB.ActivityRecords.s_exists(self.garmin_act_db_session, {'activity_id' : activity_id, 'record' : record_num}):
-            record = {
-                'activity_id'                       : activity_id,
-                'record'                            : record_num,
-                'timestamp'                         : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'position_lat'                      : self.__get_field_value(message_fields, 'position_lat'),
-                'position_long'                     : self.__get_field_value(message_fields, 'position_long'),
-                'distance'                          : self.__get_field_value(message_fields, 'distance'),
-                'cadence'                           : self.__get_field_value(message_fields, 'cadence'),
-                'hr'                                : self.__get_field_value(message_fields, 'heart_rate'),
-                'rr'                                : self.__get_field_value(message_fields, 'respiration_rate'),
-                'altitude'                          : self.__get_field_value(message_fields, 'altitude'),
-                'speed'                             : self.__get_field_value(message_fields, 'speed'),
-                'temperature'                       : self.__get_field_value(message_fields, 'temperature'),
-            }
-            self.garmin_act_db_session.add(GarminDB.ActivityRecords(**record))
+            self.garmin_act_db_session.add(GarminDB.ActivityRecords(**self.__record(fit_file, message_fields, record_num)))
 
     def _write_dev_data_id_entry(self, fit_file, message_fields):
         root_logger.debug("dev_data_id message: %r", message_fields)
@@ -484,7 +493,7 @@ class FitFileProcessor(object):
                     'cycles_to_distance'        : message_fields.cycles_to_distance[index],
                     'cycles_to_calories'        : message_fields.cycles_to_calories[index]
                 }
-                GarminDB.MonitoringInfo.s_insert_or_update(self.garmin_mon_db_session, entry)
+                HealthDB.BulkWriter.s_insert_or_update(self.garmin_mon_db_session(entry['timestamp']), GarminDB.MonitoringInfo, entry)
 
     def _write_monitoring_entry(self, fit_file, message_fields):
         # Only include not None values so that we match and update only if a table's columns if it has values.
@@ -495,19 +504,20 @@ class FitFileProcessor(object):
             timestamp = timestamp - datetime.timedelta(seconds=1)
         entry['timestamp'] = timestamp
         logger.debug("monitoring entry: %r", entry)
+        mon_db_session = self.garmin_mon_db_session(timestamp)
         try:
             intersection = GarminDB.MonitoringHeartRate.intersection(entry)
             if len(intersection) > 1 and intersection['heart_rate'] > 0:
-                GarminDB.MonitoringHeartRate.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                HealthDB.BulkWriter.s_insert_or_update(mon_db_session, GarminDB.MonitoringHeartRate, intersection)
             intersection = GarminDB.MonitoringIntensity.intersection(entry)
             if len(intersection) > 1:
-                GarminDB.MonitoringIntensity.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                HealthDB.BulkWriter.s_insert_or_update(mon_db_session, GarminDB.MonitoringIntensity, intersection)
             intersection = GarminDB.MonitoringClimb.intersection(entry)
             if len(intersection) > 1:
-                GarminDB.MonitoringClimb.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                HealthDB.BulkWriter.s_insert_or_update(mon_db_session, GarminDB.MonitoringClimb, intersection)
             intersection = GarminDB.Monitoring.intersection(entry)
             if len(intersection) > 1:
-                GarminDB.Monitoring.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                HealthDB.BulkWriter.s_insert_or_update(mon_db_session, GarminDB.Monitoring, intersection)
         except ValueError:
             logger.error("write_monitoring_entry: ValueError for %r: %s", entry, traceback.format_exc())
         except Exception:
@@ -522,7 +532,7 @@ class FitFileProcessor(object):
                 'rr'        : rr,
             }
             if fit_file.type is Fit.FileType.monitoring_b:
-                GarminDB.MonitoringRespirationRate.s_insert_or_update(self.garmin_mon_db_session, respiration)
+                HealthDB.BulkWriter.s_insert_or_update(self.garmin_mon_db_session(respiration['timestamp']), GarminDB.MonitoringRespirationRate, respiration)
             else:
                 raise(ValueError(f'Unexpected file type {repr(fit_file.type)} for respiration message'))
 
@@ -535,7 +545,7 @@ class FitFileProcessor(object):
                     'timestamp': fit_file.utc_datetime_to_local(message_fields.timestamp),
                     'pulse_ox': pulse_ox,
                 }
-                GarminDB.MonitoringPulseOx.s_insert_or_update(self.garmin_mon_db_session, pulse_ox_entry)
+                HealthDB.BulkWriter.s_insert_or_update(self.garmin_mon_db_session(pulse_ox_entry['timestamp']), GarminDB.MonitoringPulseOx, pulse_ox_entry)
         else:
             raise(ValueError(f'Unexpected file type {repr(fit_file.type)} for pulse ox'))
 
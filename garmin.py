@@ -16,6 +16,7 @@ import argparse
 import datetime
 import os
 import tempfile
+import multiprocessing
 
 from version import format_version, python_version_check, log_version
 from download_garmin import Download
@@ -25,6 +26,7 @@ from import_garmin import GarminProfile, GarminWeightData, GarminSummaryData, Ga
 from import_garmin_activities import GarminJsonSummaryData, GarminJsonDetailsData, GarminTcxData, GarminActivitiesFitData
 from analyze_garmin import Analyze
 from export_activities import ActivityExporter
+from export_parquet import ParquetExporter
 
 import HealthDB
 import GarminDB
@@ -55,10 +57,18 @@ stats_to_db_map = {
 
 summary_dbs = [GarminDB.GarminSummaryDB, HealthDB.SummaryDB]
 
+# Tables that the summary tables are generated from. Imports into these tables mark the imported days for resummarizing.
+summary_source_tables = [
+    GarminDB.DailySummary, GarminDB.RestingHeartRate, GarminDB.Stress, GarminDB.Weight, GarminDB.Sleep,
+    GarminDB.Monitoring, GarminDB.MonitoringIntensity, GarminDB.MonitoringClimb, GarminDB.MonitoringHeartRate,
+    GarminDB.Activities
+]
+
 
 def __get_date_and_days(db, latest, table, col, stat_name):
     if latest:
-        last_ts = table.latest_time(db, col)
+        # there's no monitoring database before the first monitoring data is imported
+        last_ts = table.latest_time(db, col) if db is not None else None
         if last_ts is None:
             date, days = gc_config.stat_start_date(stat_name)
             logger.info("Recent %s data not found, using: %s : %s", stat_name, date, days)
@@ -77,34 +87,39 @@ def __get_date_and_days(db, latest, table, col, stat_name):
 
 
 def copy_data(overwite, latest, stats):
-    """Copy data from a mounted Garmin USB device to files."""
+    """Copy data from a mounted Garmin USB device to files. Return a dict of the files copied for settings and each stat."""
     logger.info("___Copying Data___")
-    copy = Copy(gc_config.device_mount_dir())
+    copy = Copy(gc_config.device_mount_dir(), gc_config.copy_threads())
+    copied_files = {}
 
     settings_dir = GarminDBConfigManager.get_or_create_fit_files_dir()
     root_logger.info("Copying settings to %s", settings_dir)
-    copy.copy_settings(settings_dir)
+    copied_files['settings'] = copy.copy_settings(settings_dir)
 
     if Statistics.activities in stats:
         activities_dir = GarminDBConfigManager.get_or_create_activities_dir()
         root_logger.info("Copying activities to %s", activities_dir)
-        copy.copy_activities(activities_dir, latest)
+        copied_files[Statistics.activities] = copy.copy_activities(activities_dir, latest)
 
     if Statistics.monitoring in stats:
         monitoring_dir = GarminDBConfigManager.get_or_create_monitoring_dir(datetime.datetime.now().year)
         root_logger.info("Copying monitoring to %s", monitoring_dir)
-        copy.copy_monitoring(monitoring_dir, latest)
+        copied_files[Statistics.monitoring] = copy.copy_monitoring(monitoring_dir, latest)
 
     if Statistics.sleep in stats:
         monitoring_dir = GarminDBConfigManager.get_or_create_monitoring_dir(datetime.datetime.now().year)
         root_logger.info("Copying sleep to %s", monitoring_dir)
-        copy.copy_sleep(monitoring_dir, latest)
+        copied_files[Statistics.sleep] = copy.copy_sleep(monitoring_dir, latest)
+
+    return copied_files
 
 
 def download_data(overwite, latest, stats):
     """Download selected activity types from Garmin Connect and save the data in files. Overwrite previously downloaded data if indicated."""
     logger.info("___Downloading %s Data___", 'Latest' if latest else 'All')
     db_params_dict = GarminDBConfigManager.get_db_params()
+    garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params_dict)
+    garmin_mon_db = GarminDB.MonitoringYears(db_params_dict).latest_db()
 
     download = Download()
     if not download.login():
@@ -123,7 +138,7 @@ def download_data(overwite, latest, stats):
         download.unzip_files(activities_dir)
 
     if Statistics.monitoring in stats:
-        date, days = __get_date_and_days(GarminDB.MonitoringDB(db_params_dict), latest, GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, 'monitoring')
+        date, days = __get_date_and_days(garmin_mon_db, latest, GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, 'monitoring')
         if days > 0:
             monitoring_dir = GarminDBConfigManager.get_or_create_monitoring_dir(date.year)
             root_logger.info("Date range to update: %s (%d) to %s", date, days, monitoring_dir)
@@ -134,7 +149,7 @@ def download_data(overwite, latest, stats):
             root_logger.info("Saved monitoring files for %s (%d) to %s for processing", date, days, monitoring_dir)
 
     if Statistics.sleep in stats:
-        date, days = __get_date_and_days(GarminDB.GarminDB(db_params_dict), latest, GarminDB.Sleep, GarminDB.Sleep.total_sleep, 'sleep')
+        date, days = __get_date_and_days(garmin_db, latest, GarminDB.Sleep, GarminDB.Sleep.total_sleep, 'sleep')
         if days > 0:
             sleep_dir = GarminDBConfigManager.get_or_create_sleep_dir()
             root_logger.info("Date range to update: %s (%d) to %s", date, days, sleep_dir)
@@ -142,7 +157,7 @@ def download_data(overwite, latest, stats):
             root_logger.info("Saved sleep files for %s (%d) to %s for processing", date, days, sleep_dir)
 
     if Statistics.weight in stats:
-        date, days = __get_date_and_days(GarminDB.GarminDB(db_params_dict), latest, GarminDB.Weight, GarminDB.Weight.weight, 'weight')
+        date, days = __get_date_and_days(garmin_db, latest, GarminDB.Weight, GarminDB.Weight.weight, 'weight')
         if days > 0:
             weight_dir = GarminDBConfigManager.get_or_create_weight_dir()
             root_logger.info("Date range to update: %s (%d) to %s", date, days, weight_dir)
@@ -150,7 +165,7 @@ def download_data(overwite, latest, stats):
             root_logger.info("Saved weight files for %s (%d) to %s for processing", date, days, weight_dir)
 
     if Statistics.rhr in stats:
-        date, days = __get_date_and_days(GarminDB.GarminDB(db_params_dict), latest, GarminDB.RestingHeartRate, GarminDB.RestingHeartRate.resting_heart_rate, 'rhr')
+        date, days = __get_date_and_days(garmin_db, latest, GarminDB.RestingHeartRate, GarminDB.RestingHeartRate.resting_heart_rate, 'rhr')
         if days > 0:
             rhr_dir = GarminDBConfigManager.get_or_create_rhr_dir()
             root_logger.info("Date range to update: %s (%d) to %s", date, days, rhr_dir)
@@ -158,8 +173,8 @@ def download_data(overwite, latest, stats):
             root_logger.info("Saved rhr files for %s (%d) to %s for processing", date, days, rhr_dir)
 
 
-def import_data(debug, latest, stats):
-    """Import previously downloaded Garmin data into the database."""
+def import_data(debug, latest, stats, year=None):
+    """Import previously downloaded Garmin data into the database, only the monitoring files of the given year if there is one."""
     logger.info("___Importing %s Data___", 'Latest' if latest else 'All')
     db_params_dict = GarminDBConfigManager.get_db_params()
 
@@ -173,7 +188,7 @@ def import_data(debug, latest, stats):
     if gsfd.file_count() > 0:
         gsfd.process_files(db_params_dict)
 
-    garmindb = GarminDB.GarminDB(db_params_dict)
+    garmindb = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params_dict)
     measurement_system = GarminDB.Attributes.measurements_type(garmindb)
 
     if Statistics.weight in stats:
@@ -183,7 +198,10 @@ def import_data(debug, latest, stats):
             gwd.process()
 
     if Statistics.monitoring in stats:
-        monitoring_dir = GarminDBConfigManager.get_or_create_monitoring_base_dir()
+        if year is None:
+            monitoring_dir = GarminDBConfigManager.get_or_create_monitoring_base_dir()
+        else:
+            monitoring_dir = GarminDBConfigManager.get_or_create_monitoring_dir(year)
         gsd = GarminSummaryData(db_params_dict, monitoring_dir, latest, measurement_system, debug)
         if gsd.file_count() > 0:
             gsd.process()
@@ -195,6 +213,7 @@ def import_data(debug, latest, stats):
         gfd = GarminMonitoringFitData(monitoring_dir, latest, measurement_system, debug)
         if gfd.file_count() > 0:
             gfd.process_files(db_params_dict)
+        GarminDB.MonitoringYears(db_params_dict).write_union_script()
 
     if Statistics.sleep in stats:
         sleep_dir = GarminDBConfigManager.get_or_create_sleep_dir()
@@ -228,21 +247,145 @@ def import_data(debug, latest, stats):
             gfd.process_files(db_params_dict)
 
 
-def analyze_data(debug):
+def import_copied_data(debug, copied_files):
+    """Import just the FIT files that were copied from a Garmin USB device into the database."""
+    logger.info("___Importing Copied Data___")
+    db_params_dict = GarminDBConfigManager.get_db_params()
+
+    # Import the settings FIT file first so that we can get the measurement system sorted out first.
+    gsfd = GarminSettingsFitData(None, debug, copied_files['settings'])
+    if gsfd.file_count() > 0:
+        gsfd.process_files(db_params_dict)
+
+    garmindb = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params_dict)
+    measurement_system = GarminDB.Attributes.measurements_type(garmindb)
+
+    monitoring_files = copied_files.get(Statistics.monitoring, []) + copied_files.get(Statistics.sleep, [])
+    if monitoring_files:
+        gfd = GarminMonitoringFitData(None, False, measurement_system, debug, monitoring_files)
+        if gfd.file_count() > 0:
+            gfd.process_files(db_params_dict)
+
+    if Statistics.activities in copied_files:
+        gfd = GarminActivitiesFitData(None, False, measurement_system, debug, copied_files[Statistics.activities])
+        if gfd.file_count() > 0:
+            gfd.process_files(db_params_dict)
+
+
+def backfill_hourly_rollups():
+    """Build the hourly rollups of tables that were imported before the rollups existed."""
+    db_params_dict = GarminDBConfigManager.get_db_params()
+    GarminDB.Stress.backfill_hourly_rollup(HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params_dict))
+    for garmin_mon_db in GarminDB.MonitoringYears(db_params_dict).all_dbs():
+        for table in [GarminDB.MonitoringHeartRate, GarminDB.MonitoringRespirationRate, GarminDB.MonitoringPulseOx]:
+            table.backfill_hourly_rollup(garmin_mon_db)
+
+
+def analyze_data(debug, full, jobs, dry_run):
     """Analyze the downloaded and imported Garmin data and create summary tables."""
     logger.info("___Analyzing Data___")
     db_params_dict = GarminDBConfigManager.get_db_params()
     analyze = Analyze(db_params_dict, debug - 1)
+    if dry_run:
+        analyze.summary(full, jobs, dry_run)
+        return
     analyze.get_stats()
-    analyze.summary()
+    analyze.summary(full, jobs)
     analyze.create_dynamic_views()
 
 
+def rebuild_indexes():
+    """Drop and recreate the secondary indexes of the Garmin databases."""
+    logger.info("___Rebuilding Indexes___")
+    db_params_dict = GarminDBConfigManager.get_db_params()
+    indexed_tables = {
+        GarminDB.GarminDB       : [GarminDB.DeviceInfo],
+        GarminDB.ActivitiesDB   : [GarminDB.Activities, GarminDB.ActivityRecords],
+    }
+    for db_class, tables in indexed_tables.items():
+        db = HealthDB.DbRegistry.get(db_class, db_params_dict)
+        for table in tables:
+            table.rebuild_indexes(db)
+    for garmin_mon_db in GarminDB.MonitoringYears(db_params_dict).all_dbs():
+        GarminDB.Monitoring.rebuild_indexes(garmin_mon_db)
+
+
+def migrate_timestamps():
+    """Convert the high volume tables of the Garmin databases to the configured timestamp storage."""
+    logger.info("___Migrating Timestamps___")
+    db_params_dict = GarminDBConfigManager.get_db_params()
+    epoch_tables = {
+        GarminDB.GarminDB       : [GarminDB.Stress],
+        GarminDB.ActivitiesDB   : [GarminDB.ActivityRecords],
+    }
+    for db_class, tables in epoch_tables.items():
+        GarminDB.EpochTimestamps.migrate_db(db_class, db_params_dict, tables)
+    monitoring_tables = [
+        GarminDB.MonitoringHeartRate, GarminDB.MonitoringIntensity, GarminDB.MonitoringClimb, GarminDB.Monitoring, GarminDB.MonitoringRespirationRate,
+        GarminDB.MonitoringPulseOx
+    ]
+    for year_db_params in GarminDB.MonitoringYears(db_params_dict).all_db_params():
+        GarminDB.EpochTimestamps.migrate_db(GarminDB.MonitoringDB, year_db_params, monitoring_tables)
+
+
+def __sqlite_dbs(db_params_dict):
+    dbs = [HealthDB.DbRegistry.get(db_class, db_params_dict) for db_class in [GarminDB.GarminDB, GarminDB.ActivitiesDB, GarminDB.GarminSummaryDB, HealthDB.SummaryDB]]
+    return dbs + GarminDB.MonitoringYears(db_params_dict).all_dbs()
+
+
+def __db_filename(db):
+    return os.path.basename(db._sqlite_path(db.db_params))
+
+
+def analyze_dbs():
+    """Update the approximate query planner statistics of the SQLite databases after a large import."""
+    db_params_dict = GarminDBConfigManager.get_db_params()
+    if db_params_dict.db_type == 'sqlite':
+        for db in __sqlite_dbs(db_params_dict):
+            logger.info("Analyzing %s", __db_filename(db))
+            HealthDB.SqliteMaintenance.analyze(db, analysis_limit=1000)
+
+
+def maintain_dbs(vacuum):
+    """Update the query planner statistics, check the integrity, optionally vacuum, and report the sizes of the SQLite databases."""
+    logger.info("___Maintaining Databases___")
+    db_params_dict = GarminDBConfigManager.get_db_params()
+    if db_params_dict.db_type != 'sqlite':
+        logger.error("Database maintenance is only supported for SQLite databases.")
+        return
+    for db in __sqlite_dbs(db_params_dict):
+        filename = __db_filename(db)
+        HealthDB.SqliteMaintenance.analyze(db)
+        HealthDB.SqliteMaintenance.optimize(db)
+        if vacuum:
+            logger.info("Vacuuming %s freed %d pages", filename, HealthDB.SqliteMaintenance.vacuum(db))
+        problems = HealthDB.SqliteMaintenance.integrity_check(db)
+        for problem in problems:
+            logger.error("%s: %s", filename, problem)
+        logger.info("%s: %.1f MB, integrity %s", filename, HealthDB.SqliteMaintenance.file_size(db) / 1e6, 'failed' if problems else 'ok')
+        logger.info("    %-32s %12s %10s %10s %10s", 'table', 'rows', 'pages', 'table MB', 'index MB')
+        for table in HealthDB.SqliteMaintenance.table_sizes(db):
+            logger.info("    %-32s %12d %10d %10.1f %10.1f", table['table'], table['rows'], table['pages'], table['table_bytes'] / 1e6, table['index_bytes'] / 1e6)
+
+
+def delete_monitoring_year_db(year):
+    """Delete the monitoring database of a year, so that the year can be reimported, when monitoring year files are enabled."""
+    db_params_dict = GarminDBConfigManager.get_db_params()
+    monitoring_years = GarminDB.MonitoringYears(db_params_dict)
+    if not monitoring_years.enabled:
+        logger.error("Deleting the monitoring data of a year needs monitoring_year_files enabled in the config.")
+        sys.exit()
+    HealthDB.DbRegistry.clear()
+    GarminDB.MonitoringDB.delete_db(monitoring_years.year_db_params(year))
+
+
 def delete_dbs(delete_db_list=[]):
     """Delete selected, or all if none selected GarminDB, database files."""
     db_params_dict = GarminDBConfigManager.get_db_params()
     if len(delete_db_list) == 0:
         delete_db_list = [GarminDB.GarminDB, GarminDB.MonitoringDB, GarminDB.ActivitiesDB, GarminDB.GarminSummaryDB, HealthDB.SummaryDB]
+    # close the shared databases before their files are removed
+    HealthDB.DbRegistry.clear()
     for db in delete_db_list:
         db.delete_db(db_params_dict)
 
@@ -250,13 +393,20 @@ def delete_dbs(delete_db_list=[]):
 def export_activity(debug, directory, export_activity_id):
     """Export an activity given its database id."""
     db_params_dict = GarminDBConfigManager.get_db_params()
-    garmindb = GarminDB.GarminDB(db_params_dict)
+    garmindb = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params_dict)
     measurement_system = GarminDB.Attributes.measurements_type(garmindb)
     ae = ActivityExporter(directory, export_activity_id, measurement_system, debug)
     ae.process(db_params_dict)
     return ae.write('activity_%s.tcx' % export_activity_id)
 
 
+def export_parquet(debug, full):
+    """Export the monitoring, activity, and summary tables to Parquet files partitioned by year and month."""
+    logger.info("___Exporting Parquet Files___")
+    export_dir = GarminDBConfigManager.get_or_create_export_dir()
+    ParquetExporter(export_dir, GarminDBConfigManager.get_db_params(), debug - 1).export(full)
+
+
 def basecamp_activity(debug, export_activity_id):
     """Export an activity given its database id."""
     file_with_path = export_activity(debug, tempfile.mkdtemp(), export_activity_id)
@@ -283,8 +433,16 @@ def main(argv):
     modes_group.add_argument("-c", "--copy", help="copy data from a connected device", dest='copy_data', action="store_true", default=False)
     modes_group.add_argument("-i", "--import", help="Import data for the chosen stats", dest='import_data', action="store_true", default=False)
     modes_group.add_argument("--analyze", help="Analyze data in the db and create summary and derived tables.", dest='analyze_data', action="store_true", default=False)
+    modes_group.add_argument("--rebuild-indexes", help="Drop and recreate the secondary indexes of the Garmin databases.", dest='rebuild_indexes', action="store_true",
+                             default=False)
+    modes_group.add_argument("--migrate-timestamps", help="Convert the Garmin databases to the timestamp storage chosen in the config.", dest='migrate_timestamps',
+                             action="store_true", default=False)
+    modes_group.add_argument("--maintain", help="Update the query planner statistics, check the integrity, and report the sizes of the database files.",
+                             dest='maintain_dbs', action="store_true", default=False)
     modes_group.add_argument("--delete_db", help="Delete Garmin DB db files for the selected activities.", action="store_true", default=False)
     modes_group.add_argument("-e", "--export-activity", help="Export an activity to a TCX file based on the activity\'s id", type=int)
+    modes_group.add_argument("--export-parquet", help="Export the monitoring, activity, and summary tables to Parquet files partitioned by year and month.",
+                             dest='export_parquet', action="store_true", default=False)
     modes_group.add_argument("-b", "--basecamp-activity", help="Export an activity to Garmin BaseCamp", type=int)
     modes_group.add_argument("-g", "--google-earth-activity", help="Export an activity to Google Earth", type=int)
     # stat types to operate on
@@ -300,7 +458,21 @@ def main(argv):
     modifiers_group.add_argument("-l", "--latest", help="Only download and/or import the latest data.", action="store_true", default=False)
     modifiers_group.add_argument("-o", "--overwrite", help="Overwite existing files when downloading. The default is to only download missing files.",
                                  action="store_true", default=False)
-    args = parser.parse_args()
+    modifiers_group.add_argument("--full", help="Regenerate all of the summary tables when analyzing, or export all partitions when exporting. "
+                                 "The default is to only update periods with newly imported data.",
+                                 action="store_true", default=False)
+    modifiers_group.add_argument("-j", "--jobs", help="The number of processes to use for generating the summary tables of different years in parallel.",
+                                 type=int, default=1)
+    modifiers_group.add_argument("--year", help="With monitoring year files, only delete and import the monitoring data of the given year. "
+                                 "The summary tables are kept and updated by --analyze.", type=int)
+    modifiers_group.add_argument("--vacuum", help="With --maintain, also vacuum the database files to release the space left by deleted and updated rows.",
+                                 action="store_true", default=False)
+    modifiers_group.add_argument("--dry-run", help="With --analyze, only report the summary periods that would be generated and an estimate of the queries needed.",
+                                 dest='dry_run', action="store_true", default=False)
+    args = parser.parse_args(argv)
+
+    if args.dry_run and (args.copy_data or args.download_data or args.import_data or args.rebuild_indexes or args.migrate_timestamps or args.maintain_dbs or args.delete_db):
+        parser.error("--dry-run only reports what --analyze would do, it can't be combined with modes that change the data")
 
     log_version(sys.argv[0])
 
@@ -311,25 +483,69 @@ def main(argv):
 
     root_logger.info("Enabled statistics: %r", args.stats)
 
+    HealthDB.SqliteProfile.activate(GarminDBConfigManager.get_sqlite_profile())
+
+    if args.delete_db and args.year:
+        delete_monitoring_year_db(args.year)
+        sys.exit()
+
     if args.delete_db:
         delete_dbs([stats_to_db_map[stat] for stat in args.stats] + summary_dbs)
         sys.exit()
 
-    if args.copy_data:
-        copy_data(args.overwrite, args.latest, args.stats)
-
-    if args.download_data:
-        download_data(args.overwrite, args.latest, args.stats)
-
-    if args.import_data:
-        import_data(args.trace, args.latest, args.stats)
-
-    if args.analyze_data:
-        analyze_data(args.trace)
+    # opening the databases only records their views, they're created once the databases are up to date
+    HealthDB.ViewDefinitions.defer()
+    try:
+        if args.migrate_timestamps:
+            # before any of the databases are opened with the configured storage
+            migrate_timestamps()
+
+        if args.copy_data:
+            copied_files = copy_data(args.overwrite, args.latest, args.stats)
+
+        if args.download_data:
+            download_data(args.overwrite, args.latest, args.stats)
+
+        if (args.import_data or args.analyze_data) and not args.dry_run:
+            # bulk writes to the databases until the import and analysis are done
+            HealthDB.SqliteProfile.activate('import')
+            # the rollups are kept up to date by imports from here on
+            backfill_hourly_rollups()
+
+        if args.import_data:
+            dirty_days_tracker = GarminDB.DirtyDaysTracker(summary_source_tables)
+            # When updating from a device, import just the copied files instead of rescanning the data directories.
+            if args.copy_data and args.latest and not args.download_data:
+                import_copied_data(args.trace, copied_files)
+            else:
+                import_data(args.trace, args.latest, args.stats, args.year)
+            dirty_days_tracker.save(GarminDBConfigManager.get_db_params())
+            # large imports change the distribution of the data enough to mislead the query planner
+            if dirty_days_tracker.day_count() >= GarminDBConfigManager.get_analyze_after_days():
+                analyze_dbs()
+
+        if args.analyze_data:
+            analyze_data(args.trace, args.full, args.jobs, args.dry_run)
+
+        if args.rebuild_indexes:
+            rebuild_indexes()
+    finally:
+        # also when exiting early, only new views, dropped views, and views whose definitions changed are created. A dry run doesn't write.
+        if not args.dry_run:
+            HealthDB.ViewDefinitions.create_pending()
+        HealthDB.ViewDefinitions.defer(False)
+
+    if args.maintain_dbs:
+        maintain_dbs(args.vacuum)
+
+    HealthDB.SqliteProfile.activate(GarminDBConfigManager.get_sqlite_profile())
 
     if args.export_activity:
         export_activity(args.trace, os.getcwd(), args.export_activity)
 
+    if args.export_parquet:
+        export_parquet(args.trace, args.full)
+
     if args.basecamp_activity:
         basecamp_activity(args.trace, args.basecamp_activity)
 
@@ -338,4 +554,6 @@ def main(argv):
 
 
 if __name__ == "__main__":
+    # needed for the analyze worker processes when running as a PyInstaller executable
+    multiprocessing.freeze_support()
     main(sys.argv[1:])
@@ -70,6 +70,11 @@ class GarminConnectConfigManager(JsonConfig):
         """Return the directory where the Garmin USB device is mounted."""
         return self.__get_node_value('copy', 'mount_dir')
 
+    def copy_threads(self):
+        """Return the number of files to copy from the Garmin USB device concurrently."""
+        threads = self.__get_node_value('copy', 'threads')
+        return threads if threads else 4
+
     def download_days_overlap(self):
         """Return the number of days to overlap previously downloaded data when downloading."""
         return self.__get_node_value('data', 'download_days_overlap')
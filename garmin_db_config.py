@@ -9,7 +9,26 @@ class GarminDBConfig(object):
     """Class that encapsilates config data for the application."""
 
     db = {
-        'type'                  : 'sqlite'
+        'type'                  : 'sqlite',
+        # The SQLite performance profile, one of safe, query, or import. The import profile is used while importing and analyzing.
+        'sqlite_profile'        : 'query',
+        # Store the timestamps of the high volume SQLite tables as integer seconds since the epoch. Existing databases have to be
+        # converted with garmin.py --migrate-timestamps after changing this.
+        'epoch_timestamps'      : False,
+        # Store the records of newly imported FIT activities as one row of compressed arrays per activity instead of a row per
+        # record. The arrays keep the values to the sensors' resolution.
+        'record_streams'        : False,
+        # Store the monitoring data of each year in its own SQLite file, garmin_monitoring_<year>.db. Existing monitoring data has
+        # to be reimported, with make rebuild_mon_db, after changing this.
+        'monitoring_year_files' : False,
+        # The MySQL connection pool. Pre-ping checks pooled connections before they're used, recycle replaces connections older
+        # than that many seconds.
+        'mysql_pool_size'       : 5,
+        'mysql_max_overflow'    : 5,
+        'mysql_pool_pre_ping'   : True,
+        'mysql_pool_recycle'    : 3600,
+        # Update the SQLite query planner statistics after an import that wrote data for at least this many days.
+        'analyze_after_days'    : 30
     }
     directories = {
         'relative_to_home'      : True,
@@ -23,7 +42,8 @@ class GarminDBConfig(object):
         'activities_file_dir'   : 'Activities',
         'monitoring_file_dir'   : 'Monitoring',
         'weight_files_dir'      : 'Weight',
-        'rhr_files_dir'         : 'RHR'
+        'rhr_files_dir'         : 'RHR',
+        'export_dir'            : 'Export'
     }
     config = {
         'metric'                : False
@@ -33,7 +53,8 @@ class GarminDBConfig(object):
         'activities'            : 'activity',
         'monitoring'            : 'monitor',
         'sleep'                 : 'sleep',
-        'settings'              : 'settings'
+        'settings'              : 'settings',
+        'device_xml'            : 'GarminDevice.xml'
     }
     graphs = {
         'size'                  : [12.0, 8.0],
@@ -38,6 +38,41 @@ def get_db_host():
     return GarminDBConfig.db['host']
 
 
+def get_mysql_pool_options():
+    """Return the configured MySQL connection pool size, overflow, pre-ping, and recycle time."""
+    return {
+        'db_pool_size'      : GarminDBConfig.db.get('mysql_pool_size', 5),
+        'db_max_overflow'   : GarminDBConfig.db.get('mysql_max_overflow', 5),
+        'db_pool_pre_ping'  : GarminDBConfig.db.get('mysql_pool_pre_ping', True),
+        'db_pool_recycle'   : GarminDBConfig.db.get('mysql_pool_recycle', 3600)
+    }
+
+
+def get_sqlite_profile():
+    """Return the configured SQLite performance profile."""
+    return GarminDBConfig.db.get('sqlite_profile', 'query')
+
+
+def get_epoch_timestamps():
+    """Return if the timestamps of the high volume tables are stored as epoch seconds."""
+    return GarminDBConfig.db.get('epoch_timestamps', False)
+
+
+def get_monitoring_year_files():
+    """Return if the monitoring data of each year is stored in its own SQLite file."""
+    return GarminDBConfig.db.get('monitoring_year_files', False)
+
+
+def get_record_streams():
+    """Return if the records of new activities are stored as one row of encoded arrays per activity."""
+    return GarminDBConfig.db.get('record_streams', False)
+
+
+def get_analyze_after_days():
+    """Return the number of days of imported data after which the SQLite query planner statistics are updated."""
+    return GarminDBConfig.db.get('analyze_after_days', 30)
+
+
 def _create_dir_if_needed(dir):
     if not os.path.exists(dir):
         os.makedirs(dir)
@@ -60,6 +95,16 @@ def get_fit_files_dir(test_dir=False):
     return get_base_dir(test_dir) + os.sep + GarminDBConfig.directories['fit_file_dir']
 
 
+def get_download_cache_file(test_dir=False):
+    """Return the file where validators for downloaded Garmin Connect data are stored."""
+    return _create_dir_if_needed(get_base_dir(test_dir)) + os.sep + 'download_cache.json'
+
+
+def get_copy_manifest_file(device_serial_number, test_dir=False):
+    """Return the file that records the files previously copied from the device with the given serial number."""
+    return _create_dir_if_needed(get_base_dir(test_dir)) + os.sep + f'copy_manifest_{device_serial_number}.json'
+
+
 def get_or_create_fit_files_dir(test_dir=False):
     """Return the configured directory of where the FIT files will be stored creating it if needed."""
     return _create_dir_if_needed(get_fit_files_dir(test_dir))
@@ -145,6 +190,16 @@ def get_or_create_mshealth_dir(test_dir=False):
     return _create_dir_if_needed(get_mshealth_dir(test_dir))
 
 
+def get_export_dir(test_dir=False):
+    """Return the configured directory of where exported data will be stored."""
+    return get_base_dir(test_dir) + os.sep + GarminDBConfig.directories['export_dir']
+
+
+def get_or_create_export_dir(test_dir=False):
+    """Return the configured directory of where exported data will be stored creating it if needed."""
+    return _create_dir_if_needed(get_export_dir(test_dir))
+
+
 def get_db_dir(test_db=False):
     """Return the configured directory of where the database will be stored."""
     if test_db:
@@ -158,15 +213,19 @@ def get_db_params(test_db=False):
     """Return the database configuration."""
     db_type = get_db_type()
     db_params = {
-        'db_type' : db_type
+        'db_type'           : db_type,
+        'record_streams'    : get_record_streams()
     }
     if db_type == 'sqlite':
         db_params['db_path'] = get_db_dir(test_db)
+        db_params['epoch_timestamps'] = get_epoch_timestamps()
+        db_params['monitoring_year_files'] = get_monitoring_year_files()
     elif db_type == "mysql":
         db_params['db_type'] = 'mysql'
         db_params['db_username'] = get_db_user()
         db_params['db_password'] = get_db_password()
         db_params['db_host'] = get_db_host()
+        db_params.update(get_mysql_pool_options())
     return DbParams(**db_params)
 
 
@@ -175,6 +234,11 @@ def get_metric():
     return GarminDBConfig.config['metric']
 
 
+def device_xml_file(mount_dir):
+    """Return the full path to the device description file on a mounted device."""
+    return mount_dir + os.sep + GarminDBConfig.device_directories['base'] + os.sep + GarminDBConfig.device_directories['device_xml']
+
+
 def device_settings_dir(mount_dir):
     """Return the full path to the settings file on a mounted device."""
     return mount_dir + os.sep + GarminDBConfig.device_directories['base'] + os.sep + GarminDBConfig.device_directories['settings']
@@ -225,10 +225,14 @@ class Graph(object):
         if date is None:
             date = (datetime.datetime.now() - datetime.timedelta(days=1)).date()
         db_params = GarminDBConfigManager.get_db_params()
-        mon_db = GarminDB.MonitoringDB(db_params, self.debug)
         start_ts = datetime.datetime.combine(date, datetime.datetime.min.time())
         end_ts = datetime.datetime.combine(date, datetime.datetime.max.time())
-        hr_data = GarminDB.MonitoringHeartRate.get_for_period(mon_db, start_ts, end_ts, GarminDB.MonitoringHeartRate)
+        mon_db = GarminDB.MonitoringYears(db_params, self.debug).for_period(start_ts, end_ts)
+        if mon_db is None:
+            logger.info("No monitoring data for %s", date)
+            return
+        # heart rate is sampled more often during activities, graph the average of each minute
+        hr = GarminDB.TimeSeries.get(mon_db, GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts).resample(60)
         data = GarminDB.Monitoring.get_for_period(mon_db, start_ts, end_ts, GarminDB.Monitoring)
         over_data_dict = [
             {
@@ -238,8 +242,8 @@ class Graph(object):
             },
             {
                 'label'     : 'Heart Rate',
-                'time'      : [entry.timestamp for entry in hr_data],
-                'data'      : [entry.heart_rate for entry in hr_data],
+                'time'      : hr.datetimes(),
+                'data'      : hr.values,
                 'limits'    : (30, 220)
             }
         ]
@@ -12,6 +12,7 @@ import enum
 import dateutil.parser
 
 import Fit
+import HealthDB
 import GarminDB
 from utilities import JsonFileProcessor
 from fit_data import FitData
@@ -41,7 +42,7 @@ class GarminWeightData(JsonFileProcessor):
         logger.info("Processing weight data")
         super().__init__(r'weight_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
         self.measurement_system = measurement_system
-        self.garmin_db = GarminDB.GarminDB(db_params)
+        self.garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params)
         self.conversions = {'startDate': dateutil.parser.parse}
 
     def _process_json(self, json_data):
@@ -60,7 +61,7 @@ class GarminWeightData(JsonFileProcessor):
 class GarminMonitoringFitData(FitData):
     """Class for importing monitoring FIT files into a database."""
 
-    def __init__(self, input_dir, latest, measurement_system, debug):
+    def __init__(self, input_dir, latest, measurement_system, debug, file_names=None):
         """
         Return an instance of GarminMonitoringFitData.
 
@@ -70,15 +71,16 @@ class GarminMonitoringFitData(FitData):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        file_names (list): import these files instead of searching input_dir
 
         """
-        super().__init__(input_dir, debug, latest, True, [Fit.FileType.monitoring_b], measurement_system)
+        super().__init__(input_dir, debug, latest, True, [Fit.FileType.monitoring_b], measurement_system, file_names)
 
 
 class GarminSettingsFitData(FitData):
     """Class for importing settings FIT files into a database."""
 
-    def __init__(self, input_dir, debug):
+    def __init__(self, input_dir, debug, file_names=None):
         """
         Return an instance of GarminSettingsFitData.
 
@@ -86,9 +88,10 @@ class GarminSettingsFitData(FitData):
         ----------
         input_dir (string): directory (full path) to check for settings data files
         debug (Boolean): enable debug logging
+        file_names (list): import these files instead of searching input_dir
 
         """
-        super().__init__(input_dir, debug, fit_types=[Fit.FileType.settings])
+        super().__init__(input_dir, debug, fit_types=[Fit.FileType.settings], file_names=file_names)
 
 
 class SleepActivityLevels(enum.Enum):
@@ -127,7 +130,7 @@ class GarminSleepData(JsonFileProcessor):
         """
         logger.info("Processing sleep data")
         super().__init__(r'sleep_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
-        self.garmin_db = GarminDB.GarminDB(db_params)
+        self.garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params)
         self.conversions = {
             'calendarDate'              : dateutil.parser.parse,
             'sleepTimeSeconds'          : Fit.conversions.secs_to_dt_time,
@@ -200,7 +203,7 @@ class GarminRhrData(JsonFileProcessor):
         """
         logger.info("Processing rhr data")
         super().__init__(r'rhr_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
-        self.garmin_db = GarminDB.GarminDB(db_params)
+        self.garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params)
         self.conversions = {'statisticsStartDate': dateutil.parser.parse}
 
     def _process_json(self, json_data):
@@ -233,7 +236,7 @@ class GarminProfile(JsonFileProcessor):
         """
         logger.info("Processing profile data")
         super().__init__(r'profile\.json', input_dir=input_dir, latest=False, debug=debug)
-        self.garmin_db = GarminDB.GarminDB(db_params)
+        self.garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params)
         self.conversions = {'calendarDate' : dateutil.parser.parse}
 
     def _process_json(self, json_data):
@@ -269,7 +272,7 @@ class GarminSummaryData(JsonFileProcessor):
         super().__init__(r'daily_summary_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True)
         self.input_dir = input_dir
         self.measurement_system = measurement_system
-        self.garmin_db = GarminDB.GarminDB(db_params)
+        self.garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params)
         self.conversions = {
             'calendarDate'              : dateutil.parser.parse,
             'moderateIntensityMinutes'  : Fit.conversions.min_to_dt_time,
@@ -331,7 +334,7 @@ class GarminHydrationData(JsonFileProcessor):
         super().__init__(r'hydration_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True)
         self.input_dir = input_dir
         self.measurement_system = measurement_system
-        self.garmin_db = GarminDB.GarminDB(db_params)
+        self.garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params)
         self.conversions = {
             'calendarDate': dateutil.parser.parse
         }
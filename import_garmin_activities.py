@@ -11,6 +11,7 @@ from tqdm import tqdm
 import dateutil.parser
 
 import Fit
+import HealthDB
 import GarminDB
 from utilities import FileProcessor, JsonFileProcessor
 import garmin_connect_enums as GarminConnectEnums
@@ -26,7 +27,7 @@ root_logger = logging.getLogger()
 class GarminActivitiesFitData(FitData):
     """Class for importing Garmin activity data from FIT files."""
 
-    def __init__(self, input_dir, latest, measurement_system, debug):
+    def __init__(self, input_dir, latest, measurement_system, debug, file_names=None):
         """
         Return an instance of GarminActivitiesFitData.
 
@@ -37,9 +38,10 @@ class GarminActivitiesFitData(FitData):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        file_names (list): import these files instead of searching input_dir
 
         """
-        super().__init__(input_dir, debug, latest, False, [Fit.FileType.activity], measurement_system)
+        super().__init__(input_dir, debug, latest, False, [Fit.FileType.activity], measurement_system, file_names)
 
 
 class GarminTcxData(object):
@@ -157,8 +159,8 @@ class GarminTcxData(object):
 
     def process_files(self, db_params):
         """Import data from TCX files into the database."""
-        garmin_db = GarminDB.GarminDB(db_params, self.debug - 1)
-        garmin_act_db = GarminDB.ActivitiesDB(db_params, self.debug - 1)
+        garmin_db = HealthDB.DbRegistry.get(GarminDB.GarminDB, db_params, self.debug - 1)
+        garmin_act_db = HealthDB.DbRegistry.get(GarminDB.ActivitiesDB, db_params, self.debug - 1)
         with garmin_db.managed_session() as self.garmin_db_session, garmin_act_db.managed_session() as self.garmin_act_db_session:
             for file_name in tqdm(self.file_names, unit='files'):
                 try:
@@ -189,7 +191,7 @@ class GarminJsonSummaryData(JsonFileProcessor):
         super().__init__(r'activity_\d*\.json', input_dir=input_dir, latest=latest, debug=debug)
         self.input_dir = input_dir
         self.measurement_system = measurement_system
-        self.garmin_act_db = GarminDB.ActivitiesDB(db_params, self.debug - 1)
+        self.garmin_act_db = HealthDB.DbRegistry.get(GarminDB.ActivitiesDB, db_params, self.debug - 1)
         self.conversions = {}
 
     def _commit(self):
@@ -361,7 +363,7 @@ class GarminJsonDetailsData(JsonFileProcessor):
         logger.info("Processing activities detail data")
         super().__init__(r'activity_details_\d*\.json', input_dir=input_dir, latest=latest, debug=debug)
         self.measurement_system = measurement_system
-        self.garmin_act_db = GarminDB.ActivitiesDB(db_params, self.debug - 1)
+        self.garmin_act_db = HealthDB.DbRegistry.get(GarminDB.ActivitiesDB, db_params, self.debug - 1)
         self.conversions = {}
 
     def _commit(self):
@@ -7,12 +7,15 @@ __license__ = "GPL"
 
 import unittest
 import logging
+import tempfile
+import pyarrow.parquet as pq
 
 from test_db_base import TestDBBase
 import GarminDB
 import Fit
 from import_garmin_activities import GarminActivitiesFitData, GarminTcxData, GarminJsonSummaryData, GarminJsonDetailsData
 import garmin_db_config_manager as GarminDBConfigManager
+from export_parquet import ParquetExporter
 
 
 root_logger = logging.getLogger()
@@ -54,6 +57,50 @@ class TestActivitiesDb(TestDBBase, unittest.TestCase):
         self.assertGreater(GarminDB.CycleActivities.row_count(self.garmin_act_db), 0)
         self.assertGreater(GarminDB.EllipticalActivities.row_count(self.garmin_act_db), 0)
 
+    def test_garmin_act_db_queries_use_indexes(self):
+        index_queries = {
+            'ix_activities_start_time'                  : "SELECT * FROM activities WHERE start_time >= '2020-01-01' AND start_time < '2020-02-01'",
+            'ix_activities_course_id'                   : "SELECT * FROM activities WHERE course_id = 1 ORDER BY start_time",
+            'ix_activities_sport'                       : "SELECT sport, COUNT(*) FROM activities GROUP BY sport",
+            'ix_activity_records_activity_id_timestamp' : "SELECT * FROM activity_records WHERE activity_id = '1' AND timestamp >= '2020-01-01' AND timestamp < '2020-01-02'",
+        }
+        self.check_queries_use_indexes(self.garmin_act_db, index_queries)
+
+    def test_activity_record_streams_match_records(self):
+        with self.garmin_act_db.managed_session() as session:
+            activity_id = session.query(GarminDB.ActivityRecords.activity_id).limit(1).scalar()
+            records = GarminDB.ActivityRecords.s_get_activity(session, activity_id)
+        record_dicts = [{field: getattr(record, field) for field in GarminDB.ActivityRecordStreams.stream_decimals} for record in records]
+        with self.test_act_db.managed_session() as session:
+            GarminDB.ActivityRecordStreams.s_insert_or_replace(session, activity_id, record_dicts)
+        with self.test_act_db.managed_session() as session:
+            stream_records = GarminDB.ActivityRecordStreams.s_get_records(session, activity_id)
+        self.assertEqual(len(stream_records), len(records))
+        for record, stream_record in zip(records, stream_records):
+            for field, decimals in GarminDB.ActivityRecordStreams.stream_decimals.items():
+                value = getattr(record, field)
+                if field == 'timestamp' or value is None:
+                    self.assertEqual(getattr(stream_record, field), value.replace(microsecond=0) if value is not None else None)
+                else:
+                    self.assertAlmostEqual(getattr(stream_record, field), value, places=decimals - 1)
+
+    def test_parquet_export_of_record_streams(self):
+        with self.garmin_act_db.managed_session() as session:
+            activity = session.query(GarminDB.Activities).join(GarminDB.ActivityRecords, GarminDB.ActivityRecords.activity_id == GarminDB.Activities.activity_id).first()
+            records = GarminDB.ActivityRecords.s_get_activity(session, activity.activity_id)
+            (activity_id, start_time) = (activity.activity_id, activity.start_time)
+        record_dicts = [{field: getattr(record, field) for field in GarminDB.ActivityRecordStreams.stream_decimals} for record in records]
+        with self.test_act_db.managed_session() as session:
+            GarminDB.Activities.s_insert_or_update(session, {'activity_id': activity_id, 'start_time': start_time})
+            GarminDB.ActivityRecordStreams.s_insert_or_replace(session, activity_id, record_dicts)
+        with tempfile.TemporaryDirectory() as export_dir:
+            exporter = ParquetExporter(export_dir, self.test_db_params, 0)
+            exporter.export_record_streams_partition(self.test_act_db, start_time.year, start_time.month)
+            self.assertIn((start_time.year, start_time.month), exporter.exported_partitions(GarminDB.ActivityRecordStreams))
+            table = pq.read_table(export_dir + '/activity_record_streams')
+            self.assertEqual(table.column_names[:len(GarminDB.ActivityRecords.__table__.columns)], ParquetExporter.arrow_schema(GarminDB.ActivityRecords).names)
+            self.assertEqual(table.column('activity_id').to_pylist().count(activity_id), len(records))
+
     def check_activities_fields(self, fields_list):
         self.check_not_none_cols(self.test_act_db, {GarminDB.Activities : fields_list})
 
@@ -4,11 +4,13 @@ __author__ = "Tom Goetz"
 __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
+import os
 import unittest
 import logging
 import datetime
+import tempfile
 
-from copy_garmin import Copy
+from copy_garmin import Copy, CopyManifest
 import garmin_db_config_manager as GarminDBConfigManager
 from garmin_connect_config_manager import GarminConnectConfigManager
 
@@ -34,6 +36,11 @@ class TestCopy(unittest.TestCase):
         logger.info("Copying activities to %s", activities_dir)
         self.copy.copy_activities(activities_dir)
 
+    def test_copy_activity_incremental(self):
+        activities_dir = GarminDBConfigManager.get_or_create_activities_dir(test_dir=True)
+        self.copy.copy_activities(activities_dir)
+        self.assertEqual(self.copy.copy_activities(activities_dir), [])
+
     def test_copy_monitoring(self):
         monitoring_dir = GarminDBConfigManager.get_or_create_monitoring_dir(datetime.datetime.now().year, test_dir=True)
         logger.info("Copying monitoring to %s", monitoring_dir)
@@ -50,5 +57,27 @@ class TestCopy(unittest.TestCase):
         self.copy.copy_sleep(monitoring_dir)
 
 
+class TestCopyManifest(unittest.TestCase):
+    """Class for testing the manifest of copied files."""
+
+    def test_manifest_compares_hash_when_mtime_changes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src_file = os.path.join(temp_dir, 'src.fit')
+            dest_file = os.path.join(temp_dir, 'dest.fit')
+            for filename in [src_file, dest_file]:
+                with open(filename, 'wb') as file:
+                    file.write(b'0123456789')
+            manifest = CopyManifest(os.path.join(temp_dir, 'manifest.json'))
+            manifest.update(src_file, dest_file, os.stat(src_file), CopyManifest.sha256(src_file))
+            self.assertTrue(manifest.unchanged(src_file, dest_file))
+            stat = os.stat(src_file)
+            os.utime(src_file, (stat.st_atime, stat.st_mtime + 3600))
+            self.assertTrue(manifest.unchanged(src_file, dest_file))
+            with open(src_file, 'wb') as file:
+                file.write(b'9876543210')
+            os.utime(src_file, (stat.st_atime, stat.st_mtime + 7200))
+            self.assertFalse(manifest.unchanged(src_file, dest_file))
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
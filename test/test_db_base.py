@@ -38,6 +38,15 @@ class TestDBBase(object):
             logger.info("Checking %s exists", table_name)
             self.assertGreaterEqual(table.row_count(db), min_rows, 'table %s has no data' % table_name)
 
+    def check_queries_use_indexes(self, db, index_queries):
+        if db.db_params.db_type != 'sqlite':
+            return
+        with db.managed_session() as session:
+            for index_name, query in index_queries.items():
+                plan = ' '.join(row[-1] for row in session.execute('EXPLAIN QUERY PLAN ' + query).fetchall())
+                logger.info("%s: %s", query, plan)
+                self.assertIn(index_name, plan, f'query {query} does not use index {index_name}')
+
     def test_db_exists(self):
         logger.info("Checking DB %s exists", self.db.db_name)
         self.assertIsNotNone(self.db, 'DB %s doesnt exist' % self.db.db_name)
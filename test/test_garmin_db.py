@@ -7,8 +7,10 @@ __license__ = "GPL"
 import unittest
 import logging
 import datetime
+from sqlalchemy import inspect
 
 from test_db_base import TestDBBase
+import HealthDB
 import GarminDB
 import garmin_db_config_manager as GarminDBConfigManager
 
@@ -111,6 +113,72 @@ class TestGarminDb(TestDBBase, unittest.TestCase):
             (datetime.time(minute=10), datetime.time(6))    # latest
         )
 
+    def test_daily_summary_stats_match_col_stats(self):
+        end_ts = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        start_ts = end_ts - datetime.timedelta(30)
+        with self.garmindb.managed_session() as session:
+            stats = GarminDB.DailySummary.get_stats(session, start_ts, end_ts)
+            self.assertEqual(stats['rhr_avg'], GarminDB.DailySummary.s_get_col_avg(session, GarminDB.DailySummary.rhr, start_ts, end_ts))
+            self.assertEqual(stats['steps'], GarminDB.DailySummary.s_get_col_sum(session, GarminDB.DailySummary.steps, start_ts, end_ts))
+            self.assertEqual(stats['rr_min'], GarminDB.DailySummary.s_get_col_min(session, GarminDB.DailySummary.rr_min, start_ts, end_ts))
+            self.assertEqual(stats['intensity_time'], GarminDB.DailySummary.s_get_time_col_avg(session, GarminDB.DailySummary.intensity_time, start_ts, end_ts))
+
+    def test_daily_stats_for_period_match_daily_stats(self):
+        days = [datetime.date.today() - datetime.timedelta(days) for days in range(1, 8)]
+        with self.garmindb.managed_session() as session:
+            daily_stats = GarminDB.RestingHeartRate.get_daily_stats_for_period(session, days[-1], days[0] + datetime.timedelta(1), days=days)
+            for day in days:
+                self.assertEqual(daily_stats[day], GarminDB.RestingHeartRate.get_daily_stats(session, day))
+
+    def test_garmindb_queries_use_indexes(self):
+        self.check_queries_use_indexes(self.garmindb, {'ix_device_info_file_id' : "SELECT * FROM device_info WHERE file_id = '1'"})
+
+    def test_sqlite_profile_applied(self):
+        if self.garmindb.db_params.db_type != 'sqlite':
+            self.skipTest('SQLite profiles only apply to SQLite databases')
+        previous_profile = HealthDB.SqliteProfile.active
+        with self.garmindb.managed_session() as session:
+            previous_journal_mode = session.execute('PRAGMA journal_mode').scalar()
+        HealthDB.SqliteProfile.activate('import')
+        try:
+            with self.garmindb.managed_session() as session:
+                self.assertEqual(session.execute('PRAGMA cache_size').scalar(), HealthDB.SqliteProfile.profiles['import']['cache_size'])
+                self.assertEqual(session.execute('PRAGMA journal_mode').scalar(), 'wal')
+        finally:
+            # the journal mode is stored in the database file and outlasts the profile
+            HealthDB.SqliteProfile.activate(previous_profile)
+            with self.garmindb.managed_session() as session:
+                session.execute(f'PRAGMA journal_mode = {previous_journal_mode}')
+
+    def test_sqlite_maintenance_report(self):
+        if self.garmindb.db_params.db_type != 'sqlite':
+            self.skipTest('maintenance is only done for SQLite databases')
+        self.assertEqual(HealthDB.SqliteMaintenance.integrity_check(self.garmindb), [])
+        table_sizes = {table['table']: table for table in HealthDB.SqliteMaintenance.table_sizes(self.garmindb)}
+        self.assertEqual(table_sizes['stress']['rows'], GarminDB.Stress.row_count(self.garmindb))
+        self.assertGreater(table_sizes['device_info']['index_bytes'], 0)
+        self.assertGreaterEqual(HealthDB.SqliteMaintenance.file_size(self.garmindb), sum(table['table_bytes'] + table['index_bytes'] for table in table_sizes.values()))
+
+    def test_view_definitions_only_created_when_changed(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        HealthDB.ViewDefinitions.defer()
+        try:
+            GarminDB.GarminDB(db_params)
+            self.assertGreater(len(HealthDB.ViewDefinitions.pending_views()), 0)
+            HealthDB.ViewDefinitions.create_pending()
+            garmin_db = GarminDB.GarminDB(db_params)
+            self.assertEqual(HealthDB.ViewDefinitions.create_pending(), 0)
+            # deleting a view is deferred too, and reopening the database recreates it
+            view_name = GarminDB.DeviceInfo._get_default_view_name()
+            GarminDB.DeviceInfo.delete_view(garmin_db)
+            self.assertIn(view_name, inspect(garmin_db.engine).get_view_names())
+            HealthDB.ViewDefinitions.create_pending()
+            self.assertNotIn(view_name, inspect(garmin_db.engine).get_view_names())
+            GarminDB.GarminDB(db_params)
+            self.assertEqual(HealthDB.ViewDefinitions.create_pending(), 1)
+        finally:
+            HealthDB.ViewDefinitions.defer(False)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
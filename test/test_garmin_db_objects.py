@@ -6,6 +6,7 @@ __license__ = "GPL"
 
 import unittest
 import logging
+import datetime
 from sqlalchemy.exc import IntegrityError
 
 import GarminDB
@@ -66,6 +67,18 @@ class TestGarminDbObjects(unittest.TestCase):
         file_types_list = list(GarminDB.File.FileType)
         self.assertIn(GarminDB.File.FileType.convert(Fit.FileType.goals), file_types_list)
 
+    def test_dirty_days_tracker(self):
+        garmindb = GarminDB.GarminDB(self.db_params)
+        garmin_sum_db = GarminDB.GarminSummaryDB(self.db_params)
+        day = datetime.date(2019, 1, 2)
+        GarminDB.DirtyDays.clear_period(garmin_sum_db, datetime.date.min, datetime.date.max)
+        tracker = GarminDB.DirtyDaysTracker([GarminDB.Weight])
+        GarminDB.Weight.insert_or_update(garmindb, {'day': day, 'weight': 150.0})
+        tracker.save(self.db_params)
+        self.assertEqual(GarminDB.DirtyDays.get_days(garmin_sum_db), [day])
+        GarminDB.DirtyDays.clear_period(garmin_sum_db, day, day + datetime.timedelta(1))
+        self.assertEqual(GarminDB.DirtyDays.get_days(garmin_sum_db), [])
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -5,12 +5,18 @@ __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
 
+import os
 import unittest
 import logging
+import datetime
+import hashlib
+from sqlalchemy import select, func
 
 from test_summary_db_base import TestSummaryDBBase
+import HealthDB
 import GarminDB
 import garmin_db_config_manager as GarminDBConfigManager
+import garmin
 
 
 root_logger = logging.getLogger()
@@ -35,6 +41,78 @@ class TestGarminSummaryDB(TestSummaryDBBase, unittest.TestCase):
         }
         super().setUpClass(db, table_dict)
 
+    def test_days_rollup_matches_col_stats(self):
+        end_ts = datetime.date.today()
+        start_ts = end_ts - datetime.timedelta(28)
+        with self.db.managed_session() as session:
+            stats = GarminDB.DaysSummary.get_stats(session, start_ts, end_ts)
+            self.assertEqual(stats['steps'], GarminDB.DaysSummary.s_get_col_sum(session, GarminDB.DaysSummary.steps, start_ts, end_ts))
+            self.assertEqual(stats['rhr_max'], GarminDB.DaysSummary.s_get_col_max(session, GarminDB.DaysSummary.rhr_max, start_ts, end_ts))
+            self.assertEqual(stats['weight_avg'], GarminDB.DaysSummary.s_get_col_avg(session, GarminDB.DaysSummary.weight_avg, start_ts, end_ts))
+
+    def test_attached_intensity_hr_rows_match_monitoring_hr(self):
+        garmin_mon_db = GarminDB.MonitoringDB(GarminDBConfigManager.get_db_params())
+        with HealthDB.AttachedDatabases(self.db, {'mon': garmin_mon_db}) as attached:
+            intensity_hr = attached.table(GarminDB.IntensityHR)
+            hr = attached.table(GarminDB.MonitoringHeartRate)
+            matched = attached.session.execute(
+                select([func.count()]).select_from(intensity_hr.join(hr, (hr.c.timestamp == intensity_hr.c.timestamp) & (hr.c.heart_rate == intensity_hr.c.heart_rate)))
+            ).scalar()
+            self.assertEqual(matched, attached.session.execute(select([func.count()]).select_from(intensity_hr)).scalar())
+
+    def test_attached_intensity_hr_select_matches_series(self):
+        garmin_mon_db = GarminDB.MonitoringDB(GarminDBConfigManager.get_db_params())
+        end_ts = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        start_ts = end_ts - datetime.timedelta(28)
+        days = [start_ts.date() + datetime.timedelta(day) for day in range(28)]
+        with garmin_mon_db.managed_session() as garmin_mon_session:
+            intensity = GarminDB.TimeSeries.s_get(garmin_mon_session, GarminDB.Monitoring, GarminDB.Monitoring.intensity, start_ts, end_ts)
+            hr = GarminDB.TimeSeries.s_get(garmin_mon_session, GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts)
+            entries = GarminDB.IntensityHR.entries_from_series(intensity, hr, days)
+        with HealthDB.AttachedDatabases(self.db, {'mon': garmin_mon_db}) as attached:
+            query = GarminDB.IntensityHR.select_from_tables(attached.table(GarminDB.Monitoring), attached.table(GarminDB.MonitoringHeartRate), start_ts, end_ts, days)
+            rows = [dict(row) for row in attached.session.execute(query)]
+        self.assertEqual(sorted(rows, key=lambda row: row['timestamp']), sorted(entries, key=lambda entry: entry['timestamp']))
+
+    def test_attached_daily_stats_match_per_table_stats(self):
+        db_params = GarminDBConfigManager.get_db_params()
+        garmin_db = GarminDB.GarminDB(db_params)
+        garmin_mon_db = GarminDB.MonitoringDB(db_params)
+        garmin_act_db = GarminDB.ActivitiesDB(db_params)
+        end_ts = datetime.date.today()
+        start_ts = end_ts - datetime.timedelta(28)
+        days = [start_ts + datetime.timedelta(day) for day in range(28)]
+        with garmin_db.managed_session() as garmin_session, garmin_mon_db.managed_session() as garmin_mon_session, \
+                garmin_act_db.managed_session() as garmin_act_session:
+            tables = [
+                (GarminDB.DailySummary,         garmin_session),
+                (GarminDB.MonitoringClimb,      garmin_mon_session, GarminDB.Attributes.measurements_type(garmin_db)),
+                (GarminDB.MonitoringHeartRate,  garmin_mon_session),
+                (GarminDB.Activities,           garmin_act_session),
+            ]
+            with HealthDB.AttachedDatabases(self.db, {'garmin': garmin_db, 'mon': garmin_mon_db, 'act': garmin_act_db}) as attached:
+                attached_daily_stats = GarminDB.get_daily_stats_for_tables(attached, tables, start_ts, end_ts, days)
+            for (table, session, *args), table_daily_stats in zip(tables, attached_daily_stats):
+                self.assertEqual(table_daily_stats, table.get_daily_stats_for_period(session, start_ts, end_ts, *args, days=days), table.__name__)
+
+    @unittest.skipIf(GarminDBConfigManager.get_db_type() != 'sqlite', 'compares the SQLite database files')
+    def test_analyze_dry_run_leaves_dbs_unchanged(self):
+        db_dir = GarminDBConfigManager.get_db_dir()
+
+        def db_files_hashes():
+            # WAL and shared memory files come and go with connections, only the database files are compared
+            hashes = {}
+            for name in [name for name in os.listdir(db_dir) if name.endswith('.db')]:
+                with open(os.path.join(db_dir, name), 'rb') as file:
+                    hashes[name] = hashlib.sha256(file.read()).hexdigest()
+            return hashes
+
+        HealthDB.DbRegistry.clear()
+        db_files = db_files_hashes()
+        garmin.main(['--analyze', '--dry-run'])
+        HealthDB.DbRegistry.clear()
+        self.assertEqual(db_files_hashes(), db_files)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -7,12 +7,17 @@ __license__ = "GPL"
 import unittest
 import logging
 import datetime
+import tempfile
+import contextlib
+import pyarrow.parquet as pq
 
 from test_db_base import TestDBBase
+import HealthDB
 import GarminDB
 import Fit
 import garmin_db_config_manager as GarminDBConfigManager
 from import_garmin import GarminMonitoringFitData, GarminSummaryData
+from export_parquet import ParquetExporter
 
 
 root_logger = logging.getLogger()
@@ -63,6 +68,113 @@ class TestMonitoringDB(TestDBBase, unittest.TestCase):
             logger.info("Latest data for %s: %s", table_name, latest)
             self.assertLess(datetime.datetime.now() - latest, datetime.timedelta(days=2))
 
+    def test_garmin_mon_db_coverage_matches_days(self):
+        with self.db.managed_session() as session:
+            for year, days_count, span, months in GarminDB.Monitoring.s_get_coverage_by_year(session):
+                days = GarminDB.Monitoring.s_get_days(session, year)
+                self.assertEqual(days_count, len(days))
+                self.assertEqual(span, days[-1] - days[0] + 1)
+                self.assertEqual(months, GarminDB.Monitoring.s_get_months(session, year))
+
+    def test_garmin_mon_db_queries_use_indexes(self):
+        index_queries = {
+            'ix_monitoring_timestamp_intensity' :
+                "SELECT timestamp, intensity FROM monitoring WHERE timestamp >= '2020-01-01' AND timestamp < '2020-02-01' AND intensity IS NOT NULL",
+        }
+        self.check_queries_use_indexes(self.garmin_mon_db, index_queries)
+
+    def test_garmin_mon_db_timestamp_storage(self):
+        for table in [GarminDB.MonitoringHeartRate, GarminDB.MonitoringIntensity, GarminDB.MonitoringClimb, GarminDB.Monitoring]:
+            self.assertEqual(table.stored_as_epoch(self.garmin_mon_db.engine), GarminDBConfigManager.get_epoch_timestamps())
+
+    def test_hr_hourly_rollup_matches_col_stats(self):
+        end_ts = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        start_ts = end_ts - datetime.timedelta(7)
+        GarminDB.MonitoringHeartRate.backfill_hourly_rollup(self.db)
+        with self.db.managed_session() as session:
+            self.assertTrue(GarminDB.MonitoringHeartRate.s_rollup_complete(session))
+            stats = GarminDB.MonitoringHeartRate.get_stats(session, start_ts, end_ts)
+            self.assertEqual(stats['hr_max'], GarminDB.MonitoringHeartRate.s_get_col_max(session, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts))
+            self.assertEqual(stats['hr_min'], GarminDB.MonitoringHeartRate.s_get_col_min(session, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts, True))
+            self.assertAlmostEqual(stats['hr_avg'], GarminDB.MonitoringHeartRate.s_get_col_avg(session, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts, True))
+
+    def test_hr_time_series_matches_col_stats(self):
+        end_ts = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        start_ts = end_ts - datetime.timedelta(7)
+        with self.db.managed_session() as session:
+            hr = GarminDB.TimeSeries.s_get(session, GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts)
+            self.assertEqual(len(hr), GarminDB.MonitoringHeartRate.s_row_count_for_period(session, start_ts, end_ts))
+            for day, hr_max in hr.max_per_day().items():
+                day_ts = datetime.datetime.combine(day, datetime.time.min)
+                self.assertEqual(hr_max, GarminDB.MonitoringHeartRate.s_get_col_max(session, GarminDB.MonitoringHeartRate.heart_rate, day_ts, day_ts + datetime.timedelta(1)))
+            if len(hr):
+                self.assertEqual(hr.percentile(100), max(hr.max_per_day().values()))
+
+    def test_time_series_statistics(self):
+        end_ts = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        start_ts = end_ts - datetime.timedelta(7)
+        with self.db.managed_session() as session:
+            hr = GarminDB.TimeSeries.s_get(session, GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts)
+            for day, hr_min in hr.per_day('min').items():
+                day_ts = datetime.datetime.combine(day, datetime.time.min)
+                self.assertEqual(hr_min, GarminDB.MonitoringHeartRate.s_get_col_min(session, GarminDB.MonitoringHeartRate.heart_rate, day_ts, day_ts + datetime.timedelta(1)))
+            self.assertEqual(len(hr.between(start_ts, end_ts)), len(hr))
+            if len(hr):
+                self.assertEqual(hr.rolling_min(1).values.tolist(), hr.values.tolist())
+                self.assertEqual(hr.rolling_min(len(hr)).values.tolist(), [hr.values.min()])
+                self.assertAlmostEqual(hr.rolling_mean(len(hr)).values[0], hr.values.mean())
+                self.assertAlmostEqual(sum(hr.resample(3600, 'sum').values), sum(hr.values))
+            steps = GarminDB.TimeSeries.s_get(session, GarminDB.Monitoring, GarminDB.Monitoring.steps, start_ts, end_ts)
+            spec = {'steps' : GarminDB.AggregateStat.sum_of_max_per_day(GarminDB.Monitoring.steps)}
+            self.assertEqual(steps.sum_of_max_per_day(), GarminDB.Monitoring.s_get_aggregate_stats(session, spec, start_ts, end_ts)['steps'] or 0)
+
+    def test_parquet_export_matches_table(self):
+        with tempfile.TemporaryDirectory() as export_dir:
+            exporter = ParquetExporter(export_dir, GarminDBConfigManager.get_db_params(), 0)
+            exporter.export_table(self.garmin_mon_db, GarminDB.MonitoringHeartRate)
+            self.assertEqual(pq.read_table(export_dir + '/monitoring_hr').num_rows, GarminDB.MonitoringHeartRate.row_count(self.garmin_mon_db))
+            self.assertEqual(len(exporter.exported_partitions(GarminDB.MonitoringHeartRate)), len(
+                [(year, month) for year in GarminDB.MonitoringHeartRate.get_years(self.garmin_mon_db)
+                 for month in GarminDB.MonitoringHeartRate.get_months(self.garmin_mon_db, year)]))
+
+    @unittest.skipIf(GarminDBConfigManager.get_db_type() != 'mysql', 'rows are only batched when writing to MySQL')
+    def test_bulk_writer_matches_insert_or_update(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        test_mon_db = GarminDB.MonitoringDB(db_params)
+        start_ts = datetime.datetime(1990, 1, 1)
+        timestamps = [start_ts + datetime.timedelta(minutes=minute) for minute in range(10)]
+        walking = Fit.field_enums.ActivityType.walking
+        with test_mon_db.managed_session() as session:
+            for index, timestamp in enumerate(timestamps):
+                HealthDB.BulkWriter.s_insert_or_update(session, GarminDB.Monitoring, {'timestamp': timestamp, 'activity_type': walking, 'steps': index})
+        with test_mon_db.managed_session() as session:
+            # columns a row has no value for keep their existing values
+            HealthDB.BulkWriter.s_insert_or_update(session, GarminDB.Monitoring, {'timestamp': timestamps[0], 'activity_type': walking, 'steps': None, 'active_calories': 10})
+        with test_mon_db.managed_session() as session:
+            rows = session.query(GarminDB.Monitoring).filter(GarminDB.Monitoring.timestamp >= start_ts).filter(GarminDB.Monitoring.timestamp <= timestamps[-1]).all()
+            self.assertEqual([row.steps for row in rows], list(range(len(timestamps))))
+            self.assertEqual(rows[0].active_calories, 10)
+            session.query(GarminDB.Monitoring).filter(GarminDB.Monitoring.timestamp >= start_ts).filter(GarminDB.Monitoring.timestamp <= timestamps[-1]).delete()
+
+    @unittest.skipIf(GarminDBConfigManager.get_db_type() != 'mysql', 'rows are only batched when writing to MySQL')
+    def test_bulk_writer_updates_hourly_rollup(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        test_mon_db = GarminDB.MonitoringDB(db_params)
+        start_ts = datetime.datetime(1990, 1, 1)
+        end_ts = start_ts + datetime.timedelta(hours=1)
+        heart_rates = [60 + minute for minute in range(10)]
+        hr_table = GarminDB.MonitoringHeartRate
+        rollup_table = GarminDB.MonitoringHeartRateHourly
+        with test_mon_db.managed_session() as session:
+            for minute, heart_rate in enumerate(heart_rates):
+                HealthDB.BulkWriter.s_insert_or_update(session, hr_table, {'timestamp': start_ts + datetime.timedelta(minutes=minute), 'heart_rate': heart_rate})
+        with test_mon_db.managed_session() as session:
+            self.assertEqual(hr_table.s_row_count_for_period(session, start_ts, end_ts), len(heart_rates))
+            rollup = session.query(rollup_table).filter(rollup_table.hour == start_ts).one()
+            self.assertEqual((rollup.samples, rollup.total, rollup.minimum, rollup.maximum), (len(heart_rates), sum(heart_rates), min(heart_rates), max(heart_rates)))
+            session.query(hr_table).filter(hr_table.timestamp >= start_ts).filter(hr_table.timestamp < end_ts).delete()
+            session.query(rollup_table).filter(rollup_table.hour == start_ts).delete()
+
     def fit_file_import(self, db_params):
         gfd = GarminMonitoringFitData('test_files/fit/monitoring', latest=False, measurement_system=Fit.field_enums.DisplayMeasure.statute, debug=2)
         self.gfd_file_count = gfd.file_count()
@@ -78,6 +190,57 @@ class TestMonitoringDB(TestDBBase, unittest.TestCase):
         table_not_none_cols_dict = {GarminDB.Monitoring : [GarminDB.Monitoring.timestamp, GarminDB.Monitoring.activity_type, GarminDB.Monitoring.duration]}
         self.check_not_none_cols(GarminDB.MonitoringDB(db_params), table_not_none_cols_dict)
 
+    @contextlib.contextmanager
+    def year_files_import(self):
+        db_params = GarminDBConfigManager.get_db_params(test_db=True)
+        db_params.monitoring_year_files = True
+        # import into databases of its own, the shared test databases are used by the other tests
+        with tempfile.TemporaryDirectory() as db_dir:
+            db_params.db_path = db_dir
+            try:
+                self.fit_file_import(db_params)
+                yield GarminDB.MonitoringYears(db_params)
+            finally:
+                # close the shared databases before their files are deleted
+                HealthDB.DbRegistry.clear()
+
+    @unittest.skipIf(GarminDBConfigManager.get_db_type() != 'sqlite', 'per year files are only used with SQLite')
+    def test_fit_file_import_year_files(self):
+        with self.year_files_import() as monitoring_years:
+            years = monitoring_years.years()
+            for year in years:
+                with monitoring_years.db(year).managed_session() as session:
+                    (first_ts, last_ts) = GarminDB.Monitoring.s_get_time_span(session)
+                if first_ts is not None:
+                    self.assertEqual((first_ts.year, last_ts.year), (year, year))
+            if years:
+                with monitoring_years.for_period(datetime.date(years[0], 1, 1), datetime.date(years[-1] + 1, 1, 1)).managed_session() as session:
+                    self.assertEqual(session.query(GarminDB.Monitoring).count(), monitoring_years.row_count(GarminDB.Monitoring))
+            # reading a year without data doesn't create its database
+            self.assertIsNone(monitoring_years.db(1999))
+            self.assertIsNone(monitoring_years.for_period(datetime.date(1999, 1, 1), datetime.date(2000, 1, 1)))
+            self.assertEqual(monitoring_years.years(), years)
+
+    @unittest.skipIf(GarminDBConfigManager.get_db_type() != 'sqlite', 'per year files are only used with SQLite')
+    def test_time_series_of_year_files_union(self):
+        with self.year_files_import() as monitoring_years:
+            years = monitoring_years.years()
+            if not years:
+                return
+            start_ts = datetime.datetime(years[0], 1, 1)
+            end_ts = datetime.datetime(years[-1] + 1, 1, 1)
+            # the union's session is bound to a connection to the first year's database, its series must be cached separately
+            first_year_hr = GarminDB.TimeSeries.get(monitoring_years.db(years[0]), GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts)
+            union_db = GarminDB.MonitoringUnionDB({year: monitoring_years.db(year) for year in years})
+            hr = GarminDB.TimeSeries.get(union_db, GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts)
+            self.assertEqual(len(hr), monitoring_years.row_count(GarminDB.MonitoringHeartRate))
+            self.assertEqual(len(first_year_hr), GarminDB.MonitoringHeartRate.row_count(monitoring_years.db(years[0])))
+            # writing to the last year clears the union's series
+            with monitoring_years.db(years[-1]).managed_session() as session:
+                session.add(GarminDB.MonitoringHeartRate(timestamp=datetime.datetime(years[-1], 12, 31, 23, 59, 59), heart_rate=60))
+            hr = GarminDB.TimeSeries.get(union_db, GarminDB.MonitoringHeartRate, GarminDB.MonitoringHeartRate.heart_rate, start_ts, end_ts)
+            self.assertEqual(len(hr), monitoring_years.row_count(GarminDB.MonitoringHeartRate))
+
     def test_summary_json_file_import(self):
         db_params = GarminDBConfigManager.get_db_params(test_db=True)
         gjsd = GarminSummaryData(db_params, 'test_files/json/monitoring/summary', latest=False, measurement_system=Fit.field_enums.DisplayMeasure.statute, debug=2)
@@ -6,6 +6,7 @@ __license__ = "GPL"
 
 import unittest
 import logging
+from sqlalchemy.pool import QueuePool
 
 from test_summary_db_base import TestSummaryDBBase
 import HealthDB
@@ -34,6 +35,18 @@ class TestSummaryDB(TestSummaryDBBase, unittest.TestCase):
         }
         super().setUpClass(db, table_dict)
 
+    def test_db_registry_shares_db(self):
+        db = HealthDB.DbRegistry.get(HealthDB.SummaryDB, GarminDBConfigManager.get_db_params())
+        self.assertIs(db, HealthDB.DbRegistry.get(HealthDB.SummaryDB, GarminDBConfigManager.get_db_params()))
+        self.assertEqual(HealthDB.Summary.row_count(db), HealthDB.Summary.row_count(self.db))
+
+    def test_db_registry_sessions_use_pooled_engine(self):
+        db = HealthDB.DbRegistry.get(HealthDB.SummaryDB, GarminDBConfigManager.get_db_params())
+        with db.managed_session() as session:
+            self.assertIs(session.get_bind(), db.engine)
+        if GarminDBConfigManager.get_db_type() == 'sqlite':
+            self.assertIsInstance(db.engine.pool, QueuePool)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)